@@ -37,8 +37,7 @@ from socket import getfqdn
 
 import numpy as np
 from gwpy.io.cache import read_cache
-from gwpy.segments import (Segment, SegmentList,
-                           DataQualityFlag, DataQualityDict)
+from gwpy.segments import (DataQualityFlag, DataQualityDict)
 from gwpy.table import EventTable
 
 from gwdetchar.utils import cli
@@ -49,8 +48,11 @@ from pytz import reference
 
 from hveto import (__version__, config, core, html, utils)
 from hveto.segments import (write_ascii as write_ascii_segments,
-                            read_veto_definer_file)
-from hveto.triggers import (get_triggers, find_auxiliary_channels)
+                            analysis_segments)
+from hveto.triggercache import (DEFAULT_TRIGGER_CACHE_SIZE, TriggerCache)
+from hveto.triggers import (EVENT_STORE_EXT, CacheCatalog, cluster_triggers,
+                            compact_table, expand_table, get_triggers,
+                            get_multichannel_triggers, find_auxiliary_channels)
 
 # set matplotlib backend
 from matplotlib import use
@@ -91,8 +93,9 @@ def _find_max_significance(channels):
     """Utility to find hveto maximum significance with multiprocessing
     """
     aux = dict((c, auxiliary[c]) for c in channels)
-    return core.find_max_significance(primary, aux, pchannel,
-                                      snrs, windows, livetime)
+    return core.find_max_significance(kprimary, aux, pchannel,
+                                      snrs, windows, rnd.livetime,
+                                      masks=masks, indexes=auxindex)
 
 
 def _get_aux_triggers(channel):
@@ -101,14 +104,14 @@ def _get_aux_triggers(channel):
     if acache is None:
         auxcache = None
     else:
-        ifo, name = channel.split(':')
-        match = "{}-{}".format(ifo, name.replace('-', '_'))
-        auxcache = [e for e in acache if Path(e).name.startswith(match)]
+        auxcache = acache.files(channel)
     # get triggers
     try:
         trigs = get_triggers(channel, auxetg, analysis.active, snr=minsnr,
                              frange=auxfreq, cache=auxcache, nproc=1,
-                             trigfind_kwargs=atrigfindkw, **areadkw)
+                             trigfind_kwargs=atrigfindkw,
+                             trigger_cache=tcache, compact=compact,
+                             **areadkw)
     # catch error and continue
     except ValueError as e:
         warnings.warn('%s: %s' % (type(e).__name__, str(e)))
@@ -132,11 +135,30 @@ def _get_aux_triggers(channel):
     return out
 
 
-def _veto(channels):
-    """Utility to apply vetoes with multiprocessing
+def _get_multichannel_aux_triggers(channels, nproc=1):
+    """Retrieve triggers for auxiliary channels stored in shared files
     """
-    chandict = dict((c, auxiliary[c]) for c in channels)
-    return core.veto_all(chandict, rnd.vetoes)
+    try:
+        tables = get_multichannel_triggers(
+            channels, auxetg, analysis.active, snr=minsnr, frange=auxfreq,
+            cache=acache, nproc=nproc, trigfind_kwargs=atrigfindkw,
+            trigger_cache=tcache, compact=compact, **areadkw)
+    except ValueError as e:
+        warnings.warn('%s: %s' % (type(e).__name__, str(e)))
+        LOGGER.critical("    Failed to read events for %d channels"
+                        % len(channels))
+        return []
+    out = []
+    for i, (channel, trigs) in enumerate(tables.items(), start=1):
+        tag = '[%d/%d]' % (i, naux)
+        if len(trigs):
+            LOGGER.debug("    %s Read %d events for %s"
+                         % (tag, len(trigs), channel))
+            out.append((channel, trigs))
+        else:
+            LOGGER.warning("    %s No events found for %s"
+                           % (tag, channel))
+    return out
 
 
 def create_parser():
@@ -191,6 +213,32 @@ def create_parser():
               'the analysis flag (name in data file '
               'must match analysis-flag in config file)'),
     )
+    parser.add_argument(
+        '--trigger-cache-dir',
+        default=os.getenv('HVETO_TRIGGER_CACHE'),
+        type=_abs_path,
+        help=('directory in which to cache the events read for each '
+              'channel, so that later analyses of the same (or fewer) '
+              'segments do not read the trigger files again, '
+              'default: %(default)s'),
+    )
+    parser.add_argument(
+        '--trigger-cache-size',
+        default=DEFAULT_TRIGGER_CACHE_SIZE / 2 ** 30,
+        type=float,
+        metavar='GB',
+        help=('maximum size of the --trigger-cache-dir, the least '
+              'recently used events are removed to stay within this '
+              'limit, default: %(default)s'),
+    )
+    parser.add_argument(
+        '--compact',
+        action='store_true',
+        default=False,
+        help=('hold events in memory with times as integer GPS '
+              'nanoseconds, and other columns in single precision, '
+              'roughly halving the memory needed for auxiliary events'),
+    )
     parser.add_argument(
         '-w',
         '--omega-scans',
@@ -282,9 +330,9 @@ def main(args=None):
     """
     # declare global variables
     # this is needed for multiprocessing utilities
-    global acache, analysis, areadkw, atrigfindkw, auxiliary, auxetg
-    global auxfreq, counter, livetime, minsnr, naux, pchannel, primary
-    global rnd, snrs, windows
+    global acache, analysis, areadkw, atrigfindkw, auxiliary, auxetg, auxindex
+    global auxfreq, compact, counter, kprimary, livetime, masks, minsnr
+    global naux, pchannel, rnd, snrs, tcache, windows
 
     # parse command-line
     parser = create_parser()
@@ -360,64 +408,13 @@ def main(args=None):
     LOGGER.info("Retrieving segments...")
     get_seg_start = datetime.datetime.now()
     aflag = cp.get('segments', 'analysis-flag')
-    url = cp.get('segments', 'url')
-    padding = tuple(cp.getfloats('segments', 'padding'))
-    if args.analysis_segments:
-        segs_ = DataQualityDict.read(args.analysis_segments, gpstype=float)
-        analysis = segs_[aflag]
-        span = SegmentList([Segment(start, end)])
-        analysis.active &= span
-        analysis.known &= span
-        analysis.coalesce()
-        LOGGER.debug("Segments read from disk")
-    else:
-        analysis = DataQualityFlag.query(aflag, start, end, url=url)
-        LOGGER.debug("Segments recovered from %s" % url)
-    if padding != (0, 0):
-        mindur = padding[0] - padding[1]
-        analysis.active = type(analysis.active)([s for s in analysis.active if
-                                                 abs(s) >= mindur])
-        analysis.pad(*padding, inplace=True)
-        LOGGER.debug("Padding %s applied" % str(padding))
+    analysis, vetoes = analysis_segments(cp, start, end, ifo=ifo, files=args.analysis_segments, nproc=args.nproc)
     livetime = int(abs(analysis.active))
     livetimepc = livetime / duration * 100.
     get_seg_time = datetime.datetime.now() - get_seg_start
     LOGGER.info(f"Retrieved {len(analysis.active)} segments for {aflag} with {livetime}s ({livetimepc:.2f}%) '"
                 f"livetime in {get_seg_time.total_seconds():.1f}s")
-
-    # apply vetoes from veto-definer file
-    try:
-        vetofile = cp.get('segments', 'veto-definer-file')
-    except configparser.NoOptionError:
-        vetofile = None
-    else:
-        try:
-            categories = cp.getfloats('segments', 'veto-definer-categories')
-        except configparser.NoOptionError:
-            categories = None
-        # read file
-        vdf = read_veto_definer_file(vetofile, start=start, end=end, ifo=ifo)
-        LOGGER.info("Read veto-definer file from %s" % vetofile)
-        # get vetoes from segdb
-        vdf.populate(source=url, segments=analysis.active, on_error='warn')
-        # coalesce flags from chosen categories
-        vetoes = DataQualityFlag('%s:VDF-VETOES:1' % ifo)
-        nflags = 0
-        for flag in vdf:
-            if not categories or vdf[flag].category in categories:
-                vetoes += vdf[flag]
-                nflags += 1
-        try:
-            deadtime = int(abs(vetoes.active)) / int(abs(vetoes.known)) * 100
-        except ZeroDivisionError:
-            deadtime = 0
-        LOGGER.debug("Coalesced %ss (%.2f%%) of deadtime from %d veto flags"
-                     % (abs(vetoes.active), deadtime, nflags))
-        # apply to analysis segments
-        analysis -= vetoes
-        LOGGER.debug("Applied vetoes from veto-definer file")
-        livetime = int(abs(analysis.active))
-        livetimepc = livetime / duration * 100.
+    if vetoes is not None:
         LOGGER.info(f"{livetime}s ({livetimepc:.2f}%) livetime remaining after vetoes")
 
     snrs = cp.getfloats('hveto', 'snr-thresholds')
@@ -435,7 +432,7 @@ def main(args=None):
 
     # read auxiliary cache
     if args.auxiliary_cache is not None:
-        acache = read_cache(args.auxiliary_cache)
+        acache = CacheCatalog(read_cache(args.auxiliary_cache))
     else:
         acache = None
 
@@ -447,7 +444,7 @@ def main(args=None):
         auxchannels = cp.get('auxiliary', 'channels').strip('\n').split('\n')
     except config.configparser.NoOptionError:
         auxchannels = find_auxiliary_channels(auxetg, (start, end), ifo=ifo,
-                                              cache=acache)
+                                              cache=acache, nproc=args.nproc)
         cp.set('auxiliary', 'channels', '\n'.join(auxchannels))
         aux_find_time = datetime.datetime.now() - aux_find_start
         LOGGER.debug(f"Auto-discovered {len(auxchannels)} auxiliary channels in {aux_find_time.total_seconds():.1f}s")
@@ -498,6 +495,15 @@ def main(args=None):
 
     # -- load primary triggers ------------------
 
+    # set up the (read-through) cache of events for each channel
+    if args.trigger_cache_dir is not None:
+        tcache = TriggerCache(args.trigger_cache_dir,
+                              max_size=int(args.trigger_cache_size * 2 ** 30))
+        LOGGER.debug("Caching events in %s" % args.trigger_cache_dir)
+    else:
+        tcache = None
+    compact = args.compact
+
     # read primary cache
     if args.primary_cache is not None:
         pcache = read_cache(args.primary_cache)
@@ -516,7 +522,8 @@ def main(args=None):
     primary = get_triggers(pchannel, petg, analysis.active, snr=psnr,
                            frange=pfreq, cache=pcache, nproc=args.nproc,
                            extra_times=args.extra_times,
-                           trigfind_kwargs=ptrigfindkw, **preadkw)
+                           trigfind_kwargs=ptrigfindkw,
+                           trigger_cache=tcache, **preadkw)
     fcol, scol = primary.dtype.names[1:3]
 
     if len(primary):
@@ -528,7 +535,7 @@ def main(args=None):
     # cluster primary triggers
     clusterkwargs = cp.getparams('primary', 'cluster-')
     if clusterkwargs:
-        primary = primary.cluster(**clusterkwargs)
+        primary = cluster_triggers(primary, **clusterkwargs)
         LOGGER.info("%d primary events remain after clustering over %s" %
                     (len(primary), clusterkwargs['rank']))
 
@@ -559,6 +566,12 @@ def main(args=None):
         '%s-HVETO_RAW_TRIGS_ROUND_0-%d-%d.txt' % (ifo, start, duration),
     )
     primary.write(trigfile, format='ascii', overwrite=True)
+    primary.sort('time')
+
+    # primary events are kept as read for output, with a compact copy (if
+    # requested) to match the auxiliary events in the coincidence search,
+    # both in time order
+    kprimary = compact_table(primary) if compact else primary
 
     # -- load auxiliary triggers ----------------
 
@@ -571,8 +584,12 @@ def main(args=None):
         areadkw['format'] = None
     atrigfindkw = cp.getparams('auxiliary', 'trigfind-')
 
+    # read multi-channel files (or event stores) once for all channels
+    stores = acache is not None and any(str(e).endswith(EVENT_STORE_EXT) for e in acache)
+    if auxetg.lower() == 'snax' or stores:
+        results = _get_multichannel_aux_triggers(auxchannels, args.nproc)
     # map with multiprocessing
-    if args.nproc > 1:
+    elif args.nproc > 1:
         pool = multiprocessing.Pool(processes=args.nproc)
         results = pool.map(_get_aux_triggers, auxchannels)
         pool.close()
@@ -595,15 +612,32 @@ def main(args=None):
 
     minsig = cp.getfloat('hveto', 'minimum-significance')
 
-    pevents = [primary]
-    pvetoed = []
-
     auxfcol, auxscol = auxiliary[auxchannels[0]].dtype.names[1:3]
+
+    # events are never removed from the tables, instead each primary event
+    # records the round in which it was vetoed (0 if it survives), and
+    # each auxiliary channel carries an SNR index of its surviving events
+    # (using the SNR order stored with the events, if available)
+    vetoed_in_round = numpy.zeros(len(primary), dtype=int)
+    auxindex = dict(
+        (c, core.SnrIndex(t[auxscol], order=t.meta.get('snr_order')))
+        for c, t in auxiliary.items())
+    auxalive = dict((c, idx.alive) for c, idx in auxindex.items())
     slabel = plot.get_column_label(scol)
     flabel = plot.get_column_label(fcol)
     auxslabel = plot.get_column_label(auxscol)
     auxflabel = plot.get_column_label(auxfcol)
 
+    # split the analysis into time partitions for coincidence counting
+    try:
+        partdur = cp.getfloat('hveto', 'partition-duration')
+    except configparser.NoOptionError:
+        partitions = None
+    else:
+        partitions = core.time_partitions(analysis.active, partdur)
+        LOGGER.debug("Counting coincidences over %d partitions of %ss"
+                     % (len(partitions), partdur))
+
     rounds = []
     rnd = core.HvetoRound(1, pchannel, rank=scol)
     rnd.segments = analysis.active
@@ -619,7 +653,15 @@ def main(args=None):
         write_ascii_segments(segfile, rnd.segments)
 
         # calculate significances for this round
-        if args.nproc > 1:  # multiprocessing
+        palive = vetoed_in_round == 0
+        masks = dict(auxalive)
+        masks[pchannel] = palive
+        if partitions:  # distribute time partitions over processes
+            winner, newsignificances = core.find_max_significance(
+                kprimary, auxiliary, pchannel, snrs, windows, rnd.livetime,
+                partitions=partitions, nproc=args.nproc, masks=masks,
+                indexes=auxindex)
+        elif args.nproc > 1:  # multiprocessing
             # separate channel list into chunks and process each chunk
             pool = multiprocessing.Pool(
                 processes=min(args.nproc, len(auxiliary.keys())))
@@ -635,7 +677,8 @@ def main(args=None):
                 newsignificances.update(subdict)
         else:  # single process
             winner, newsignificances = core.find_max_significance(
-                primary, auxiliary, pchannel, snrs, windows, rnd.livetime)
+                kprimary, auxiliary, pchannel, snrs, windows, rnd.livetime,
+                masks=masks, indexes=auxindex)
 
         LOGGER.info("Round %d winner: %s" % (rnd.n, winner.name))
 
@@ -667,12 +710,14 @@ def main(args=None):
             break
 
         # work out the vetoes for this round
-        allaux = auxiliary[winner.name][
-            auxiliary[winner.name][auxscol] >= winner.snr]
-        winner.events = allaux
-        coincs = allaux[core.find_coincidences(allaux['time'], primary['time'],
-                                               dt=winner.window)]
+        waux = auxiliary[winner.name]
+        allaux = waux[numpy.sort(auxindex[winner.name].select(winner.snr))]
+        coincs = allaux[core.find_coincidences(
+            allaux['time'], kprimary['time'][palive], dt=winner.window)]
         rnd.vetoes = winner.get_segments(allaux['time'])
+        # convert compact events back (to seconds) for output
+        winner.events = expand_table(allaux)
+        coincs = expand_table(coincs)
         flag = DataQualityFlag(
             '%s:HVT-ROUND_%d:1' % (ifo, rnd.n), active=rnd.vetoes,
             known=rnd.segments,
@@ -682,18 +727,19 @@ def main(args=None):
         LOGGER.debug("Generated veto segments for round %d" % rnd.n)
 
         # link events before veto for plotting
-        before = primary
-        beforeaux = auxiliary[winner.name]
+        before = primary[palive]
+        beforeaux = expand_table(waux[auxalive[winner.name]])
 
         # apply vetoes to primary
-        primary, vetoed = core.veto(primary, rnd.vetoes)
-        pevents.append(primary)
-        pvetoed.append(vetoed)
+        vetomask = palive & core.veto_mask(kprimary['time'], rnd.vetoes)
+        vetoed_in_round[vetomask] = rnd.n
+        vetoed = primary[vetomask]
+        after = primary[vetoed_in_round == 0]
         LOGGER.debug("Applied vetoes to primary")
 
         # record results
         rnd.winner = winner
-        rnd.efficiency = (len(vetoed), len(primary) + len(vetoed))
+        rnd.efficiency = (len(vetoed), len(before))
         rnd.use_percentage = (len(coincs), len(winner.events))
         if rnd.n > 1:
             rnd.cum_efficiency = (
@@ -707,18 +753,8 @@ def main(args=None):
             rnd.cum_deadtime = rnd.deadtime
 
         # apply vetoes to auxiliary
-        if args.nproc > 1:  # multiprocess
-            # separate channel list into chunks and process each chunk
-            pool = multiprocessing.Pool(
-                processes=min(args.nproc, len(auxiliary.keys())))
-            chunks = utils.channel_groups(list(auxiliary.keys()), args.nproc)
-            results = pool.map(_veto, chunks)
-            pool.close()
-            auxiliary = results[0]
-            for subdict in results[1:]:
-                auxiliary.update(subdict)
-        else:  # single process
-            auxiliary = core.veto_all(auxiliary, rnd.vetoes)
+        for c, t in auxiliary.items():
+            auxindex[c].discard(core.veto_mask(t['time'], rnd.vetoes))
         LOGGER.debug("Applied vetoes to auxiliary channels")
 
         # log results
@@ -753,7 +789,7 @@ def main(args=None):
                 ifo, rnd.n, start, duration))
         for tag, arr in zip(
                 ['WINNER', 'VETOED', 'RAW'],
-                [winner.events, vetoed, primary]):
+                [winner.events, vetoed, after]):
             f = trigfile % tag
             arr.write(f, format='ascii', overwrite=True)
             LOGGER.debug("Round %d %s events written to %s"
@@ -774,7 +810,7 @@ def main(args=None):
             ifo, rnd.n, start, duration))
         wname = texify(rnd.winner.name)
         beforel = 'Before\n[%d]' % len(before)
-        afterl = 'After\n[%d]' % len(primary)
+        afterl = 'After\n[%d]' % len(after)
         vetoedl = 'Vetoed\n(primary)\n[%d]' % len(vetoed)
         beforeauxl = 'All\n[%d]' % len(beforeaux)
         usedl = 'Used\n(aux)\n[%d]' % len(winner.events)
@@ -787,7 +823,7 @@ def main(args=None):
         # before/after histogram
         png = pngname % 'HISTOGRAM'
         plot.before_after_histogram(
-            png, before[scol], primary[scol],
+            png, before[scol], after[scol],
             label1=beforel, label2=afterl, xlabel=slabel,
             title=ptitle, subtitle=subtitle)
         LOGGER.debug("Figure written to %s" % png)
@@ -904,12 +940,16 @@ def main(args=None):
     title = '%s Hveto all rounds' % args.ifo
     subtitle = '%d rounds | %d-%d' % (len(rounds), start, end)
 
+    # recover the events vetoed in each round
+    remaining = primary[vetoed_in_round == 0]
+    pvetoed = [primary[vetoed_in_round == r.n] for r in rounds]
+
     # before/after histogram
     png = pngname % 'HISTOGRAM'
-    beforel = 'Before analysis [%d events]' % len(pevents[0])
-    afterl = 'After %d rounds [%d]' % (len(pevents) - 1, len(pevents[-1]))
+    beforel = 'Before analysis [%d events]' % len(primary)
+    afterl = 'After %d rounds [%d]' % (len(rounds), len(remaining))
     plot.before_after_histogram(
-        png, pevents[0][scol], pevents[-1][scol],
+        png, primary[scol], remaining[scol],
         label1=beforel, label2=afterl, xlabel=slabel,
         title=title, subtitle=subtitle)
     png = FancyPlot(png, caption=plot.HEADER_CAPTION['HISTOGRAM'])
@@ -928,7 +968,7 @@ def main(args=None):
     labels = [str(r.n) for r in rounds]
     legtitle = 'Vetoed at\nround'
     plot.veto_scatter(
-        png, pevents[0], pvetoed,
+        png, primary, pvetoed,
         label1='', label2=labels, title=title,
         subtitle=subtitle, ylabel=flabel, x='time', y=fcol,
         epoch=start, xlim=[start, end], legend_title=legtitle)
@@ -939,7 +979,7 @@ def main(args=None):
     # snr versus time
     png = pngname % 'SNR_TIME'
     plot.veto_scatter(
-        png, pevents[0], pvetoed, label1='', label2=labels, title=title,
+        png, primary, pvetoed, label1='', label2=labels, title=title,
         subtitle=subtitle, ylabel=slabel, x='time', y=scol,
         epoch=start, xlim=[start, end], legend_title=legtitle)
     png = FancyPlot(png, caption=plot.HEADER_CAPTION['SNR_TIME'])
@@ -23,11 +23,13 @@ as given in the configuration files
 """
 
 import h5py
+import numpy
 import os
 import multiprocessing
 import sys
 import warnings
 
+from collections import OrderedDict
 from pathlib import Path
 
 from astropy.table import vstack
@@ -43,14 +45,30 @@ from gwpy.segments import (
     DataQualityFlag,
     DataQualityDict,
 )
+from gwpy.table.filters import in_segmentlist
 
 from gwdetchar.utils import cli
 
 from .. import (__version__, config)
+from ..core import ns_to_gps
+from ..segments import query_flag
 from ..triggers import (
+    EVENT_STORE_EXT,
+    EVENT_STORE_INDEX_DTYPE,
+    NPY_MANIFEST_EXT,
+    SNR_ORDER,
+    TIME_UNIT,
+    CacheCatalog,
+    compact_table,
+    expand_table,
     get_triggers,
+    get_multichannel_triggers,
     find_auxiliary_channels,
     find_trigger_files,
+    is_compact,
+    read_npy_manifest,
+    read_npy_triggers,
+    write_npy_triggers,
 )
 from ..utils import write_lal_cache
 
@@ -58,6 +76,12 @@ __author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
 
 IFO = os.getenv('IFO')
 
+#: number of rows per HDF5 chunk in cached event files
+HDF5_APPEND_CHUNK_SIZE = 4096
+
+#: number of segments per HDF5 chunk in cached event files
+SEGMENT_CHUNK_SIZE = 64
+
 # set up logger
 PROG = ('python -m hveto.cli.cache_events' if sys.argv[0].endswith('.py')
         else os.path.basename(sys.argv[0]))
@@ -97,17 +121,20 @@ def create_parser():
     parser.add_argument(
         '-p',
         '--primary-cache',
+        action='append',
         default=None,
         type=_abs_path,
-        help='path for cache containing primary channel files',
+        help=('path for cache containing primary channel files, '
+              'can be given multiple times'),
     )
     parser.add_argument(
         '-a',
         '--auxiliary-cache',
+        action='append',
         default=None,
         type=_abs_path,
         help=('path for cache containing auxiliary channel files, '
-              'files contained must be T050017-compliant with the '
+              'can be given multiple times, files contained must be T050017-compliant with the '
               'channel name as the leading name parts, e.g. '
               '\'L1-GDS_CALIB_STRAIN_<tag>-<start>-<duration>.'
               '<ext>\' for L1:GDS-CALIB_STRAIN triggers'),
@@ -139,11 +166,191 @@ def create_parser():
         type=_abs_path,
         help='path of output directory, default: %(default)s',
     )
+    pout.add_argument(
+        '-F',
+        '--cache-format',
+        choices=('hdf5', 'npy', 'store'),
+        default='hdf5',
+        help=('format of cached event files, \'npy\' writes one NumPy '
+              'file per column (plus a JSON manifest) that hveto can '
+              'memory-map, \'store\' writes all channels to a single '
+              'indexed HDF5 file, default: %(default)s'),
+    )
+    pout.add_argument(
+        '--compact',
+        action='store_true',
+        default=False,
+        help=('store event times as integer GPS nanoseconds, and other '
+              'columns in single precision, roughly halving the size of '
+              'the cache, only valid with --cache-format npy or store'),
+    )
 
     # return the parser
     return parser
 
 
+# -- HDF5 utilities -----------------------------------------------------------
+
+def append_rows(group, name, data, chunksize=HDF5_APPEND_CHUNK_SIZE):
+    """Append rows to a resizable HDF5 dataset, creating it if needed
+
+    Datasets written by older versions (with a fixed size) are rewritten
+    once as resizable datasets.
+
+    Parameters
+    ----------
+    group : `h5py.Group`
+        the group holding the dataset
+
+    name : `str`
+        the name of the dataset
+
+    data : `numpy.ndarray`
+        the (1-D) array of rows to append
+
+    chunksize : `int`, optional
+        the number of rows per HDF5 chunk of a new dataset
+
+    Returns
+    -------
+    dset : `h5py.Dataset`
+        the extended dataset
+    """
+    data = numpy.asarray(data)
+    if name in group and group[name].maxshape[0] is not None:
+        data = numpy.concatenate((group[name][()].astype(data.dtype), data))
+        del group[name]
+    if name not in group:
+        return group.create_dataset(name, data=data, maxshape=(None,),
+                                    chunks=(chunksize,))
+    dset = group[name]
+    nrows = dset.shape[0]
+    dset.resize((nrows + data.shape[0],))
+    dset[nrows:] = data
+    return dset
+
+
+def _flag_rows(flag):
+    """Format a `DataQualityFlag` as it would be written to HDF5
+    """
+    with h5py.File('flag.h5', 'w', driver='core',
+                   backing_store=False) as h5f:
+        flag.write(h5f, path='segments')
+        group = h5f['segments']
+        return (dict(group.attrs), group['active'][()], group['known'][()])
+
+
+def append_flag(h5f, path, flag):
+    """Append the segments of a `DataQualityFlag` to an HDF5 group
+
+    The ``active`` and ``known`` segments are appended to resizable
+    datasets, in the same layout as `DataQualityFlag.write`, so the
+    result can be read back with `DataQualityFlag.read` (and coalesced).
+
+    Parameters
+    ----------
+    h5f : `h5py.Group`
+        the file (or group) in which to write
+
+    path : `str`
+        the name of the group for this flag
+
+    flag : `~gwpy.segments.DataQualityFlag`
+        the flag to append
+    """
+    attrs, active, known = _flag_rows(flag)
+    group = h5f.require_group(path)
+    if not group.attrs:
+        group.attrs.update(attrs)
+    append_rows(group, 'active', active, chunksize=SEGMENT_CHUNK_SIZE)
+    append_rows(group, 'known', known, chunksize=SEGMENT_CHUNK_SIZE)
+    return group
+
+
+def append_store_events(h5f, channel, table, flag):
+    """Append the events for a channel to a consolidated event store
+
+    Each column is appended to its own resizable dataset in the
+    ``/channels/<channel>`` group, alongside the ``segments`` for this
+    channel and the (ascending argsort) SNR order of all of its events, and the
+    summary of that channel (as used by the store index) is updated.
+
+    Parameters
+    ----------
+    h5f : `h5py.File`
+        the open event store
+
+    channel : `str`
+        the name of the channel
+
+    table : `~gwpy.table.EventTable`
+        the events to append, the first three columns are taken to be
+        the time, frequency-like, and SNR-like columns, respectively
+
+    flag : `~gwpy.segments.DataQualityFlag`
+        the segments over which these events were found
+
+    Notes
+    -----
+    Compact tables (see `hveto.triggers.compact_table`) are stored as
+    they are, with the unit of their times recorded in the group
+    attributes, events appended to an existing group are converted to
+    match the events already stored.
+    """
+    group = h5f.require_group('channels').require_group(channel)
+    if 'columns' not in group.attrs:
+        group.attrs.update({
+            'columns': list(table.dtype.names),
+            'rows': 0,
+            'tmin': numpy.inf,
+            'tmax': -numpy.inf,
+            'maxsnr': -numpy.inf,
+        })
+        if is_compact(table):
+            group.attrs[TIME_UNIT] = table.meta[TIME_UNIT]
+    elif TIME_UNIT in group.attrs:
+        table = compact_table(table)
+    else:
+        table = expand_table(table)
+    data = table.as_array()
+    columns = list(group.attrs['columns'])
+    for name in columns:
+        append_rows(group, name, data[name])
+    append_flag(group, 'segments', flag)
+    # (re-)write the SNR order of all events for this channel
+    if SNR_ORDER in group:
+        del group[SNR_ORDER]
+    group.create_dataset(SNR_ORDER, data=numpy.argsort(
+        group[columns[2]][()], kind='stable'))
+    if len(data):
+        times = data[columns[0]]
+        if is_compact(table):
+            times = ns_to_gps(times)
+        group.attrs['rows'] += len(data)
+        group.attrs['tmin'] = min(group.attrs['tmin'], times.min())
+        group.attrs['tmax'] = max(group.attrs['tmax'], times.max())
+        group.attrs['maxsnr'] = max(group.attrs['maxsnr'],
+                                    data[columns[2]].max())
+    return group
+
+
+def write_store_index(h5f):
+    """(Re-)write the index of a consolidated event store
+
+    The index is a table of the number of rows, the time span, and the
+    loudest SNR of the events for each channel in the store.
+    """
+    groups = h5f.get('channels', {})
+    index = numpy.zeros(len(groups), dtype=EVENT_STORE_INDEX_DTYPE)
+    for row, channel in zip(index, groups):
+        row['channel'] = channel
+        for key in ('rows', 'tmin', 'tmax', 'maxsnr'):
+            row[key] = groups[channel].attrs[key]
+    if 'index' in h5f:
+        del h5f['index']
+    return h5f.create_dataset('index', data=index)
+
+
 # -- main code block ----------------------------------------------------------
 
 def main(args=None):
@@ -151,6 +358,8 @@ def main(args=None):
     """
     parser = create_parser()
     args = parser.parse_args(args=args)
+    if args.compact and args.cache_format == 'hdf5':
+        parser.error("--compact requires --cache-format npy or store")
 
     ifo = args.ifo
     start = int(args.gpsstart)
@@ -189,7 +398,7 @@ def main(args=None):
         analysis.coalesce()
         LOGGER.debug("Segments read from disk")
     else:
-        analysis = DataQualityFlag.query(aflag, start, end, url=url)
+        analysis = query_flag(aflag, start, end, url=url)
         LOGGER.debug("Segments recovered from %s" % url)
     analysis.pad(*padding)
     livetime = int(abs(analysis.active))
@@ -202,24 +411,49 @@ def main(args=None):
 
     # -- utility methods ------------------------------
 
+    ext = {
+        'npy': NPY_MANIFEST_EXT,
+        'store': EVENT_STORE_EXT,
+    }.get(args.cache_format, '.h5')
+
     def create_path(channel):
-        ifo, name = channel.split(':', 1)
+        # all channels share the same event store
+        if args.cache_format == 'store':
+            return trigdir / "{}-HVETO_EVENT_STORE-{}-{}{}".format(
+                args.ifo, start, duration, ext)
+        cifo, name = channel.split(':', 1)
         name = name.replace('-', '_')
-        return trigdir / "{}-{}-{}-{}.h5".format(ifo, name, start, duration)
+        return trigdir / "{}-{}-{}-{}{}".format(
+            cifo, name, start, duration, ext)
 
-    def read_and_cache_events(channel, etg, cache=None, trigfind_kw={},
-                              **read_kw):
+    def new_segments(channel):
         cfile = create_path(channel)
         # read existing cached triggers and work out new segments to query
+        if args.append and cfile.is_file() and args.cache_format == 'npy':
+            previous = read_npy_manifest(cfile)['segments']
+            return analysis - DataQualityFlag(known=previous, active=previous)
+        if args.append and cfile.is_file() and args.cache_format == 'store':
+            with h5py.File(str(cfile), 'r') as h5f:
+                if channel not in h5f.get('channels', {}):
+                    return analysis.copy()
+            previous = DataQualityFlag.read(
+                str(cfile),
+                path='channels/{}/segments'.format(channel),
+                format='hdf5',
+            ).coalesce()
+            return analysis - previous
         if args.append and cfile.is_file():
             previous = DataQualityFlag.read(
                 str(cfile),
                 path='segments',
                 format='hdf5',
             ).coalesce()
-            new = analysis - previous
-        else:
-            new = analysis.copy()
+            return analysis - previous
+        return analysis.copy()
+
+    def read_and_cache_events(channel, etg, cache=None, trigfind_kw={},
+                              **read_kw):
+        new = new_segments(channel)
         # get cache of files
         if cache is None:
             cache = find_trigger_files(channel, etg, new.active, **trigfind_kw)
@@ -247,37 +481,91 @@ def main(args=None):
             except TypeError:  # None
                 return
 
+    def read_and_cache_multichannel_events(channels, etg, cache=None,
+                                           trigfind_kw={}, **read_kw):
+        """Read and cache events for channels that share the same files
+
+        Returns a `dict` of ``(path, count)`` pairs for each channel.
+        """
+        news = dict((c, new_segments(c)) for c in channels)
+        segments = SegmentList(
+            s for new in news.values() for s in new.active).coalesce()
+        # get cache of files
+        if cache is None:
+            cache = list(OrderedDict.fromkeys(
+                e for c in channels for e in find_trigger_files(
+                    c, etg, segments, **dict(trigfind_kw))))
+        else:
+            cache = list(filter(
+                lambda e: segments.intersects_segment(file_segment(e)),
+                cache,
+            ))
+        try:
+            available = cache_segments(cache)
+        except IndexError:
+            available = SegmentList()
+        # find new triggers for all channels at once
+        try:
+            trigs = get_multichannel_triggers(
+                channels, etg, segments & available, cache=cache, raw=True,
+                nproc=args.nproc, trigfind_kwargs=trigfind_kw, **read_kw)
+        # catch error and continue
+        except ValueError as e:
+            warnings.warn('%s: %s' % (type(e).__name__, str(e)))
+            return {}
+        out = {}
+        for channel, tab in trigs.items():
+            # restrict to the new segments for this channel
+            new = news[channel]
+            new.active &= available
+            tab = tab[in_segmentlist(tab[tab.dtype.names[0]], new.active)]
+            out[channel] = (write_events(channel, tab, new), len(tab))
+        return out
+
     def write_events(channel, tab, segments):
         """Write events to file with a given filename
         """
-        # get filename
+        if args.compact:
+            tab = compact_table(tab)
+        if args.cache_format == 'npy':
+            return write_npy_events(channel, tab, segments)
+        if args.cache_format == 'store':
+            return write_store_events(channel, tab, segments)
+
+        # append events and segments to the file in place
         path = create_path(channel)
-        h5f = h5py.File(str(path), 'a')
-
-        # read existing table from file
-        try:
-            old = tab.read(h5f["triggers"], format="hdf5")
-        except KeyError:
-            pass
-        else:
-            tab = vstack(old, tab)
-
-        # append event table
-        tab.write(h5f, path="triggers", append=True, overwrite=True)
+        with h5py.File(str(path), 'a' if args.append else 'w') as h5f:
+            append_rows(h5f, 'triggers', tab.as_array())
+            append_flag(h5f, 'segments', segments)
+        return path
 
-        # write segments
-        try:
-            oldsegs = DataQualityFlag.read(h5f, path="segments", format="hdf5")
-        except KeyError:
-            pass
-        else:
-            segments = oldsegs + segments
-        segments.write(h5f, path="segments", append=True, overwrite=True)
+    def write_store_events(channel, tab, segments):
+        """Append events to the consolidated event store
+        """
+        path = create_path(channel)
+        with h5py.File(str(path), 'a') as h5f:
+            append_store_events(h5f, channel, tab, segments)
+        return path
 
-        # write file to disk
-        h5f.close()
+    def write_npy_events(channel, tab, segments):
+        """Write events to a set of NumPy column files
+        """
+        path = create_path(channel)
+        segments = segments.active
+        if args.append and path.is_file():
+            # copy the (memory-mapped) existing events before overwriting
+            old = read_npy_triggers(path)
+            old = compact_table(old) if is_compact(tab) else expand_table(old)
+            tab = vstack([old, tab])
+            segments = segments | read_npy_manifest(path)['segments']
+            del old
+        write_npy_triggers(path, tab, segments.coalesce())
         return path
 
+    # start a new event store from scratch
+    if args.cache_format == 'store' and not args.append:
+        create_path(None).unlink(missing_ok=True)
+
     # -- load channels --------------------------------
 
     # get primary channel name
@@ -285,7 +573,7 @@ def main(args=None):
 
     # read auxiliary cache
     if args.auxiliary_cache is not None:
-        acache = [e for c in args.auxiliary_cache for e in read_cache(str(c))]
+        acache = CacheCatalog.read(*map(str, args.auxiliary_cache))
     else:
         acache = None
 
@@ -296,7 +584,7 @@ def main(args=None):
         auxchannels = cp.get('auxiliary', 'channels').strip('\n').split('\n')
     except config.configparser.NoOptionError:
         auxchannels = find_auxiliary_channels(auxetg, start, ifo=args.ifo,
-                                              cache=acache)
+                                              cache=acache, nproc=args.nproc)
 
     # load unsafe channels list
     _unsafe = cp.get('safety', 'unsafe-channels')
@@ -385,9 +673,7 @@ def main(args=None):
         if acache is None:
             auxcache = None
         else:
-            ifo, name = channel.split(':')
-            match = "{}-{}".format(ifo, name.replace('-', '_'))
-            auxcache = [e for e in acache if Path(e).name.startswith(match)]
+            auxcache = acache.files(channel)
 
         out = read_and_cache_events(
             channel, auxetg, cache=auxcache, snr=minsnr, frange=auxfreq,
@@ -409,8 +695,22 @@ def main(args=None):
                              % (tag, n, channel))
         return e
 
-    # map with multiprocessing
-    if args.nproc > 1:
+    # read multi-channel files once for all channels
+    if auxetg.lower() == 'snax':
+        written = read_and_cache_multichannel_events(
+            auxchannels, auxetg, cache=acache, snr=minsnr, frange=auxfreq,
+            trigfind_kw=atrigfindkw, **areadkw)
+        for i, channel in enumerate(auxchannels, start=1):
+            tag = '[%d/%d]' % (i, naux)
+            if channel in written:
+                LOGGER.debug("    %s Cached %d new events for %s"
+                             % (tag, written[channel][1], channel))
+            else:
+                LOGGER.critical("    %s Failed to read events for %s"
+                                % (tag, channel))
+        results = [written[c][0] for c in auxchannels if c in written]
+    # map with multiprocessing (the event store is written serially)
+    elif args.nproc > 1 and args.cache_format != 'store':
         pool = multiprocessing.Pool(processes=args.nproc)
         results = pool.map(read_and_write_aux_triggers, auxchannels)
         pool.close()
@@ -418,7 +718,11 @@ def main(args=None):
     else:
         results = map(read_and_write_aux_triggers, auxchannels)
 
-    acache = [x for x in results if x is not None]
+    acache = list(OrderedDict.fromkeys(x for x in results if x is not None))
+    # index the event store once all channels have been written
+    if args.cache_format == 'store' and create_path(None).is_file():
+        with h5py.File(str(create_path(None)), 'a') as h5f:
+            write_store_index(h5f)
     aname = trigdir / '{}-HVETO_AUXILIARY_CACHE-{}-{}.lcf'.format(
         ifo, start, duration,
     )
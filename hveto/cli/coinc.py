@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Pre-compute hveto coincidences in shards, and run rounds from them
+
+The ``compute`` step reads the primary triggers and the triggers for one
+shard of the auxiliary channels, and writes every coincident (primary,
+auxiliary) event pair inside the largest time window to HDF5. The
+``merge`` step then runs all hveto rounds from a complete set of shard
+files, without reading any trigger files.
+"""
+
+import json
+import os
+import sys
+import warnings
+
+from pathlib import Path
+
+import h5py
+import numpy
+
+from gwpy.io.cache import read_cache
+from gwpy.segments import (
+    Segment,
+    SegmentList,
+)
+
+from gwdetchar.utils import cli
+
+from .. import (__version__, config, core)
+from ..segments import analysis_segments
+from ..triggers import (CacheCatalog, cluster_triggers,
+                        find_auxiliary_channels, get_triggers)
+from .online import write_rounds
+from .serve import round_summary
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+
+IFO = os.getenv('IFO')
+
+# set up logger
+PROG = ('python -m hveto.cli.coinc' if sys.argv[0].endswith('.py')
+        else os.path.basename(sys.argv[0]))
+LOGGER = cli.logger(name=PROG.split('python -m ').pop())
+
+
+# -- parse command line -------------------------------------------------------
+
+def _abs_path(p):
+    return Path(p).expanduser().resolve()
+
+
+def _shard(s):
+    try:
+        i, n = map(int, s.split('/'))
+    except ValueError:
+        raise ValueError("shard must be given as 'i/N', e.g. '0/10'")
+    if not 0 <= i < n:
+        raise ValueError("shard index must be in [0, N)")
+    return i, n
+
+
+def create_parser():
+    """Create a command-line parser for this entry point
+    """
+    parser = cli.create_parser(
+        prog=PROG,
+        description=__doc__,
+        version=__version__,
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    # -- compute
+
+    compute = subparsers.add_parser(
+        'compute',
+        help='compute coincidences for one shard of auxiliary channels',
+    )
+    cli.add_gps_start_stop_arguments(compute)
+    cli.add_ifo_option(compute, required=IFO is None, ifo=IFO)
+    compute.add_argument(
+        '-f',
+        '--config-file',
+        action='append',
+        default=[],
+        type=_abs_path,
+        help=('path to hveto configuration file, can be given '
+              'multiple times (files read in order)'),
+    )
+    compute.add_argument(
+        '-p',
+        '--primary-cache',
+        default=None,
+        type=_abs_path,
+        help='path for cache containing primary channel files',
+    )
+    compute.add_argument(
+        '-a',
+        '--auxiliary-cache',
+        default=None,
+        type=_abs_path,
+        help=('path for cache containing auxiliary channel files, '
+              'files contained must be T050017-compliant with the '
+              'channel name as the leading name parts'),
+    )
+    compute.add_argument(
+        '-S',
+        '--analysis-segments',
+        action='append',
+        default=[],
+        type=_abs_path,
+        help=('path to file containing segments for '
+              'the analysis flag (name in data file '
+              'must match analysis-flag in config file)'),
+    )
+    compute.add_argument(
+        '-s',
+        '--shard',
+        default='0/1',
+        type=_shard,
+        help=('index and number of shards as \'i/N\', '
+              'auxiliary channels are distributed evenly over '
+              'shards, default: %(default)s'),
+    )
+    compute.add_argument(
+        '-o',
+        '--output-directory',
+        default=os.curdir,
+        type=_abs_path,
+        help='path of output directory, default: %(default)s',
+    )
+
+    # -- merge
+
+    merge = subparsers.add_parser(
+        'merge',
+        help='run all hveto rounds from a set of shard files',
+    )
+    merge.add_argument(
+        'shards',
+        nargs='+',
+        type=_abs_path,
+        help='path(s) of shard files written by the compute step',
+    )
+    merge.add_argument(
+        '-m',
+        '--minimum-significance',
+        type=float,
+        default=None,
+        help=('significance value below which to stop the analysis, '
+              'default: as configured for the compute step'),
+    )
+    merge.add_argument(
+        '-o',
+        '--output-directory',
+        default=os.curdir,
+        type=_abs_path,
+        help='path of output directory, default: %(default)s',
+    )
+
+    # return the parser
+    return parser
+
+
+# -- coincidence I/O ----------------------------------------------------------
+
+#: attributes that must match between the shards of an analysis
+SHARD_ATTRS = ('nshards', 'snr-thresholds', 'time-windows')
+
+
+def write_coincidences(path, primary, segments, auxiliary, **attrs):
+    """Write pre-computed coincidences to HDF5
+
+    Parameters
+    ----------
+    path : `str`
+        the path of the output file
+
+    primary : `numpy.ndarray`
+        sorted array of primary event times
+
+    segments : `~gwpy.segments.SegmentList`
+        the analysis segments
+
+    auxiliary : `dict` of `dict`
+        the coincidences for each auxiliary channel, see
+        :func:`hveto.core.coincidence_rounds`
+
+    **attrs
+        other attributes to record in the file
+    """
+    with h5py.File(str(path), 'w') as h5f:
+        for key, val in attrs.items():
+            h5f.attrs[key] = val
+        h5f.create_dataset('segments', data=numpy.asarray(
+            segments, dtype=float).reshape((-1, 2)))
+        h5f.create_dataset('primary/time', data=primary)
+        group = h5f.create_group('channels')
+        for channel, aux in auxiliary.items():
+            chan = group.create_group(channel)
+            for key, dtype in (
+                    ('time', 'f8'),
+                    ('snr', 'f8'),
+                    ('primary', 'i8'),
+                    ('auxiliary', 'i8'),
+                    ('lag', 'f8'),
+            ):
+                chan.create_dataset(key, data=aux[key], dtype=dtype,
+                                    compression='gzip', shuffle=True)
+    return path
+
+
+def read_coincidences(paths):
+    """Read and combine pre-computed coincidences from HDF5 shard files
+
+    Parameters
+    ----------
+    paths : `list` of `str`
+        the paths of the shard files
+
+    Returns
+    -------
+    primary : `numpy.ndarray`
+        sorted array of primary event times
+
+    segments : `~gwpy.segments.SegmentList`
+        the analysis segments
+
+    auxiliary : `dict` of `dict`
+        the coincidences for each auxiliary channel
+
+    attrs : `dict`
+        the attributes recorded in the first file
+
+    Raises
+    ------
+    ValueError
+        if the shards were not computed for the same analysis (primary
+        events, SNR thresholds and time windows), or a shard is missing
+    """
+    primary = segments = attrs = None
+    auxiliary = {}
+    shards = set()
+    for path in paths:
+        with h5py.File(str(path), 'r') as h5f:
+            fattrs = dict(h5f.attrs)
+            ptimes = h5f['primary/time'][()]
+            if attrs is None:
+                attrs = fattrs
+                primary = ptimes
+                segments = SegmentList(
+                    Segment(float(a), float(b)) for
+                    a, b in h5f['segments'][()]).coalesce()
+            elif not numpy.array_equal(ptimes, primary):
+                raise ValueError(
+                    "shard %s was not computed for the same analysis as %s"
+                    % (path, paths[0]))
+            else:
+                for key in SHARD_ATTRS:
+                    if not numpy.array_equal(fattrs.get(key),
+                                             attrs.get(key)):
+                        raise ValueError(
+                            "shard %s was computed with different %s to %s"
+                            % (path, key, paths[0]))
+            shards.add(int(fattrs['shard']))
+            for channel, group in h5f['channels'].items():
+                auxiliary[channel] = dict(
+                    (key, group[key][()]) for key in group)
+    missing = set(range(int(attrs['nshards']))) - shards
+    if missing:
+        raise ValueError("missing shard(s): %s"
+                         % ', '.join(map(str, sorted(missing))))
+    return primary, segments, auxiliary, attrs
+
+
+# -- main code blocks ---------------------------------------------------------
+
+def compute(args):
+    """Compute the coincidences for one shard of auxiliary channels
+    """
+    ifo = args.ifo
+    start = int(args.gpsstart)
+    end = int(args.gpsend)
+    duration = end - start
+    shard, nshards = args.shard
+
+    LOGGER.info("-- Welcome to Hveto --")
+    LOGGER.info("GPS start time: %d" % start)
+    LOGGER.info("GPS end time: %d" % end)
+    LOGGER.info("Interferometer: %s" % ifo)
+    LOGGER.info("Shard: %d/%d" % (shard, nshards))
+
+    # read configuration
+    cp = config.HvetoConfigParser(ifo=ifo)
+    cp.read(map(str, args.config_file))
+    LOGGER.info("Parsed configuration file(s)")
+
+    # format output directory
+    outdir = args.output_directory
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    # get segments
+    aflag = cp.get('segments', 'analysis-flag')
+    analysis, _ = analysis_segments(cp, start, end, ifo=ifo,
+                                    files=args.analysis_segments)
+    LOGGER.info("Retrieved %d segments for %s with %ss livetime"
+                % (len(analysis.active), aflag, abs(analysis.active)))
+
+    snrs = cp.getfloats('hveto', 'snr-thresholds')
+    windows = cp.getfloats('hveto', 'time-windows')
+    minsig = cp.getfloat('hveto', 'minimum-significance')
+
+    # get channels for this shard
+    pchannel = cp.get('primary', 'channel')
+    if args.auxiliary_cache is not None:
+        acache = CacheCatalog(read_cache(str(args.auxiliary_cache)))
+    else:
+        acache = None
+    auxetg = cp.get('auxiliary', 'trigger-generator')
+    try:
+        auxchannels = cp.get('auxiliary', 'channels').strip('\n').split('\n')
+    except config.configparser.NoOptionError:
+        auxchannels = find_auxiliary_channels(auxetg, (start, end), ifo=ifo,
+                                              cache=acache)
+    unsafe = set(cp.get('safety', 'unsafe-channels').strip('\n').split('\n'))
+    unsafe.add(pchannel)
+    auxchannels = sorted(set(auxchannels) - unsafe)[shard::nshards]
+    LOGGER.info("Identified %d auxiliary channels to process"
+                % len(auxchannels))
+
+    # read primary triggers
+    if args.primary_cache is not None:
+        pcache = read_cache(str(args.primary_cache))
+    else:
+        pcache = None
+    preadkw = cp.getparams('primary', 'read-')
+    if pcache is not None:  # auto-detect the file format
+        preadkw['format'] = None
+    primary = get_triggers(
+        pchannel, cp.get('primary', 'trigger-generator'), analysis.active,
+        snr=cp.getfloat('primary', 'snr-threshold'),
+        frange=cp.getfloats('primary', 'frequency-range'), cache=pcache,
+        trigfind_kwargs=cp.getparams('primary', 'trigfind-'), **preadkw)
+    clusterkwargs = cp.getparams('primary', 'cluster-')
+    if clusterkwargs:
+        primary = cluster_triggers(primary, **clusterkwargs)
+        primary.sort('time')
+    ptimes = numpy.asarray(primary['time'])
+    LOGGER.info("Read %d events for %s" % (ptimes.size, pchannel))
+
+    # read auxiliary triggers and compute coincidences
+    areadkw = cp.getparams('auxiliary', 'read-')
+    if acache is not None:  # auto-detect the file format
+        areadkw['format'] = None
+    atrigfindkw = cp.getparams('auxiliary', 'trigfind-')
+    auxfreq = cp.getfloats('auxiliary', 'frequency-range')
+    auxiliary = {}
+    for channel in auxchannels:
+        if acache is None:
+            auxcache = None
+        else:
+            auxcache = acache.files(channel)
+        try:
+            trigs = get_triggers(channel, auxetg, analysis.active,
+                                 snr=min(snrs), frange=auxfreq,
+                                 cache=auxcache, trigfind_kwargs=atrigfindkw,
+                                 **areadkw)
+        except ValueError as e:
+            warnings.warn('%s: %s' % (type(e).__name__, str(e)))
+            continue
+        if not len(trigs):
+            continue
+        atimes = numpy.asarray(trigs['time'])
+        pidx, aidx, lag = core.coincident_pairs(ptimes, atimes,
+                                                dt=max(windows))
+        auxiliary[channel] = {
+            'time': atimes,
+            'snr': numpy.asarray(trigs['snr']),
+            'primary': pidx,
+            'auxiliary': aidx,
+            'lag': lag,
+        }
+        LOGGER.debug("    Found %d coincident pairs for %s"
+                     % (pidx.size, channel))
+
+    # write output
+    path = outdir / '{}-HVETO_COINC_SHARD_{}_OF_{}-{}-{}.h5'.format(
+        ifo, shard, nshards, start, duration)
+    write_coincidences(
+        path, ptimes, analysis.active, auxiliary,
+        ifo=ifo, gpsstart=start, gpsend=end, channel=pchannel,
+        shard=shard, nshards=nshards, minsig=minsig,
+        **{'snr-thresholds': snrs, 'time-windows': windows})
+    LOGGER.info("Coincidences for %d channels written to %s"
+                % (len(auxiliary), path))
+
+
+def merge(args):
+    """Run all rounds from a set of shard files
+    """
+    LOGGER.info("-- Welcome to Hveto --")
+    primary, segments, auxiliary, attrs = read_coincidences(args.shards)
+    ifo = attrs['ifo']
+    start = int(attrs['gpsstart'])
+    end = int(attrs['gpsend'])
+    minsig = args.minimum_significance
+    if minsig is None:
+        minsig = float(attrs['minsig'])
+    LOGGER.info("Read coincidences for %d channels from %d shards"
+                % (len(auxiliary), len(args.shards)))
+
+    rounds, vetoed_in_round = core.coincidence_rounds(
+        primary, segments, auxiliary,
+        list(attrs['snr-thresholds']), list(attrs['time-windows']),
+        minsig, channel=attrs['channel'])
+    for rnd in rounds:
+        LOGGER.info("Round %d winner: %s (significance %.2f)"
+                    % (rnd.n, rnd.winner.name, rnd.winner.significance))
+
+    # write output
+    outdir = args.output_directory
+    outdir.mkdir(parents=True, exist_ok=True)
+    segfile = write_rounds(rounds, ifo, start, end, outdir)
+    LOGGER.info("Segments written to %s" % segfile)
+    with open(outdir / 'summary-stats.json', 'w') as f:
+        json.dump({
+            'ifo': ifo,
+            'gpsstart': start,
+            'gpsend': end,
+            'rounds': list(map(round_summary, rounds)),
+        }, f, sort_keys=True)
+    vetofile = outdir / '{}-HVETO_VETOED_IN_ROUND-{}-{}.txt'.format(
+        ifo, start, end - start)
+    numpy.savetxt(vetofile, numpy.column_stack((primary, vetoed_in_round)),
+                  fmt=('%.6f', '%d'), header='time round')
+    LOGGER.info("-- Hveto complete --")
+
+
+def main(args=None):
+    """Run the hveto-coinc tool
+    """
+    parser = create_parser()
+    args = parser.parse_args(args=args)
+    if args.command == 'compute':
+        compute(args)
+    else:
+        merge(args)
+
+
+# -- run code -----------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
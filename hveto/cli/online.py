@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run the HierarchichalVeto (hveto) algorithm incrementally
+
+New trigger files are discovered by re-reading the primary and auxiliary
+cache files at a fixed interval, the veto segments for each round are
+re-written whenever new data are ingested.
+"""
+
+import os
+import sys
+import time
+
+from pathlib import Path
+
+from gwpy.io.cache import read_cache
+from gwpy.segments import (
+    DataQualityFlag,
+    DataQualityDict,
+)
+from gwpy.time import to_gps
+
+from gwdetchar.utils import cli
+
+from .. import (__version__, config)
+from ..online import HvetoOnline
+from ..segments import (write_ascii as write_ascii_segments,
+                        analysis_segments)
+from ..triggers import find_auxiliary_channels
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+
+IFO = os.getenv('IFO')
+
+# set up logger
+PROG = ('python -m hveto.cli.online' if sys.argv[0].endswith('.py')
+        else os.path.basename(sys.argv[0]))
+LOGGER = cli.logger(name=PROG.split('python -m ').pop())
+
+
+# -- parse command line -------------------------------------------------------
+
+def _abs_path(p):
+    return Path(p).expanduser().resolve()
+
+
+def create_parser():
+    """Create a command-line parser for this entry point
+    """
+    parser = cli.create_parser(
+        prog=PROG,
+        description=__doc__,
+        version=__version__,
+    )
+
+    # gwdetchar standard arguments/options
+    cli.add_gps_start_stop_arguments(parser)
+    cli.add_ifo_option(parser, required=IFO is None, ifo=IFO)
+
+    # custom options
+    parser.add_argument(
+        '-f',
+        '--config-file',
+        action='append',
+        default=[],
+        type=_abs_path,
+        help=('path to hveto configuration file, can be given '
+              'multiple times (files read in order)'),
+    )
+    parser.add_argument(
+        '-p',
+        '--primary-cache',
+        required=True,
+        type=_abs_path,
+        help=('path for cache containing primary channel files, '
+              're-read at each update'),
+    )
+    parser.add_argument(
+        '-a',
+        '--auxiliary-cache',
+        required=True,
+        type=_abs_path,
+        help=('path for cache containing auxiliary channel files, '
+              're-read at each update, files contained must be '
+              'T050017-compliant with the channel name as the '
+              'leading name parts'),
+    )
+    parser.add_argument(
+        '-S',
+        '--analysis-segments',
+        action='append',
+        default=[],
+        type=_abs_path,
+        help=('path to file containing segments for '
+              'the analysis flag (name in data file '
+              'must match analysis-flag in config file), '
+              'default: query the segment database once, '
+              'on startup'),
+    )
+    parser.add_argument(
+        '-t',
+        '--interval',
+        type=float,
+        default=300,
+        help='time (seconds) between updates, default: %(default)s',
+    )
+
+    # output options
+    pout = parser.add_argument_group('Output options')
+    pout.add_argument(
+        '-o',
+        '--output-directory',
+        default=os.curdir,
+        type=_abs_path,
+        help='path of output directory, default: %(default)s',
+    )
+
+    # return the parser
+    return parser
+
+
+# -- main code block ----------------------------------------------------------
+
+def _read_cache(path):
+    try:
+        return read_cache(str(path))
+    except FileNotFoundError:
+        return []
+
+
+def write_rounds(rounds, ifo, start, end, outdir):
+    """Write the veto segments for a set of rounds
+    """
+    duration = end - start
+    segments = DataQualityDict()
+    for rnd in rounds:
+        segfile = outdir / '{}-HVETO_VETO_SEGS_ROUND_{}-{}-{}.txt'.format(
+            ifo, rnd.n, start, duration)
+        write_ascii_segments(str(segfile), rnd.vetoes)
+        flag = DataQualityFlag(
+            '%s:HVT-ROUND_%d:1' % (ifo, rnd.n), active=rnd.vetoes,
+            known=rnd.segments,
+            description="winner=%s, window=%s, snr=%s" % (
+                rnd.winner.name, rnd.winner.window, rnd.winner.snr))
+        segments[flag.name] = flag
+    segfile = outdir / '{}-HVETO_SEGMENTS-{}-{}.h5'.format(
+        ifo, start, duration)
+    segments.write(str(segfile), overwrite=True)
+    return segfile
+
+
+def main(args=None):
+    """Run the online hveto tool
+    """
+    parser = create_parser()
+    args = parser.parse_args(args=args)
+
+    ifo = args.ifo
+    start = int(args.gpsstart)
+    end = int(args.gpsend)
+
+    LOGGER.info("-- Welcome to Hveto --")
+    LOGGER.info("GPS start time: %d" % start)
+    LOGGER.info("GPS end time: %d" % end)
+    LOGGER.info("Interferometer: %s" % ifo)
+
+    # read configuration
+    cp = config.HvetoConfigParser(ifo=ifo)
+    cp.read(map(str, args.config_file))
+    LOGGER.info("Parsed configuration file(s)")
+
+    # format output directory
+    outdir = args.output_directory
+    outdir.mkdir(parents=True, exist_ok=True)
+    LOGGER.info("Working directory: {}".format(outdir))
+
+    # get segments (once, as for hveto)
+    analysis, _ = analysis_segments(cp, start, end, ifo=ifo,
+                                    files=args.analysis_segments)
+    LOGGER.info("Analysing %ss of livetime" % abs(analysis.active))
+
+    # get channels
+    pchannel = cp.get('primary', 'channel')
+    auxetg = cp.get('auxiliary', 'trigger-generator')
+    try:
+        auxchannels = cp.get('auxiliary', 'channels').strip('\n').split('\n')
+    except config.configparser.NoOptionError:
+        auxchannels = None
+    unsafe = set(cp.get('safety', 'unsafe-channels').strip('\n').split('\n'))
+    unsafe.add(pchannel)
+
+    snrs = cp.getfloats('hveto', 'snr-thresholds')
+    windows = cp.getfloats('hveto', 'time-windows')
+    minsig = cp.getfloat('hveto', 'minimum-significance')
+
+    store = None
+    while True:
+        pcache = _read_cache(args.primary_cache)
+        acache = _read_cache(args.auxiliary_cache)
+
+        # set up store once some auxiliary channels are known,
+        # auto-discovering channels if needed
+        if store is None:
+            channels = auxchannels
+            if channels is None:
+                channels = find_auxiliary_channels(
+                    auxetg, (start, end), ifo=ifo, cache=acache)
+            channels = [c for c in channels if c not in unsafe]
+            if channels:
+                store = HvetoOnline(
+                    pchannel,
+                    cp.get('primary', 'trigger-generator'),
+                    channels,
+                    auxetg,
+                    snrs,
+                    windows,
+                    analysis=analysis.active,
+                    psnr=cp.getfloat('primary', 'snr-threshold'),
+                    pfreq=cp.getfloats('primary', 'frequency-range'),
+                    auxfreq=cp.getfloats('auxiliary', 'frequency-range'),
+                    preadkw=cp.getparams('primary', 'read-'),
+                    areadkw=cp.getparams('auxiliary', 'read-'),
+                    clusterkw=cp.getparams('primary', 'cluster-'),
+                )
+                LOGGER.info("Processing %d auxiliary channels"
+                            % len(store.auxchannels))
+            else:
+                LOGGER.warning("No auxiliary channels found, will try "
+                               "again in %ss" % args.interval)
+
+        # ingest new files and recompute rounds
+        if store is not None and store.update(pcache, acache):
+            nprimary = 0 if store.primary is None else len(store.primary)
+            LOGGER.info("Updated store with %d primary events over %ss"
+                        % (nprimary, abs(store.segments)))
+            rounds = store.rounds(minsig)
+            segfile = write_rounds(rounds, ifo, start, end, outdir)
+            LOGGER.info("%d rounds written to %s" % (len(rounds), segfile))
+        elif float(to_gps('now')) >= end:
+            break
+        time.sleep(args.interval)
+
+    LOGGER.info("-- Hveto complete --")
+
+
+# -- run code -----------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Serve HierarchichalVeto (hveto) analyses from memory
+
+All primary and auxiliary triggers for the requested interval are read
+once, then held in memory while analysis requests are accepted over a
+local (UNIX) socket. Each request is a single line of JSON, e.g.
+
+.. code-block:: json
+
+   {"snr-thresholds": [8, 10, 20], "channels": ["X1:AUX-A"],
+    "output-directory": "/path/to/output"}
+
+and receives a single line of JSON in reply containing a summary of each
+round. Supported keys are ``snr-thresholds``, ``time-windows``,
+``minimum-significance``, ``channels``, ``unsafe-channels`` and
+``output-directory``. Send ``{"command": "shutdown"}`` to stop the server.
+
+Given an ``output-directory``, only the veto segments for each round (as
+written by ``hveto-online``) and the reply itself, as
+``<IFO>-HVETO_SERVE_SUMMARY-<start>-<duration>.json``, are written there.
+This is a summary only, not the full ``hveto`` output: no plots, HTML
+pages, trigger files or ``summary-stats.json`` are written.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import sys
+
+from pathlib import Path
+
+from gwpy.io.cache import read_cache
+
+from gwdetchar.utils import cli
+
+from .. import (__version__, config)
+from ..online import HvetoOnline
+from ..segments import analysis_segments
+from ..triggers import (find_auxiliary_channels, find_trigger_files)
+from .online import write_rounds
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+
+IFO = os.getenv('IFO')
+
+# set up logger
+PROG = ('python -m hveto.cli.serve' if sys.argv[0].endswith('.py')
+        else os.path.basename(sys.argv[0]))
+LOGGER = cli.logger(name=PROG.split('python -m ').pop())
+
+
+# -- parse command line -------------------------------------------------------
+
+def _abs_path(p):
+    return Path(p).expanduser().resolve()
+
+
+def create_parser():
+    """Create a command-line parser for this entry point
+    """
+    parser = cli.create_parser(
+        prog=PROG,
+        description=__doc__,
+        version=__version__,
+    )
+
+    # gwdetchar standard arguments/options
+    cli.add_gps_start_stop_arguments(parser)
+    cli.add_ifo_option(parser, required=IFO is None, ifo=IFO)
+
+    # custom options
+    parser.add_argument(
+        '-f',
+        '--config-file',
+        action='append',
+        default=[],
+        type=_abs_path,
+        help=('path to hveto configuration file, can be given '
+              'multiple times (files read in order)'),
+    )
+    parser.add_argument(
+        '-p',
+        '--primary-cache',
+        default=None,
+        type=_abs_path,
+        help='path for cache containing primary channel files',
+    )
+    parser.add_argument(
+        '-a',
+        '--auxiliary-cache',
+        default=None,
+        type=_abs_path,
+        help=('path for cache containing auxiliary channel files, '
+              'files contained must be T050017-compliant with the '
+              'channel name as the leading name parts'),
+    )
+    parser.add_argument(
+        '-S',
+        '--analysis-segments',
+        action='append',
+        default=[],
+        type=_abs_path,
+        help=('path to file containing segments for '
+              'the analysis flag (name in data file '
+              'must match analysis-flag in config file)'),
+    )
+    parser.add_argument(
+        '-s',
+        '--socket',
+        required=True,
+        type=_abs_path,
+        help='path of the UNIX socket on which to accept requests',
+    )
+
+    # return the parser
+    return parser
+
+
+# -- request handling ---------------------------------------------------------
+
+def round_summary(rnd):
+    """Summarise an `~hveto.core.HvetoRound` as a `dict`
+    """
+    return {
+        'round': rnd.n,
+        'name': rnd.winner.name,
+        'window': rnd.winner.window,
+        'snr': rnd.winner.snr,
+        'significance': rnd.winner.significance,
+        'nveto': rnd.efficiency[0],
+        'use-percentage': rnd.use_percentage[0] / rnd.use_percentage[1] * 100.,
+        'efficiency': rnd.efficiency[0] / rnd.efficiency[1] * 100.,
+        'deadtime': rnd.deadtime[0] / rnd.deadtime[1] * 100.,
+        'cumulative-efficiency':
+            rnd.cum_efficiency[0] / rnd.cum_efficiency[1] * 100.,
+        'cumulative-deadtime':
+            rnd.cum_deadtime[0] / rnd.cum_deadtime[1] * 100.,
+    }
+
+
+def analyse(store, request, minsig=5, ifo=None, span=None):
+    """Run an hveto analysis over the triggers in a store
+
+    Parameters
+    ----------
+    store : `~hveto.online.HvetoOnline`
+        the trigger store to analyse
+
+    request : `dict`
+        the analysis request, see the module documentation for the
+        supported keys
+
+    minsig : `float`, optional
+        the default minimum significance
+
+    ifo : `str`, optional
+        the interferometer prefix, required to write output files
+
+    span : `tuple` of `int`, optional
+        the ``(start, end)`` GPS interval, required to write output files
+
+    Returns
+    -------
+    result : `dict`
+        the JSON-serialisable result for this request
+    """
+    snrs = request.get('snr-thresholds')
+    if snrs is not None and min(snrs) < min(store.snrs):
+        raise ValueError(
+            "cannot analyse SNR thresholds below %s, the minimum used "
+            "to read auxiliary triggers" % min(store.snrs))
+    unsafe = set(request.get('unsafe-channels', []))
+    channels = [c for c in request.get('channels', store.auxchannels)
+                if c not in unsafe]
+    rounds = store.rounds(
+        request.get('minimum-significance', minsig),
+        snrs=snrs,
+        windows=request.get('time-windows'),
+        channels=channels,
+    )
+    result = {
+        'channels': len(channels),
+        'rounds': list(map(round_summary, rounds)),
+    }
+    outdir = request.get('output-directory')
+    if outdir:
+        outdir = _abs_path(outdir)
+        outdir.mkdir(parents=True, exist_ok=True)
+        write_rounds(rounds, ifo, span[0], span[1], outdir)
+        summary = outdir / '{}-HVETO_SERVE_SUMMARY-{}-{}.json'.format(
+            ifo, span[0], span[1] - span[0])
+        with open(summary, 'w') as f:
+            json.dump(result, f, sort_keys=True)
+        result['output-directory'] = str(outdir)
+    return result
+
+
+class HvetoRequestHandler(socketserver.StreamRequestHandler):
+    """Handle a single line-delimited JSON analysis request
+    """
+    def handle(self):
+        server = self.server
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get('command') == 'shutdown':
+                server.running = False
+                result = {'status': 'shutdown'}
+            else:
+                result = analyse(server.store, request, **server.analyse_kw)
+                result['status'] = 'ok'
+        except Exception as exc:
+            LOGGER.warning("Failed to process request: %s" % exc)
+            result = {'status': 'error', 'error': str(exc)}
+        self.wfile.write(json.dumps(result).encode('utf-8') + b'\n')
+
+
+class HvetoServer(socketserver.UnixStreamServer):
+    """Local socket server holding an `~hveto.online.HvetoOnline` store
+    """
+    def __init__(self, path, store, **analyse_kw):
+        self.store = store
+        self.analyse_kw = analyse_kw
+        self.running = True
+        super().__init__(str(path), HvetoRequestHandler)
+
+    def serve(self):
+        """Handle requests until a shutdown request is received
+        """
+        try:
+            while self.running:
+                self.handle_request()
+        finally:
+            self.server_close()
+            os.unlink(self.server_address)
+
+
+def send_request(path, request):
+    """Send an analysis request to a running server
+
+    Parameters
+    ----------
+    path : `str`
+        the path of the server socket
+
+    request : `dict`
+        the analysis request
+
+    Returns
+    -------
+    result : `dict`
+        the decoded response from the server
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(path))
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+# -- main code block ----------------------------------------------------------
+
+def main(args=None):
+    """Run the hveto analysis server
+    """
+    parser = create_parser()
+    args = parser.parse_args(args=args)
+
+    ifo = args.ifo
+    start = int(args.gpsstart)
+    end = int(args.gpsend)
+
+    LOGGER.info("-- Welcome to Hveto --")
+    LOGGER.info("GPS start time: %d" % start)
+    LOGGER.info("GPS end time: %d" % end)
+    LOGGER.info("Interferometer: %s" % ifo)
+
+    # read configuration
+    cp = config.HvetoConfigParser(ifo=ifo)
+    cp.read(map(str, args.config_file))
+    LOGGER.info("Parsed configuration file(s)")
+
+    # get segments
+    aflag = cp.get('segments', 'analysis-flag')
+    analysis, _ = analysis_segments(cp, start, end, ifo=ifo,
+                                    files=args.analysis_segments)
+    LOGGER.info("Retrieved %d segments for %s with %ss livetime"
+                % (len(analysis.active), aflag, abs(analysis.active)))
+
+    # get channels
+    pchannel = cp.get('primary', 'channel')
+    petg = cp.get('primary', 'trigger-generator')
+    auxetg = cp.get('auxiliary', 'trigger-generator')
+    if args.auxiliary_cache is not None:
+        acache = read_cache(str(args.auxiliary_cache))
+    else:
+        acache = None
+    try:
+        auxchannels = cp.get('auxiliary', 'channels').strip('\n').split('\n')
+    except config.configparser.NoOptionError:
+        auxchannels = find_auxiliary_channels(auxetg, (start, end), ifo=ifo,
+                                              cache=acache)
+    unsafe = set(cp.get('safety', 'unsafe-channels').strip('\n').split('\n'))
+    unsafe.add(pchannel)
+    auxchannels = [c for c in auxchannels if c not in unsafe]
+
+    # find files
+    if args.primary_cache is not None:
+        pcache = read_cache(str(args.primary_cache))
+    else:
+        pcache = find_trigger_files(pchannel, petg, analysis.active,
+                                    **cp.getparams('primary', 'trigfind-'))
+    if acache is None:
+        atrigfindkw = cp.getparams('auxiliary', 'trigfind-')
+        acache = [e for c in auxchannels for e in find_trigger_files(
+            c, auxetg, analysis.active, **atrigfindkw)]
+
+    # load all triggers into memory
+    LOGGER.info("Reading events for %d auxiliary channels..."
+                % len(auxchannels))
+    store = HvetoOnline(
+        pchannel,
+        petg,
+        auxchannels,
+        auxetg,
+        cp.getfloats('hveto', 'snr-thresholds'),
+        cp.getfloats('hveto', 'time-windows'),
+        analysis=analysis.active,
+        psnr=cp.getfloat('primary', 'snr-threshold'),
+        pfreq=cp.getfloats('primary', 'frequency-range'),
+        auxfreq=cp.getfloats('auxiliary', 'frequency-range'),
+        preadkw=cp.getparams('primary', 'read-'),
+        areadkw=cp.getparams('auxiliary', 'read-'),
+        clusterkw=cp.getparams('primary', 'cluster-'),
+    )
+    store.update(pcache, acache)
+    nprimary = 0 if store.primary is None else len(store.primary)
+    LOGGER.info("Read %d primary events and %d auxiliary channels"
+                % (nprimary, len(store.auxiliary)))
+
+    # serve requests
+    server = HvetoServer(
+        args.socket,
+        store,
+        minsig=cp.getfloat('hveto', 'minimum-significance'),
+        ifo=ifo,
+        span=(start, end),
+    )
+    LOGGER.info("Listening for requests on %s" % args.socket)
+    server.serve()
+    LOGGER.info("-- Hveto server stopped --")
+
+
+# -- run code -----------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for :mod:`hveto.cli.cache_events`
+"""
+
+import h5py
+import numpy
+
+from gwpy.segments import (Segment, SegmentList, DataQualityFlag)
+from gwpy.table import EventTable
+
+from .. import cache_events
+from ... import triggers
+
+
+def _rows(start, stop):
+    data = numpy.zeros(stop - start, dtype=[('time', 'f8'), ('snr', 'f8')])
+    data['time'] = numpy.arange(start, stop)
+    return data
+
+
+def test_append_rows(tmp_path):
+    path = tmp_path / 'test.h5'
+    with h5py.File(path, 'w') as h5f:
+        # legacy fixed-size datasets are converted on first append
+        h5f.create_dataset('triggers', data=_rows(0, 10))
+        cache_events.append_rows(h5f, 'triggers', _rows(10, 20))
+        dset = cache_events.append_rows(h5f, 'triggers', _rows(20, 25),
+                                        chunksize=8)
+        assert dset.maxshape == (None,)
+        assert dset['time'].tolist() == list(range(25))
+
+
+def test_append_flag(tmp_path):
+    path = tmp_path / 'test.h5'
+    span = SegmentList([Segment(0, 100)])
+    with h5py.File(path, 'w') as h5f:
+        for seg in ((0, 10), (10, 20.5), (50, 60)):
+            flag = DataQualityFlag(
+                'X1:TEST:1', known=span, active=SegmentList([Segment(*seg)]))
+            cache_events.append_flag(h5f, 'segments', flag)
+    flag = DataQualityFlag.read(path, path='segments', format='hdf5')
+    assert flag.name == 'X1:TEST:1'
+    assert flag.coalesce().active == SegmentList([
+        Segment(0, 20.5), Segment(50, 60)])
+    assert flag.known == span
+
+
+def test_append_store_events(tmp_path):
+    path = tmp_path / 'X1-HVETO_EVENT_STORE-0-100.hveto.h5'
+    span = SegmentList([Segment(0, 100)])
+    with h5py.File(path, 'w') as h5f:
+        for i, channel in enumerate(('X1:AUX-A', 'X1:AUX-B')):
+            for seg in ((0, 50), (50, 100)):
+                table = EventTable(
+                    [numpy.arange(*seg, 10.) + i, numpy.full(5, 100.),
+                     numpy.arange(5.) + 5 * i],
+                    names=('time', 'frequency', 'snr'))
+                flag = DataQualityFlag(
+                    known=span, active=SegmentList([Segment(*seg)]))
+                cache_events.append_store_events(h5f, channel, table, flag)
+        cache_events.write_store_index(h5f)
+
+    index = triggers.read_event_store_index(path)
+    assert list(index) == ['X1:AUX-A', 'X1:AUX-B']
+    assert index['X1:AUX-B'] == {
+        'rows': 10, 'tmin': 1., 'tmax': 91., 'maxsnr': 9.}
+    assert triggers.find_auxiliary_channels(
+        'omicron', cache=[str(path)]) == list(index)
+
+    # read one channel, or all at once
+    segments = SegmentList([Segment(20, 80)])
+    out = triggers.get_triggers('X1:AUX-B', 'omicron', segments,
+                                cache=[str(path)], format=None, snr=7)
+    assert out['time'].tolist() == [21., 31., 41., 71.]
+    tables = triggers.get_multichannel_triggers(
+        ['X1:AUX-A', 'X1:AUX-B', 'X1:AUX-C'], 'omicron', segments,
+        cache=[str(path)], snr=7)
+    assert tables['X1:AUX-B']['time'].tolist() == out['time'].tolist()
+    assert out['snr'][out.meta['snr_order']].tolist() == [7., 7., 8., 9.]
+    assert len(tables['X1:AUX-A']) == len(tables['X1:AUX-C']) == 0
+
+
+def test_append_store_events_compact(tmp_path):
+    path = tmp_path / 'X1-HVETO_EVENT_STORE-0-100.hveto.h5'
+    span = SegmentList([Segment(0, 100)])
+    with h5py.File(path, 'w') as h5f:
+        for seg, convert in (((0, 50), triggers.compact_table),
+                             ((50, 100), triggers.expand_table)):
+            table = convert(EventTable(
+                [numpy.arange(*seg, 10.), numpy.full(5, 100.),
+                 numpy.arange(5.)], names=('time', 'frequency', 'snr')))
+            flag = DataQualityFlag(
+                known=span, active=SegmentList([Segment(*seg)]))
+            cache_events.append_store_events(h5f, 'X1:AUX-A', table, flag)
+        group = h5f['channels/X1:AUX-A']
+        assert group['time'].dtype == numpy.int64
+        assert group['snr'].dtype == numpy.float32
+        assert (group.attrs['tmin'], group.attrs['tmax']) == (0., 90.)
+
+    out = triggers.get_triggers('X1:AUX-A', 'omicron', span,
+                                cache=[str(path)], format=None, snr=3)
+    assert out['time'].tolist() == [30., 40., 80., 90.]
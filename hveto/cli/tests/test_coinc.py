@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for :mod:`hveto.cli.coinc`
+"""
+
+import numpy
+import pytest
+
+from gwpy.segments import (Segment, SegmentList)
+
+from ... import core
+from .. import coinc
+
+PRIMARY = numpy.arange(0, 100, 2.)
+SEGMENTS = SegmentList([Segment(0, 100)])
+
+
+def _shard(tmp_path, shard, nshards, channel, times, snrs=(8, 10)):
+    times = numpy.asarray(times, dtype=float)
+    pidx, aidx, lag = core.coincident_pairs(PRIMARY, times, dt=1)
+    auxiliary = {channel: {
+        'time': times, 'snr': numpy.full(times.size, 10.),
+        'primary': pidx, 'auxiliary': aidx, 'lag': lag,
+    }}
+    return coinc.write_coincidences(
+        tmp_path / 'X1-SHARD_{}-0-100.h5'.format(shard),
+        PRIMARY, SEGMENTS, auxiliary, shard=shard, nshards=nshards,
+        **{'snr-thresholds': snrs, 'time-windows': [.5, 1]})
+
+
+def test_shard(tmp_path):
+    paths = [
+        _shard(tmp_path, 0, 2, 'X1:AUX-A', PRIMARY[::2] + .1),
+        _shard(tmp_path, 1, 2, 'X1:AUX-B', [3.]),
+    ]
+    primary, segments, auxiliary, attrs = coinc.read_coincidences(paths)
+    numpy.testing.assert_array_equal(primary, PRIMARY)
+    assert segments == SEGMENTS
+    assert sorted(auxiliary) == ['X1:AUX-A', 'X1:AUX-B']
+    assert auxiliary['X1:AUX-A']['primary'].size == 25
+
+    # check that missing shards are caught
+    with pytest.raises(ValueError) as exc:
+        coinc.read_coincidences(paths[:1])
+    assert str(exc.value) == 'missing shard(s): 1'
+
+    # check that shards with different thresholds are caught
+    paths[1] = _shard(tmp_path, 1, 2, 'X1:AUX-B', [3.], snrs=(8, 12))
+    with pytest.raises(ValueError) as exc:
+        coinc.read_coincidences(paths)
+    assert 'different snr-thresholds' in str(exc.value)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for :mod:`hveto.cli.online`, compared with :mod:`hveto`
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy
+import pytest
+
+from gwpy.segments import (Segment, SegmentList, DataQualityFlag,
+                           DataQualityDict)
+
+from ... import (__main__ as hveto_main, segments)
+from ...tests.test_online import _write_triggers
+from .. import (online, serve)
+
+START = 1000000000
+END = START + 200
+ARGS = [str(START), str(END), '--ifo', 'L1']
+
+CONFIG = """
+[segments]
+analysis-flag = L1:ANALYSIS:1
+padding = 1, -1
+[primary]
+channel = L1:PRIMARY
+snr-threshold = 8
+frequency-range = 10, 2000
+read-format = hdf5
+read-path = triggers
+read-columns = time, frequency, snr
+cluster-index = time
+cluster-rank = snr
+cluster-window = 0.1
+[auxiliary]
+channels = L1:AUX-A
+    L1:AUX-B
+frequency-range = 10, 2000
+read-format = hdf5
+read-path = triggers
+read-columns = time, frequency, snr
+[hveto]
+snr-thresholds = 8, 10, 20
+time-windows = .1, .5, 1
+"""
+
+
+@pytest.fixture(scope='module')
+def inputs(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('online')
+    rng = numpy.random.default_rng(1)
+
+    # primary events come in pairs, which are clustered
+    ptimes = numpy.sort(rng.uniform(START, END, size=60))
+    ptimes = numpy.concatenate((ptimes, ptimes + .05))
+    psnr = numpy.concatenate((numpy.full(60, 12.), numpy.full(60, 9.)))
+    atimes = ptimes[:60:2] + .01
+    btimes = numpy.sort(rng.uniform(START, END, size=40))
+    tag = '{}-{}.h5'.format(START, END - START)
+    pfile = _write_triggers(tmp_path / 'L1-PRIMARY_OMICRON-{}'.format(tag),
+                            ptimes, psnr)
+    afiles = [
+        _write_triggers(tmp_path / 'L1-AUX_A_OMICRON-{}'.format(tag),
+                        atimes, numpy.full(atimes.size, 25.)),
+        _write_triggers(tmp_path / 'L1-AUX_B_OMICRON-{}'.format(tag),
+                        btimes, numpy.full(btimes.size, 9.)),
+    ]
+
+    # the short second segment does not survive the padding
+    segfile = tmp_path / 'segments.h5'
+    DataQualityDict({'L1:ANALYSIS:1': DataQualityFlag(
+        'L1:ANALYSIS:1',
+        known=SegmentList([Segment(START, END)]),
+        active=SegmentList([Segment(START, START + 96),
+                            Segment(START + 97, START + 98),
+                            Segment(START + 99, END)]),
+    )}).write(str(segfile))
+
+    config = tmp_path / 'config.ini'
+    config.write_text(CONFIG)
+    pcache = tmp_path / 'primary.lcf'
+    pcache.write_text(pfile + '\n')
+    acache = tmp_path / 'auxiliary.lcf'
+    acache.write_text('\n'.join(afiles) + '\n')
+    args = ARGS + ['--config-file', str(config),
+                   '--primary-cache', str(pcache),
+                   '--auxiliary-cache', str(acache),
+                   '--analysis-segments', str(segfile)]
+
+    # run hveto itself, for reference
+    outdir = tmp_path / 'hveto'
+    cwd = os.getcwd()
+    try:
+        hveto_main.main(args + ['--output-directory', str(outdir)])
+    finally:
+        os.chdir(cwd)
+    return args, outdir
+
+
+def _round_flags(path):
+    flags = DataQualityDict.read(str(path))
+    return dict((key, flag) for key, flag in flags.items() if
+                key.startswith('L1:HVT-ROUND_'))
+
+
+def test_online_matches_hveto(inputs, tmp_path):
+    args, hvetodir = inputs
+    online.main(args + ['--output-directory', str(tmp_path),
+                        '--interval', '0'])
+    segfile = 'L1-HVETO_SEGMENTS-{}-{}.h5'.format(START, END - START)
+    expected = _round_flags(hvetodir / 'segments' / segfile)
+    result = _round_flags(tmp_path / segfile)
+    assert expected
+    assert sorted(result) == sorted(expected)
+    for key, flag in expected.items():
+        assert result[key].description == flag.description
+        assert result[key].known == flag.known
+        assert result[key].active == flag.active
+
+
+def test_online_queries_segments(inputs, tmp_path, monkeypatch):
+    args, hvetodir = inputs
+    args = list(args)
+    segfile = args.pop(args.index('--analysis-segments') + 1)
+    args.remove('--analysis-segments')
+
+    # without -S the analysis flag is queried, as for hveto
+    flag = DataQualityDict.read(segfile)['L1:ANALYSIS:1']
+    queries = []
+
+    def query_flag(name, start, end, url=None):
+        queries.append((name, start, end))
+        return flag.copy()
+
+    monkeypatch.setattr(segments, 'query_flag', query_flag)
+    online.main(args + ['--output-directory', str(tmp_path),
+                        '--interval', '0'])
+    assert queries == [('L1:ANALYSIS:1', START, END)]
+    segfile = 'L1-HVETO_SEGMENTS-{}-{}.h5'.format(START, END - START)
+    expected = _round_flags(hvetodir / 'segments' / segfile)
+    result = _round_flags(tmp_path / segfile)
+    assert sorted(result) == sorted(expected)
+    for key, flag in expected.items():
+        assert result[key].known == flag.known
+        assert result[key].active == flag.active
+
+
+def test_online_waits_for_channels(inputs, tmp_path, monkeypatch):
+    args, hvetodir = inputs
+    config = tmp_path / 'config.ini'
+    config.write_text(CONFIG.replace('channels = L1:AUX-A\n    L1:AUX-B\n', ''))
+    args = list(args)
+    args[args.index('--config-file') + 1] = str(config)
+    acache = args[args.index('--auxiliary-cache') + 1]
+    args[args.index('--auxiliary-cache') + 1] = str(tmp_path / 'aux.lcf')
+
+    # the auxiliary files only appear after the first update
+    sleeps = []
+
+    def sleep(interval):
+        sleeps.append(interval)
+        shutil.copyfile(acache, tmp_path / 'aux.lcf')
+
+    monkeypatch.setattr(online.time, 'sleep', sleep)
+    monkeypatch.setattr(online, 'to_gps',
+                        lambda _: START if len(sleeps) < 2 else END)
+    online.main(args + ['--output-directory', str(tmp_path)])
+    segfile = 'L1-HVETO_SEGMENTS-{}-{}.h5'.format(START, END - START)
+    expected = _round_flags(hvetodir / 'segments' / segfile)
+    result = _round_flags(tmp_path / segfile)
+    assert sorted(result) == sorted(expected)
+
+
+def test_serve_matches_hveto(inputs, tmp_path):
+    args, hvetodir = inputs
+    path = tmp_path / 'hveto.sock'
+    thread = threading.Thread(
+        target=serve.main, args=(args + ['--socket', str(path)],))
+    thread.start()
+    try:
+        for _ in range(600):
+            if path.exists() or not thread.is_alive():
+                break
+            time.sleep(.1)
+        result = serve.send_request(path, {})
+    finally:
+        if path.exists():
+            serve.send_request(path, {'command': 'shutdown'})
+        thread.join(timeout=10)
+    with open(hvetodir / 'summary-stats.json') as f:
+        expected = json.load(f)['rounds']
+    assert expected
+    assert len(result['rounds']) == len(expected)
+    for rnd, exp in zip(result['rounds'], expected):
+        exp.pop('files')
+        assert rnd == pytest.approx(exp)
+
+
+def test_hveto_compact(inputs, tmp_path):
+    args, hvetodir = inputs
+    outdir = tmp_path / 'compact'
+    cwd = os.getcwd()
+    try:
+        hveto_main.main(args + ['--output-directory', str(outdir),
+                                '--compact'])
+    finally:
+        os.chdir(cwd)
+    rounds = []
+    for path in (hvetodir, outdir):
+        with open(path / 'summary-stats.json') as f:
+            rounds.append(json.load(f)['rounds'])
+    assert rounds[0]
+    assert len(rounds[1]) == len(rounds[0])
+    for rnd, exp in zip(*rounds):
+        assert rnd.pop('files') == exp.pop('files')
+        assert rnd == pytest.approx(exp)
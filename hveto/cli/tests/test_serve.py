@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for :mod:`hveto.cli.serve`
+"""
+
+import threading
+
+import numpy
+import pytest
+
+from ...online import HvetoOnline
+from ...tests.test_online import (SNRS, WINDOWS, _write_block)
+from .. import serve
+
+
+@pytest.fixture
+def store(tmp_path):
+    rng = numpy.random.default_rng(0)
+    pcache, acache = _write_block(tmp_path, 0, 100, rng)
+    store = HvetoOnline(
+        'X1:PRIMARY', 'omicron', ['X1:AUX-A', 'X1:AUX-B'], 'omicron',
+        SNRS, WINDOWS)
+    store.update(pcache, acache)
+    return store
+
+
+def test_analyse(store, tmp_path):
+    result = serve.analyse(store, {}, ifo='X1', span=(0, 100))
+    assert result['rounds'][0]['name'] == 'X1:AUX-A'
+
+    # unsafe channels are excluded
+    result = serve.analyse(store, {'unsafe-channels': ['X1:AUX-A']})
+    assert result['channels'] == 1
+    assert all(r['name'] == 'X1:AUX-B' for r in result['rounds'])
+
+    # output is written on request
+    outdir = tmp_path / 'out'
+    result = serve.analyse(store, {'output-directory': str(outdir)},
+                           ifo='X1', span=(0, 100))
+    assert (outdir / 'X1-HVETO_SERVE_SUMMARY-0-100.json').is_file()
+    assert not (outdir / 'summary-stats.json').exists()
+    assert (outdir / 'X1-HVETO_SEGMENTS-0-100.h5').is_file()
+
+    # cannot go below the loaded threshold
+    with pytest.raises(ValueError):
+        serve.analyse(store, {'snr-thresholds': [1]})
+
+
+def test_server(store, tmp_path):
+    path = tmp_path / 'hveto.sock'
+    server = serve.HvetoServer(path, store)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    try:
+        result = serve.send_request(path, {'time-windows': [.1]})
+        assert result['status'] == 'ok'
+        assert result['rounds'][0]['window'] == .1
+        result = serve.send_request(path, {'snr-thresholds': [1]})
+        assert result['status'] == 'error'
+    finally:
+        assert serve.send_request(
+            path, {'command': 'shutdown'})['status'] == 'shutdown'
+        thread.join(timeout=10)
+    assert not path.exists()
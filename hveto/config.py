@@ -52,6 +52,11 @@ in the INI format:
                           seconds) over which to test each auxiliary channel
 ``minimum-significance``  The significance value below which to stop the
                           analysis
+``partition-duration``    (optional) Split the analysis into time partitions
+                          of this duration (seconds), counting coincidences
+                          in each partition independently (and in parallel
+                          with ``--nproc``), all events are still held in
+                          memory
 ========================  =====================================================
 
 .. code-block:: ini
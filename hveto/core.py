@@ -20,15 +20,13 @@
 """
 
 import itertools
+import multiprocessing
 from math import (log, exp, log10)
-from bisect import (bisect_left, bisect_right)
 
 import numpy
 
 from scipy.special import (gammainc, gammaln)
 
-from astropy.table import vstack as vstack_tables
-
 from gwpy.segments import (SegmentList, Segment)
 
 __author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
@@ -37,6 +35,68 @@ __credits__ = 'Joshua Smith <joshua.smith@ligo.org>'
 LOG_10 = log(10)
 LOG_EXP_1 = log10(exp(1))
 
+#: the number of nanoseconds in one second, the unit of compact times
+NS_PER_SECOND = 1000000000
+
+
+# -- integer times -----------------------------------------------------------
+
+def gps_to_ns(gps):
+    """Convert GPS times (or time offsets) in seconds to integer nanoseconds
+
+    The integer and fractional seconds are converted separately, so no
+    precision is lost beyond that of the input. Infinite times are
+    mapped to the limits of the `numpy.int64` range.
+
+    Parameters
+    ----------
+    gps : `float`, `numpy.ndarray`
+        the time(s) in seconds
+
+    Returns
+    -------
+    ns : `numpy.int64`, `numpy.ndarray`
+        the time(s) in nanoseconds
+    """
+    gps = numpy.asarray(gps, dtype=float)
+    finite = numpy.isfinite(gps)
+    value = numpy.where(finite, gps, 0.)
+    sec = numpy.floor(value)
+    ns = sec.astype('int64') * NS_PER_SECOND
+    ns += numpy.round((value - sec) * NS_PER_SECOND).astype('int64')
+    limits = numpy.iinfo('int64')
+    ns = numpy.where(finite, ns, numpy.where(gps > 0, limits.max, limits.min))
+    return ns[()]
+
+
+def ns_to_gps(ns):
+    """Convert integer GPS nanoseconds to (floating-point) seconds
+
+    Parameters
+    ----------
+    ns : `int`, `numpy.ndarray`
+        the time(s) in nanoseconds
+
+    Returns
+    -------
+    gps : `numpy.float64`, `numpy.ndarray`
+        the time(s) in seconds
+    """
+    ns = numpy.asarray(ns, dtype='int64')
+    sec, rem = numpy.divmod(ns, NS_PER_SECOND)
+    return (sec.astype(float) + rem / NS_PER_SECOND)[()]
+
+
+def _time_units(times, *values):
+    """Convert times in seconds to the units of an array of times
+
+    Integer arrays hold times in nanoseconds (see `gps_to_ns`), so
+    ``values`` are converted to match, otherwise they are returned as-is.
+    """
+    if numpy.issubdtype(numpy.asarray(times).dtype, numpy.integer):
+        values = [gps_to_ns(value) for value in values]
+    return values[0] if len(values) == 1 else values
+
 
 # -- define round structure --------------------------------------------------
 
@@ -145,7 +205,8 @@ def find_all_coincidences(triggers, channel, snrs, windows):
 
 
 def find_max_significance(primary, auxiliary, channel, snrs, windows,
-                          livetime):
+                          livetime, partitions=None, nproc=1, masks=None,
+                          indexes=None):
     """Find the maximum Hveto significance for this primary-auxiliary pair
 
     Parameters
@@ -158,27 +219,416 @@ def find_max_significance(primary, auxiliary, channel, snrs, windows,
         the SNR thresholds to use
     window : `list` of `float`
         the time windows to use
+    livetime : `float`
+        the livetime of the analysis
+    partitions : `~gwpy.segments.SegmentList`, optional
+        the time partitions over which to count coincidences independently,
+        see :func:`time_partitions`, default: one partition for all time
+    nproc : `int`, optional
+        the number of processes over which to distribute the partitions
+    masks : `dict` of `numpy.ndarray`, optional
+        boolean masks selecting the surviving events for each channel,
+        keyed by channel name (including the primary `channel`),
+        default: use all events
+    indexes : `dict` of `SnrIndex`, optional
+        SNR indexes for each auxiliary channel, used to count the
+        surviving events above each SNR threshold, these should be kept
+        in step with the ``masks``
 
     Returns
     -------
     winner : `HvetoWinner`
         the parameters and segments generated by the (snr, dt) with the
         highest significance
+
+    Notes
+    -----
+    A primary event is coincident with an auxiliary channel if any
+    auxiliary event lies within half a window of it (see
+    :func:`coincidence_counts`). Earlier versions counted coincidences
+    with :func:`find_all_coincidences`, which stops looking at the
+    neighbouring primary event, so missed auxiliary events beyond it
+    that were still inside the window; the counts (and significances)
+    are now slightly higher for closely-spaced primary events.
+    """
+    masks = masks or {}
+    counts = partitioned_counts(primary, auxiliary, snrs, windows,
+                                partitions=partitions, nproc=nproc,
+                                masks=masks, channel=channel)
+    indexes = indexes or {}
+    naux = dict(
+        (c, indexes[c].counts(snrs) if c in indexes else threshold_counts(
+            _columns(t, masks.get(c), 'snr')[0], snrs))
+        for c, t in auxiliary.items())
+    pmask = masks.get(channel)
+    nprimary = len(primary) if pmask is None else int(pmask.sum())
+    return score_coincidences(counts, naux, nprimary, snrs, windows,
+                              livetime)
+
+
+def time_partitions(segments, duration):
+    """Split the span of a segment list into fixed-duration partitions
+
+    Parameters
+    ----------
+    segments : `~gwpy.segments.SegmentList`
+        the analysis segments
+    duration : `float`
+        the maximum duration of each partition
+
+    Returns
+    -------
+    partitions : `~gwpy.segments.SegmentList`
+        the list of partitions that overlap at least one segment
+    """
+    segments = SegmentList(segments).coalesce()
+    partitions = SegmentList()
+    if not segments:
+        return partitions
+    start, end = segments.extent()
+    while start < end:
+        part = Segment(start, min(start + duration, end))
+        if segments.intersects_segment(part):
+            partitions.append(part)
+        start += duration
+    return partitions
+
+
+def _columns(table, mask, *names):
+    """Return the named columns of a table, selecting only masked rows
+    """
+    cols = [numpy.asarray(table[name]) for name in names]
+    if mask is None:
+        return cols
+    return [col[mask] for col in cols]
+
+
+def _time_ordered(times, *columns):
+    """Return arrays in time order, as they are if already sorted
+    """
+    if times.size < 2 or (times[1:] >= times[:-1]).all():
+        return (times,) + columns
+    order = numpy.argsort(times, kind='stable')
+    return (times[order],) + tuple(
+        None if col is None else col[order] for col in columns)
+
+
+def _select(part, mask, *columns):
+    """Return the rows of some columns in a slice, that pass a mask
+    """
+    if mask is None:  # views
+        return [col[part] for col in columns]
+    keep = mask[part]
+    return [col[part][keep] for col in columns]
+
+
+def _partition_slice(times, start, end, pad=0):
+    start, end, pad = _time_units(times, start, end, pad)
+    if numpy.issubdtype(times.dtype, numpy.integer):
+        # infinite bounds are held at the limits of the integer range, so
+        # pad (exactly) with python integers, then clip back to that range
+        limits = numpy.iinfo(times.dtype)
+        lower = max(int(start) - int(pad), int(limits.min))
+        upper = min(int(end) + int(pad), int(limits.max))
+    else:
+        lower, upper = start - pad, end + pad
+    return slice(numpy.searchsorted(times, lower, side='left'),
+                 numpy.searchsorted(times, upper,
+                                    side='right' if pad else 'left'))
+
+
+def _partition_tasks(primary, auxiliary, snrs, windows, partitions,
+                     masks, channel):
+    """Yield the inputs needed to count coincidences in each partition
+
+    The columns of each table are sorted by time only if they are not
+    already, and the events of each partition are sliced from them, so
+    only the selected events of one partition are copied at a time.
+    """
+    pad = max(windows) / 2.
+    ptimes, pmask = _time_ordered(
+        numpy.asarray(primary['time']), masks.get(channel))
+    auxiliary = dict(
+        (c, _time_ordered(numpy.asarray(t['time']), numpy.asarray(t['snr']),
+                          masks.get(c)))
+        for c, t in auxiliary.items())
+    for start, end in partitions:
+        pslice = _partition_slice(ptimes, start, end)
+        pevents, = _select(pslice, pmask, ptimes)
+        if not pevents.size:
+            continue
+        aux = {}
+        for c, (atimes, asnr, amask) in auxiliary.items():
+            aslice = _partition_slice(atimes, start, end, pad=pad)
+            aux[c] = tuple(_select(aslice, amask, atimes, asnr))
+        yield pevents, aux, snrs, windows
+
+
+def _partition_counts(task):
+    """Count coincidences for all channels in a single time partition
+    """
+    ptimes, auxiliary, snrs, windows = task
+    return dict(
+        (c, coincidence_counts(ptimes, atimes, asnr, snrs, windows))
+        for c, (atimes, asnr) in auxiliary.items())
+
+
+def partitioned_counts(primary, auxiliary, snrs, windows, partitions=None,
+                       nproc=1, masks=None, channel=None):
+    """Count coincidences for each channel, one time partition at a time
+
+    Each partition counts the primary events inside ``[start, end)``
+    against the auxiliary events inside the partition padded by half of
+    the largest window, so the sum over partitions is exact.
+
+    Parameters
+    ----------
+    primary : `~gwpy.table.EventTable`
+        table of primary events
+    auxiliary : `dict` of `~gwpy.table.EventTable`
+        tables of auxiliary events
+    snrs : `list` of `float`
+        the SNR thresholds to use
+    windows : `list` of `float`
+        the time windows to use
+    partitions : `~gwpy.segments.SegmentList`, optional
+        the time partitions, default: one partition for all time
+    nproc : `int`, optional
+        the number of processes over which to distribute the partitions
+    masks : `dict` of `numpy.ndarray`, optional
+        boolean masks selecting the surviving events for each channel,
+        keyed by channel name, default: use all events
+    channel : `str`, optional
+        the name of the primary channel, used to look up its mask
+
+    Returns
+    -------
+    counts : `dict` of `numpy.ndarray`
+        the coincidence counts for each channel, see
+        :func:`coincidence_counts`
+
+    Notes
+    -----
+    All events for all channels are still held in memory, partitioning
+    only limits the events copied (and, with ``nproc > 1``, sent to
+    another process) for each partition. Tables that are already sorted
+    by time (as in `hveto`) are not sorted again, and without ``masks``
+    the events of each partition are views of the table columns.
+    """
+    if partitions is None:
+        partitions = [Segment(-numpy.inf, numpy.inf)]
+    counts = dict(
+        (c, numpy.zeros((len(windows), len(snrs)), dtype=int))
+        for c in auxiliary)
+    tasks = _partition_tasks(primary, auxiliary, snrs, windows, partitions,
+                             masks or {}, channel)
+    if nproc > 1 and len(partitions) > 1:
+        pool = multiprocessing.Pool(processes=min(nproc, len(partitions)))
+        results = pool.imap_unordered(_partition_counts, tasks)
+    else:
+        pool = None
+        results = map(_partition_counts, tasks)
+    for partcounts in results:
+        for c, n in partcounts.items():
+            counts[c] += n
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return counts
+
+
+def coincidence_counts(primary, auxiliary, auxsnr, snrs, windows):
+    """Count the primary events coincident with an auxiliary channel
+
+    Parameters
+    ----------
+    primary : `numpy.ndarray`
+        sorted array of times for the primary channel
+    auxiliary : `numpy.ndarray`
+        sorted array of times for the auxiliary channel
+    auxsnr : `numpy.ndarray`
+        array of SNRs for the auxiliary channel, one per time
+    snrs : `list` of `float`
+        the SNR thresholds to use
+    windows : `list` of `float`
+        the time windows to use, in seconds
+
+    Returns
+    -------
+    counts : `numpy.ndarray`
+        an array of shape ``(len(windows), len(snrs))`` holding the number
+        of primary events within ``[-dt/2., +dt/2.]`` of at least one
+        auxiliary event louder than the SNR threshold
+
+    Notes
+    -----
+    Times may be given either in seconds, or as integer nanoseconds (see
+    `gps_to_ns`), in which case the windows are converted to match.
+    """
+    counts = numpy.zeros((len(windows), len(snrs)), dtype=int)
+    if not len(primary):
+        return counts
+    for j, snr in enumerate(snrs):
+        times = auxiliary[auxsnr >= snr]
+        if not times.size:
+            continue
+        for i, dt in enumerate(windows):
+            dx = _time_units(primary, dt / 2.)
+            x = numpy.searchsorted(times, primary - dx, side='left')
+            y = numpy.searchsorted(times, primary + dx, side='right')
+            counts[i, j] = numpy.count_nonzero(y > x)
+    return counts
+
+
+def threshold_counts(snr, snrs):
+    """Count the number of events above each of a set of SNR thresholds
+
+    Parameters
+    ----------
+    snr : `numpy.ndarray`
+        array of event SNRs
+    snrs : `list` of `float`
+        the SNR thresholds to use
+
+    Returns
+    -------
+    counts : `numpy.ndarray`
+        the number of events with ``snr >= threshold`` for each threshold
+    """
+    snr = numpy.sort(snr)
+    return snr.size - numpy.searchsorted(snr, snrs, side='left')
+
+
+class SnrIndex(object):
+    """Index of the events of a channel in ascending order of SNR
+
+    The index holds the (stable, ascending) argsort of the event SNRs, and
+    a Fenwick tree counting the surviving events at each position in that
+    order. The number of surviving events at or above any SNR threshold,
+    i.e. in the tail of that order, can then be found in ``O(log n)`` time,
+    and events can be discarded (e.g. vetoed) without rebuilding the index.
+
+    Parameters
+    ----------
+    snr : `numpy.ndarray`
+        the SNR of each event
+    order : `numpy.ndarray`, optional
+        the precomputed (ascending) argsort of ``snr`` (e.g. read alongside
+        the events), ignored if it does not sort ``snr``
+
+    Attributes
+    ----------
+    alive : `numpy.ndarray`
+        boolean mask of the surviving events, in their original order
+    """
+    def __init__(self, snr, order=None):
+        snr = numpy.asarray(snr)
+        size = snr.size
+        if order is not None:
+            order = numpy.asarray(order, dtype=int)
+        if order is None or order.size != size or (
+                size and numpy.any(numpy.diff(snr[order]) < 0)):
+            order = numpy.argsort(snr, kind='stable')
+        self.order = order
+        self.snr = snr[order]
+        self.alive = numpy.ones(size, dtype=bool)
+        self.nalive = size
+        # position of each event in the SNR order
+        self._rank = numpy.empty(size, dtype=int)
+        self._rank[order] = numpy.arange(size)
+        # Fenwick tree with every event alive
+        positions = numpy.arange(1, size + 1)
+        self._tree = positions & -positions
+
+    def __len__(self):
+        return self.alive.size
+
+    def _prefix(self, i):
+        """Count the surviving events in the first ``i`` positions
+        """
+        total = 0
+        while i > 0:
+            total += self._tree[i - 1]
+            i &= i - 1
+        return int(total)
+
+    def count(self, snr):
+        """Count the surviving events with SNR at or above a threshold
+        """
+        return self.nalive - self._prefix(
+            int(numpy.searchsorted(self.snr, snr, side='left')))
+
+    def counts(self, snrs):
+        """Count the surviving events above each of a set of thresholds
+
+        This is equivalent to :func:`threshold_counts` for the surviving
+        events.
+        """
+        return numpy.array([self.count(snr) for snr in snrs], dtype=int)
+
+    def select(self, snr):
+        """Return the indices of surviving events with SNR at or above
+        a threshold, in order of SNR
+        """
+        rows = self.order[numpy.searchsorted(self.snr, snr, side='left'):]
+        return rows[self.alive[rows]]
+
+    def discard(self, mask):
+        """Discard the events selected by a boolean mask
+
+        Events already discarded are ignored.
+        """
+        rows = numpy.flatnonzero(mask & self.alive)
+        self.alive[rows] = False
+        self.nalive -= rows.size
+        positions = self._rank[rows] + 1
+        while positions.size:
+            numpy.subtract.at(self._tree, positions - 1, 1)
+            positions = positions + (positions & -positions)
+            positions = positions[positions <= self._tree.size]
+
+
+def score_coincidences(counts, naux, nprimary, snrs, windows, livetime):
+    """Find the maximum Hveto significance from pre-computed counts
+
+    Parameters
+    ----------
+    counts : `dict` of `numpy.ndarray`
+        the coincidence counts for each auxiliary channel, as returned
+        by :func:`coincidence_counts`
+    naux : `dict` of `numpy.ndarray`
+        the number of auxiliary events above each SNR threshold for each
+        channel, as returned by :func:`threshold_counts`
+    nprimary : `int`
+        the number of primary events
+    snrs : `list` of `float`
+        the SNR thresholds used
+    windows : `list` of `float`
+        the time windows used
+    livetime : `float`
+        the livetime of the analysis
+
+    Returns
+    -------
+    winner : `HvetoWinner`
+        the parameters generated by the (snr, dt) with the highest
+        significance
+    significances : `dict` of `float`
+        the maximum significance for each channel
     """
-    rec = vstack_tables([primary] + list(auxiliary.values()))
-    coincs = find_all_coincidences(rec, channel, snrs, windows)
     winner = HvetoWinner(name='unknown', significance=-1)
-    sigs = dict((c, 0) for c in auxiliary)
-    for p, cdict in coincs.items():
-        dt, snr = p
-        for chan in cdict:
-            mu = (len(primary) * (auxiliary[chan]['snr'] >= snr).sum() * dt / livetime)
-            # NOTE: coincs[p][chan] counts the number of primary channel
-            # triggers coincident with a 'chan' trigger
-            try:
-                sig = significance(coincs[p][chan], mu)
-            except KeyError:
-                sig == 0
+    sigs = dict((c, 0) for c in counts)
+    wins = sorted(range(len(windows)), key=lambda i: windows[i], reverse=True)
+    thresh = sorted(range(len(snrs)), key=lambda j: snrs[j])
+    for i, j in itertools.product(wins, thresh):
+        dt = windows[i]
+        snr = snrs[j]
+        for chan in counts:
+            n = int(counts[chan][i, j])
+            if not n:
+                continue
+            mu = nprimary * naux[chan][j] * dt / livetime
+            sig = significance(n, mu)
             if sig > sigs[chan]:
                 sigs[chan] = sig
             if sig > winner.significance:
@@ -187,6 +637,7 @@ def find_max_significance(primary, auxiliary, channel, snrs, windows,
                 winner.window = dt
                 winner.significance = sig
                 winner.mu = mu
+                winner.ncoinc = n
     return winner, sigs
 
 
@@ -203,9 +654,12 @@ class HvetoWinner(object):
         self.window = window
         self.segments = segments
         self.events = events
+        self.ncoinc = ncoinc
         self.mu = mu
 
     def get_segments(self, times):
+        if numpy.issubdtype(numpy.asarray(times).dtype, numpy.integer):
+            times = ns_to_gps(times)
         return SegmentList([Segment(t - self.window / 2., t + self.window / 2.)
                             for t in times])
 
@@ -274,7 +728,8 @@ def find_coincidences(a, b, dt=1):
     b : `numpy.ndarray`
         second array
     dt : `float`, optional
-        coincidence window
+        coincidence window, in seconds (even if the arrays hold integer
+        nanoseconds)
 
     Returns
     -------
@@ -282,19 +737,47 @@ def find_coincidences(a, b, dt=1):
         the indices of all items in `a` within [-dt/2., +dt/2.) of an item
         in `b`
     """
-    dx = dt / 2.
+    a = numpy.asarray(a)
+    b = numpy.asarray(b)
+    dx = _time_units(b, dt / 2.)
+    x = numpy.searchsorted(b, a - dx, side='left')  # find b >= t-dx
+    y = numpy.searchsorted(b, a + dx, side='right')  # find b <= t+dx
+    return (y > x).nonzero()[0]
+
+
+def coincident_pairs(a, b, dt=1):
+    """Find all pairs of coincident values in two sorted numpy arrays
 
-    def _is_coincident(t):
-        x = bisect_left(b, t - dx)  # find b >= t-dx
-        y = bisect_right(b, t + dx)  # find b <= t+dx
-        if x != y:
-            return True
-        return False
+    Parameters
+    ----------
+    a : `numpy.ndarray`
+        first sorted array
+    b : `numpy.ndarray`
+        second sorted array
+    dt : `float`, optional
+        coincidence window, in seconds (even if the arrays hold integer
+        nanoseconds)
 
-    out = numpy.zeros(a.size)
-    for i, t in enumerate(a):
-        out[i] = _is_coincident(t)
-    return out.nonzero()[0]
+    Returns
+    -------
+    ia : `numpy.ndarray`
+        the index in `a` of each pair, in ascending order
+    ib : `numpy.ndarray`
+        the index in `b` of each pair
+    lag : `numpy.ndarray`
+        the time difference ``b[ib] - a[ia]`` of each pair (in the units
+        of the arrays), which is always inside ``[-dt/2., +dt/2.]``
+    """
+    a = numpy.asarray(a)
+    b = numpy.asarray(b)
+    dx = _time_units(b, dt / 2.)
+    x = numpy.searchsorted(b, a - dx, side='left')
+    y = numpy.searchsorted(b, a + dx, side='right')
+    n = y - x
+    ia = numpy.repeat(numpy.arange(a.size), n)
+    offset = numpy.repeat(numpy.cumsum(n) - n, n)
+    ib = numpy.arange(ia.size) - offset + numpy.repeat(x, n)
+    return ia, ib, b[ib] - a[ia]
 
 
 def veto(table, segmentlist):
@@ -317,30 +800,38 @@ def veto(table, segmentlist):
         segments
     """
     table.sort('time')
-    times = table['time']
+    vetoed = veto_mask(table['time'], segmentlist)
+    return table[~vetoed], table[vetoed]
+
+
+def veto_mask(times, segmentlist):
+    """Find which times fall inside any segment in a list
+
+    A time ``t`` will be vetoed if ``start <= t <= end`` for any veto
+    segment in the list.
+
+    Parameters
+    ----------
+    times : `numpy.ndarray`
+        the array of times to test, in seconds or integer nanoseconds
+    segmentlist : `~ligo.segments.segmentlist`
+        the list of veto segments to use, in seconds
+
+    Returns
+    -------
+    vetoed : `numpy.ndarray`
+        a boolean array, `True` for each time inside a veto segment
+    """
+    times = numpy.asarray(times)
     segmentlist = type(segmentlist)(segmentlist).coalesce()
-    keep = numpy.ones(times.shape[0], dtype=bool)
-    j = 0
-    a, b = segmentlist[j]
-    i = 0
-    while i < times.size:
-        t = times[i]
-        # if before start, move to next trigger now
-        if t < a:
-            i += 1
-            continue
-        # if after end, find the next segment and check this trigger again
-        if t > b:
-            j += 1
-            try:
-                a, b = segmentlist[j]
-                continue
-            except IndexError:
-                break
-        # otherwise it must be in this segment, record and move to next
-        keep[i] = False
-        i += 1
-    return table[keep], table[~keep]
+    if not segmentlist:
+        return numpy.zeros(times.shape, dtype=bool)
+    starts, ends = _time_units(
+        times, *numpy.asarray(segmentlist, dtype=float).T)
+    idx = numpy.searchsorted(starts, times, side='right') - 1
+    vetoed = idx >= 0
+    vetoed[vetoed] = times[vetoed] <= ends[idx[vetoed]]
+    return vetoed
 
 
 def veto_all(auxiliary, segmentlist):
@@ -363,7 +854,120 @@ def veto_all(auxiliary, segmentlist):
     core.veto
         for details on the veto algorithm itself
     """
-    channels = auxiliary.keys()
-    t = vstack_tables(list(auxiliary.values()))
-    keep, _ = veto(t, segmentlist)
-    return dict((c, keep[keep['channel'] == c]) for c in channels)
+    return dict((c, veto(t, segmentlist)[0]) for c, t in auxiliary.items())
+
+
+# -- pre-computed coincidences -----------------------------------------------
+
+def _count_unique(index):
+    """Count the unique values in a sorted integer array
+    """
+    if not index.size:
+        return 0
+    return int(numpy.count_nonzero(numpy.diff(index))) + 1
+
+
+def coincidence_rounds(primary, segments, auxiliary, snrs, windows, minsig,
+                       channel=None):
+    """Run the hierarchical round loop from pre-computed coincidences
+
+    Vetoed events are masked at the end of each round, rather than
+    removed, so no coincidences need to be re-computed.
+
+    Parameters
+    ----------
+    primary : `numpy.ndarray`
+        sorted array of primary event times
+    segments : `~gwpy.segments.SegmentList`
+        the analysis segments
+    auxiliary : `dict` of `dict`
+        the pre-computed coincidences for each auxiliary channel, each
+        entry should contain arrays for the auxiliary event ``'time'`` and
+        ``'snr'``, and the ``'primary'`` index, ``'auxiliary'`` index and
+        ``'lag'`` of each coincident pair (see :func:`coincident_pairs`),
+        computed with the largest window
+    snrs : `list` of `float`
+        the SNR thresholds to use
+    windows : `list` of `float`
+        the time windows to use
+    minsig : `float`
+        the minimum significance for a round
+    channel : `str`, optional
+        the name of the primary channel
+
+    Returns
+    -------
+    rounds : `list` of `HvetoRound`
+        the completed rounds, in order
+    vetoed_in_round : `numpy.ndarray`
+        the round in which each primary event was vetoed, or ``0`` if
+        it survived all rounds
+    """
+    primary = numpy.asarray(primary)
+    vetoed_in_round = numpy.zeros(primary.size, dtype=int)
+    alive = dict((c, numpy.ones(len(aux['time']), dtype=bool))
+                 for c, aux in auxiliary.items())
+    rounds = []
+    rnd = HvetoRound(1, channel, segments=segments)
+    while rnd.livetime:
+        palive = vetoed_in_round == 0
+        nprimary = int(palive.sum())
+        if not nprimary:
+            break
+
+        # count coincidences between surviving events
+        counts = {}
+        naux = {}
+        valid = {}
+        for c, aux in auxiliary.items():
+            valid[c] = keep = palive[aux['primary']]
+            keep &= alive[c][aux['auxiliary']]
+            pidx = aux['primary'][keep]
+            lag = numpy.abs(aux['lag'][keep])
+            snr = aux['snr'][aux['auxiliary'][keep]]
+            counts[c] = numpy.zeros((len(windows), len(snrs)), dtype=int)
+            for (i, dt), (j, thresh) in itertools.product(
+                    enumerate(windows), enumerate(snrs)):
+                counts[c][i, j] = _count_unique(
+                    pidx[(lag <= dt / 2.) & (snr >= thresh)])
+            naux[c] = threshold_counts(aux['snr'][alive[c]], snrs)
+        winner, _ = score_coincidences(counts, naux, nprimary, snrs,
+                                       windows, rnd.livetime)
+        if winner.significance < minsig:
+            break
+
+        # work out the vetoes for this round
+        aux = auxiliary[winner.name]
+        used = alive[winner.name] & (aux['snr'] >= winner.snr)
+        rnd.vetoes = winner.get_segments(aux['time'][used])
+        rnd.winner = winner
+        keep = valid[winner.name]
+        coinc = numpy.abs(aux['lag'][keep]) <= winner.window / 2.
+        coinc &= aux['snr'][aux['auxiliary'][keep]] >= winner.snr
+        aidx = aux['auxiliary'][keep][coinc]
+        rnd.use_percentage = (numpy.unique(aidx).size, int(used.sum()))
+
+        # mask vetoed events
+        vetoed = palive & veto_mask(primary, rnd.vetoes)
+        vetoed_in_round[vetoed] = rnd.n
+        for c, aux in auxiliary.items():
+            alive[c] &= ~veto_mask(aux['time'], rnd.vetoes)
+
+        # record results
+        rnd.efficiency = (int(vetoed.sum()), nprimary)
+        if rounds:
+            rnd.cum_efficiency = (
+                rnd.efficiency[0] + rounds[-1].cum_efficiency[0],
+                rounds[0].efficiency[1])
+            rnd.cum_deadtime = (
+                rnd.deadtime[0] + rounds[-1].cum_deadtime[0],
+                rounds[0].livetime)
+        else:
+            rnd.cum_efficiency = rnd.efficiency
+            rnd.cum_deadtime = rnd.deadtime
+
+        # move to the next round
+        rounds.append(rnd)
+        rnd = HvetoRound(rnd.n + 1, channel,
+                         segments=rnd.segments - rnd.vetoes)
+    return rounds, vetoed_in_round
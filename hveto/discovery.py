@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent caching of trigger file discovery
+
+Trigger archives are organised into GPS directories, each holding
+``10 ** 5`` seconds of files, so the files found for a given channel and
+trigger generator (or the channels processed) in a directory that is no
+longer being written to will never change. The `DiscoveryCache` records
+the results of searching each such GPS directory on disk, so that repeated
+analyses do not need to scan the archive again.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+import numpy
+
+from gwpy.io.cache import file_segment
+from gwpy.time import to_gps
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+
+#: directory in which to cache trigger file discovery, if not given
+DEFAULT_DISCOVERY_CACHE = os.getenv('HVETO_DISCOVERY_CACHE')
+
+#: width (seconds) of the GPS directories in a trigger archive
+GPS_DIRECTORY_WIDTH = 100000
+
+#: time (seconds) after the end of a GPS directory after which it is
+#: assumed to be complete
+DISCOVERY_LATENCY = 3600
+
+
+def _gps_blocks(start, end):
+    """Return the GPS directory numbers that overlap ``[start, end)``
+    """
+    first = int(start // GPS_DIRECTORY_WIDTH)
+    last = int(-(-end // GPS_DIRECTORY_WIDTH))
+    return range(first, last)
+
+
+def _directories(files):
+    """Return the local directories (and their parents) holding files
+    """
+    dirs = set()
+    for url in files:
+        path = Path(urlparse(url).path)
+        dirs.update((str(path.parent), str(path.parent.parent)))
+    return sorted(dirs)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class _IntervalIndex(object):
+    """Index of files by their (T050017) GPS segments
+
+    Files are sorted by start time, and a query only inspects those files
+    that start within one (maximum) file duration of the query interval.
+    """
+    def __init__(self, files):
+        files = list(OrderedDict.fromkeys(files))
+        segs = numpy.array([tuple(file_segment(f)) for f in files],
+                           dtype=float).reshape(-1, 2)
+        order = numpy.argsort(segs[:, 0], kind='stable')
+        self.files = [files[i] for i in order]
+        self.starts = segs[order, 0]
+        self.ends = segs[order, 1]
+        self.maxdur = (self.ends - self.starts).max() if len(files) else 0.
+
+    def search(self, start, end):
+        """Return the files that overlap ``[start, end)``, in time order
+        """
+        i = numpy.searchsorted(self.starts, start - self.maxdur, side='left')
+        j = numpy.searchsorted(self.starts, end, side='left')
+        return [self.files[k] for k in range(i, j)
+                if self.ends[k] > start]
+
+
+class DiscoveryCache(object):
+    """On-disk cache of the results of searching each GPS directory
+
+    Each search (e.g. for the trigger files of a given channel, trigger
+    generator, and finder options) has its own JSON record, mapping GPS
+    directory numbers to the results for that directory. Directories
+    that ended more than `DISCOVERY_LATENCY` seconds ago are cached
+    permanently, while the entry for a directory that is still being
+    written is revalidated against the modification times of the
+    directories that were searched.
+
+    Parameters
+    ----------
+    path : `str`
+        the directory in which to store the cache
+
+    now : `callable`, optional
+        function returning the current GPS time, default: the system clock
+    """
+    def __init__(self, path, now=None):
+        self.path = Path(path)
+        self.now = now or (lambda: float(to_gps('now')))
+        self._records = {}
+        self._indexes = {}
+
+    @staticmethod
+    def key(*args, **kwargs):
+        """Return the cache key for a search, e.g. ``(channel, etg)``
+        """
+        ident = json.dumps([list(map(str, args)), kwargs],
+                           sort_keys=True, default=str)
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+    def _record_path(self, key):
+        return self.path / '{}.json'.format(key)
+
+    def _load(self, key):
+        if key not in self._records:
+            try:
+                with open(self._record_path(key), 'r') as f:
+                    self._records[key] = json.load(f)
+            except (OSError, ValueError):  # missing or corrupt record
+                self._records[key] = {}
+        return self._records[key]
+
+    def _save(self, key):
+        self.path.mkdir(parents=True, exist_ok=True)
+        target = self._record_path(key)
+        tmp = target.with_name('.{}.{}'.format(target.name, os.getpid()))
+        with open(tmp, 'w') as f:
+            json.dump(self._records[key], f)
+        os.replace(tmp, target)
+
+    def _valid(self, entry):
+        if entry['complete']:
+            return True
+        # an empty, incomplete directory could gain results at any time
+        return bool(entry['values']) and all(
+            _mtime(d) == mtime for d, mtime in entry['mtimes'].items())
+
+    def search(self, key, blocks, query, nproc=1):
+        """Return the results of searching each GPS directory
+
+        Parameters
+        ----------
+        key : `str`
+            the key for this search, see `DiscoveryCache.key`
+
+        blocks : `list` of `int`
+            the GPS directory numbers to search
+
+        query : `callable`
+            function taking a GPS directory number and returning the
+            `list` of results and the `list` of directories searched
+
+        nproc : `int`, optional
+            the number of threads with which to run ``query`` for
+            those directories not already cached, default: ``1``
+
+        Returns
+        -------
+        results : `dict` of `list`
+            the results for each GPS directory
+        """
+        record = self._load(key)
+        todo = [b for b in blocks if not (
+            str(b) in record and self._valid(record[str(b)]))]
+        if todo:
+            now = self.now()
+            with ThreadPoolExecutor(max_workers=max(nproc, 1)) as executor:
+                for block, (values, dirs) in zip(todo,
+                                                 executor.map(query, todo)):
+                    bend = (block + 1) * GPS_DIRECTORY_WIDTH
+                    complete = bend + DISCOVERY_LATENCY <= now
+                    record[str(block)] = {
+                        'values': list(values),
+                        'complete': complete,
+                        'mtimes': {} if complete else dict(
+                            (d, _mtime(d)) for d in dirs),
+                    }
+            self._save(key)
+            self._indexes.pop(key, None)
+        return dict((b, record[str(b)]['values']) for b in blocks)
+
+    def find(self, finder, channel, etg, start, end, **kwargs):
+        """Find the trigger files for a channel overlapping ``[start, end)``
+
+        Parameters
+        ----------
+        finder : `callable`
+            the function used to search an archive, with the same
+            signature as `gwtrigfind.find_trigger_files`
+
+        channel : `str`
+            name of channel to find
+
+        etg : `str`
+            name of event trigger generator to find
+
+        start : `float`
+            GPS start time of search
+
+        end : `float`
+            GPS end time of search
+
+        **kwargs
+            all other keyword arguments are passed to ``finder``
+
+        Returns
+        -------
+        files : `list` of `str`
+            the URLs of the files found, in time order
+        """
+        def _query(block):
+            bstart = block * GPS_DIRECTORY_WIDTH
+            files = list(finder(channel, etg, bstart,
+                                bstart + GPS_DIRECTORY_WIDTH, **kwargs))
+            return files, _directories(files)
+
+        key = self.key(channel, str(etg).lower(), **kwargs)
+        self.search(key, _gps_blocks(start, end), _query)
+        if key not in self._indexes:
+            self._indexes[key] = _IntervalIndex(
+                f for entry in self._load(key).values()
+                for f in entry['values'])
+        return self._indexes[key].search(start, end)
+
+
+_DISCOVERY_CACHES = {}
+
+
+def get_discovery_cache(path):
+    """Return the (shared) `DiscoveryCache` for a directory
+    """
+    path = os.path.abspath(os.path.expanduser(str(path)))
+    try:
+        return _DISCOVERY_CACHES[path]
+    except KeyError:
+        cache = _DISCOVERY_CACHES[path] = DiscoveryCache(path)
+        return cache
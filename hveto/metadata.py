@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent cache of trigger file metadata
+
+The first time a trigger file is read, the number of rows, the time
+span, the loudest SNR, and the available columns are recorded in an
+SQLite database, keyed by the file path and the options used to read it.
+Records are only used while the size and modification time of the file
+are unchanged, and allow later reads (by `hveto` or `hveto-cache-events`)
+to skip files that cannot contain any events that pass the cuts, without
+opening them.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from urllib.parse import urlparse
+
+import numpy
+
+from .core import ns_to_gps
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+
+#: path of the trigger file metadata database, if not given
+DEFAULT_METADATA_CACHE = os.getenv('HVETO_METADATA_CACHE')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    path TEXT NOT NULL,
+    options TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    rows INTEGER,
+    tmin REAL,
+    tmax REAL,
+    maxsnr REAL,
+    columns TEXT,
+    PRIMARY KEY (path, options)
+)
+"""
+
+
+def _local_path(path):
+    return urlparse(str(path)).path
+
+
+def _options(options):
+    return json.dumps(options or {}, sort_keys=True, default=str)
+
+
+def skip_file(metadata, segments=None, snr=None):
+    """Return `True` if a file cannot contain events that pass all cuts
+
+    Parameters
+    ----------
+    metadata : `dict`
+        the metadata for the file, see `FileMetadataCache.get`
+
+    segments : `~gwpy.segments.SegmentList`, optional
+        the segments in which to keep events
+
+    snr : `float`, optional
+        the minimum SNR of events to keep
+
+    Returns
+    -------
+    skip : `bool`
+        `True` if the file holds no events, or no events louder than
+        ``snr``, or no events in the ``segments``
+    """
+    if metadata['rows'] == 0:
+        return True
+    if snr is not None and metadata['maxsnr'] is not None:
+        if metadata['maxsnr'] < snr:
+            return True
+    if segments is not None and metadata['tmin'] is not None:
+        tmin, tmax = metadata['tmin'], metadata['tmax']
+        return not any(a <= tmax and tmin < b for a, b in segments)
+    return False
+
+
+class FileMetadataCache(object):
+    """SQLite-backed cache of trigger file metadata
+
+    Parameters
+    ----------
+    path : `str`
+        the path of the database file, created if needed
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(str(path)))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=60,
+                                   check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(_SCHEMA)
+
+    @staticmethod
+    def _stat(path):
+        stat = os.stat(_local_path(path))
+        return stat.st_size, stat.st_mtime_ns
+
+    def get(self, path, options=None):
+        """Return the metadata for a file, if known and up to date
+
+        Parameters
+        ----------
+        path : `str`
+            the path of the file
+
+        options : `dict`, optional
+            the options used to read the file
+
+        Returns
+        -------
+        metadata : `dict` or `None`
+            a `dict` with keys ``'rows'``, ``'tmin'``, ``'tmax'``,
+            ``'maxsnr'``, and ``'columns'``, or `None` if the file has
+            not been recorded (or has changed since)
+        """
+        try:
+            size, mtime = self._stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT rows, tmin, tmax, maxsnr, columns FROM metadata "
+                "WHERE path = ? AND options = ? AND size = ? AND mtime = ?",
+                (str(path), _options(options), size, mtime),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'rows': row[0],
+            'tmin': row[1],
+            'tmax': row[2],
+            'maxsnr': row[3],
+            'columns': json.loads(row[4]) if row[4] else None,
+        }
+
+    def set(self, path, options=None, rows=None, tmin=None, tmax=None,
+            maxsnr=None, columns=None):
+        """Record the metadata for a file
+        """
+        size, mtime = self._stat(path)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO metadata VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(path), _options(options), size, mtime, rows,
+                 tmin, tmax, maxsnr,
+                 json.dumps(list(columns)) if columns is not None else None),
+            )
+
+    def set_table(self, path, table, options=None):
+        """Record the metadata for a file from the (full) table read from it
+
+        The first and third columns of the ``table`` are taken to be the
+        time and SNR-like columns, respectively, integer times are taken
+        to be in nanoseconds (see `hveto.core.gps_to_ns`).
+        """
+        columns = table.dtype.names
+        kwargs = {}
+        if len(table):
+            times = numpy.asarray(table[columns[0]])
+            if numpy.issubdtype(times.dtype, numpy.integer):
+                times = ns_to_gps(times)
+            kwargs = {
+                'tmin': float(times.min()),
+                'tmax': float(times.max()),
+                'maxsnr': float(table[columns[2]].max()),
+            }
+        self.set(path, options=options, rows=len(table), columns=columns,
+                 **kwargs)
+
+
+_METADATA_CACHES = {}
+
+
+def get_metadata_cache(path=None):
+    """Return the (shared) `FileMetadataCache` for a database path
+
+    Returns `None` if no ``path`` is given and the ``HVETO_METADATA_CACHE``
+    environment variable is not set.
+    """
+    path = path or DEFAULT_METADATA_CACHE
+    if not path:
+        return None
+    # connections cannot be shared with forked processes
+    key = (os.path.abspath(os.path.expanduser(str(path))), os.getpid())
+    try:
+        return _METADATA_CACHES[key]
+    except KeyError:
+        cache = _METADATA_CACHES[key] = FileMetadataCache(key[0])
+        return cache
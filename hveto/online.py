@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Incremental (online) hveto analysis
+
+The :class:`HvetoOnline` object holds the primary and auxiliary triggers
+for an analysis in memory, alongside the running coincidence statistics
+for the first round. New trigger files are ingested as they appear, and
+the statistics are updated only for those primary events that could be
+affected by the new data.
+"""
+
+import numpy
+
+from astropy.table import vstack as vstack_tables
+
+from gwpy.io.cache import cache_segments
+from gwpy.io.utils import file_list
+from gwpy.segments import (Segment, SegmentList)
+from gwpy.table.filters import in_segmentlist
+
+from . import core
+from .triggers import (CacheCatalog, cluster_triggers, get_triggers)
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+
+
+class HvetoOnline(object):
+    """In-memory trigger store with incrementally updated coincidences
+
+    Parameters
+    ----------
+    channel : `str`
+        name of the primary channel
+
+    etg : `str`
+        name of the primary event trigger generator
+
+    auxchannels : `list` of `str`
+        names of the auxiliary channels
+
+    auxetg : `str`
+        name of the auxiliary event trigger generator
+
+    snrs : `list` of `float`
+        the SNR thresholds to use
+
+    windows : `list` of `float`
+        the time windows to use
+
+    analysis : `~gwpy.segments.SegmentList`, optional
+        the analysis segments, livetime outside of these segments is
+        ignored, default: use all times covered by primary trigger files
+
+    psnr : `float`, optional
+        the SNR threshold for primary events
+
+    pfreq : `tuple` of `float`, optional
+        the frequency range for primary events
+
+    auxfreq : `tuple` of `float`, optional
+        the frequency range for auxiliary events
+
+    preadkw : `dict`, optional
+        keyword arguments to pass to `~hveto.triggers.get_triggers`
+        when reading primary triggers
+
+    areadkw : `dict`, optional
+        keyword arguments to pass to `~hveto.triggers.get_triggers`
+        when reading auxiliary triggers
+
+    clusterkw : `dict`, optional
+        keyword arguments to pass to `~hveto.triggers.cluster_triggers`
+        to cluster primary events, as for the ``cluster-`` options of
+        the ``[primary]`` section of the configuration
+    """
+    def __init__(self, channel, etg, auxchannels, auxetg, snrs, windows,
+                 analysis=None, psnr=None, pfreq=None, auxfreq=None,
+                 preadkw=None, areadkw=None, clusterkw=None):
+        self.channel = channel
+        self.etg = etg
+        self.auxchannels = sorted(set(auxchannels))
+        self.auxetg = auxetg
+        self.snrs = list(snrs)
+        self.windows = list(windows)
+        self.analysis = analysis
+        self.psnr = psnr
+        self.pfreq = pfreq
+        self.auxfreq = auxfreq
+        self.preadkw = dict(preadkw or {})
+        self.areadkw = dict(areadkw or {})
+        self.clusterkw = dict(clusterkw or {})
+
+        self.segments = SegmentList()
+        self.primary = None
+        self._unclustered = None
+        self.auxiliary = {}
+        self.counts = dict(
+            (c, numpy.zeros((len(self.windows), len(self.snrs)), dtype=int))
+            for c in self.auxchannels)
+        self.naux = dict(
+            (c, numpy.zeros(len(self.snrs), dtype=int))
+            for c in self.auxchannels)
+        self._seen = set()
+
+    # -- ingestion ------------------------------
+
+    def _crop(self, segments):
+        segments = SegmentList(segments).coalesce()
+        if self.analysis is not None:
+            segments &= self.analysis
+        return segments
+
+    def _read(self, channel, etg, cache, **kwargs):
+        segments = self._crop(cache_segments(cache))
+        if not abs(segments):
+            return None
+        return get_triggers(channel, etg, segments, cache=cache, **kwargs)
+
+    @staticmethod
+    def _append(old, new):
+        if new is None or not len(new):
+            return old
+        if old is None or not len(old):
+            return new
+        table = vstack_tables([old, new])
+        table.sort('time')
+        return table
+
+    def _cluster(self, table):
+        if table is None or not len(table):
+            return table
+        table = cluster_triggers(table, **self.clusterkw)
+        table.sort('time')
+        return table
+
+    def _accumulate(self, dirty, sign=1):
+        """Add (or subtract) the coincidences for primaries in ``dirty``
+        """
+        if self.primary is None or not len(self.primary):
+            return
+        times = self.primary['time']
+        ptimes = numpy.asarray(times[in_segmentlist(times, dirty)])
+        if not ptimes.size:
+            return
+        for channel, table in self.auxiliary.items():
+            self.counts[channel] += sign * core.coincidence_counts(
+                ptimes,
+                numpy.asarray(table['time']),
+                numpy.asarray(table['snr']),
+                self.snrs,
+                self.windows,
+            )
+
+    def update(self, primary_files=(), auxiliary_files=()):
+        """Ingest any new trigger files and update the statistics
+
+        Files that have already been read are ignored, so it is safe
+        to pass the full (growing) list of available files each time.
+
+        Parameters
+        ----------
+        primary_files : `list` of `str`
+            the list of files containing primary channel triggers
+
+        auxiliary_files : `list` of `str`
+            the list of files containing auxiliary channel triggers,
+            each filename must start with the T050017-formatted
+            channel name
+
+        Returns
+        -------
+        updated : `bool`
+            `True` if any new files were read, otherwise `False`
+        """
+        pnew = [f for f in file_list(primary_files) if f not in self._seen]
+        anew = [f for f in file_list(auxiliary_files) if f not in self._seen]
+        if not pnew and not anew:
+            return False
+
+        # work out which primary events could be affected by the new data
+        dx = max(self.windows) / 2.
+        dirty = SegmentList(
+            type(seg)(seg[0] - dx, seg[1] + dx) for
+            seg in self._crop(cache_segments(pnew + anew))).coalesce()
+        if pnew and self.clusterkw:
+            # new primary events can change clustering anywhere
+            dirty = SegmentList([Segment(-numpy.inf, numpy.inf)])
+        self._accumulate(dirty, sign=-1)
+
+        # read new primary triggers
+        if pnew:
+            new = self._read(self.channel, self.etg, pnew, snr=self.psnr,
+                             frange=self.pfreq, **self.preadkw)
+            if self.clusterkw:
+                self._unclustered = self._append(self._unclustered, new)
+                self.primary = self._cluster(self._unclustered)
+            else:
+                self.primary = self._append(self.primary, new)
+            self.segments = (
+                self.segments | self._crop(cache_segments(pnew))).coalesce()
+
+        # read new auxiliary triggers
+        catalog = CacheCatalog(anew)
+        for channel in self.auxchannels:
+            cache = catalog.files(channel)
+            if not cache:
+                continue
+            new = self._read(channel, self.auxetg, cache, snr=min(self.snrs),
+                             frange=self.auxfreq, **self.areadkw)
+            if new is None or not len(new):
+                continue
+            self.auxiliary[channel] = self._append(
+                self.auxiliary.get(channel), new)
+            self.naux[channel] += core.threshold_counts(
+                numpy.asarray(new['snr']), self.snrs)
+
+        self._accumulate(dirty, sign=1)
+        self._seen.update(pnew)
+        self._seen.update(anew)
+        return True
+
+    # -- analysis -------------------------------
+
+    def rounds(self, minsig, snrs=None, windows=None, channels=None):
+        """Derive the hveto rounds from the current trigger store
+
+        The first round is scored directly from the running statistics,
+        unless different thresholds or channels are requested, later
+        rounds are re-computed from the in-memory triggers.
+
+        Parameters
+        ----------
+        minsig : `float`
+            the minimum significance for a round
+
+        snrs : `list` of `float`, optional
+            the SNR thresholds to use, default: as given on creation
+
+        windows : `list` of `float`, optional
+            the time windows to use, default: as given on creation
+
+        channels : `list` of `str`, optional
+            a subset of auxiliary channels to use, default: all
+
+        Returns
+        -------
+        rounds : `list` of `~hveto.core.HvetoRound`
+            the completed rounds, in order
+        """
+        reuse = snrs is None and windows is None
+        snrs = self.snrs if snrs is None else list(snrs)
+        windows = self.windows if windows is None else list(windows)
+        if channels is None:
+            channels = self.auxchannels
+        primary = self.primary
+        auxiliary = dict((c, self.auxiliary[c]) for c in channels if
+                         len(self.auxiliary.get(c, [])))
+
+        rounds = []
+        rnd = core.HvetoRound(1, self.channel, segments=self.segments)
+        while primary is not None and len(primary) and auxiliary:
+            if not rnd.livetime:
+                break
+            if reuse and rnd.n == 1:
+                counts = dict((c, self.counts[c]) for c in auxiliary)
+                naux = dict((c, self.naux[c]) for c in auxiliary)
+            else:
+                ptimes = numpy.asarray(primary['time'])
+                counts = {}
+                naux = {}
+                for c, table in auxiliary.items():
+                    asnr = numpy.asarray(table['snr'])
+                    counts[c] = core.coincidence_counts(
+                        ptimes, numpy.asarray(table['time']), asnr,
+                        snrs, windows)
+                    naux[c] = core.threshold_counts(asnr, snrs)
+            winner, _ = core.score_coincidences(
+                counts, naux, len(primary), snrs, windows, rnd.livetime)
+            if winner.significance < minsig:
+                break
+
+            # work out the vetoes for this round
+            allaux = auxiliary[winner.name][
+                auxiliary[winner.name]['snr'] >= winner.snr]
+            winner.events = allaux
+            coincs = allaux[core.find_coincidences(
+                allaux['time'], primary['time'], dt=winner.window)]
+            rnd.vetoes = winner.get_segments(allaux['time'])
+            rnd.winner = winner
+
+            # apply vetoes and record results
+            primary, vetoed = core.veto(primary, rnd.vetoes)
+            rnd.efficiency = (len(vetoed), len(primary) + len(vetoed))
+            rnd.use_percentage = (len(coincs), len(winner.events))
+            if rounds:
+                rnd.cum_efficiency = (
+                    len(vetoed) + rounds[-1].cum_efficiency[0],
+                    rounds[0].efficiency[1])
+                rnd.cum_deadtime = (
+                    rnd.deadtime[0] + rounds[-1].cum_deadtime[0],
+                    rounds[0].livetime)
+            else:
+                rnd.cum_efficiency = rnd.efficiency
+                rnd.cum_deadtime = rnd.deadtime
+            auxiliary = dict(
+                (c, t) for c, t in core.veto_all(auxiliary, rnd.vetoes).items()
+                if len(t))
+
+            # move to the next round
+            rounds.append(rnd)
+            rnd = core.HvetoRound(rnd.n + 1, self.channel,
+                                  segments=rnd.segments - rnd.vetoes)
+        return rounds
@@ -17,29 +17,61 @@
 # along with hveto.  If not, see <http://www.gnu.org/licenses/>.
 
 """Segment utilities for hveto
+
+If the ``HVETO_SEGMENT_CACHE`` environment variable names a directory,
+the results of segment database queries made by `query_flag` and
+`populate` are recorded there (see `SegmentCache`), so that segments for
+times in the past are only fetched from the server once. Downloaded
+veto-definer files, and the flags parsed from them, are also cached
+there by `read_veto_definer_file`.
 """
 
 from __future__ import print_function
 
+import configparser
+import hashlib
+import json
+import logging
 import os
 import os.path
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
+from pathlib import Path
 
 try:
+    from urllib.error import (HTTPError, URLError)
     from urllib.parse import urlparse
-    from urllib.request import urlopen
+    from urllib.request import (Request, urlopen)
 except ImportError:  # python < 3
     from urlparse import urlparse
-    from urllib2 import urlopen
+    from urllib2 import (HTTPError, Request, URLError, urlopen)
+
+import numpy
 
-from gwpy.segments import (DataQualityFlag, DataQualityDict)
+from gwpy.segments import (Segment, SegmentList,
+                           DataQualityFlag, DataQualityDict)
+from gwpy.time import to_gps
 
 __author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
 __credits__ = 'Joshua Smith <joshua.smith@ligo.org>'
 
+LOGGER = logging.getLogger(__name__)
+
 DEFAULT_SEGMENT_SERVER = os.getenv('DEFAULT_SEGMENT_SERVER',
                                    'https://segments.ligo.org')
 
+#: directory in which to cache segment queries, if not given
+DEFAULT_SEGMENT_CACHE = os.getenv('HVETO_SEGMENT_CACHE')
+
+#: width (seconds) of the GPS chunks in which segments are cached
+SEGMENT_CHUNK_WIDTH = 100000
+
+#: time (seconds) before the present after which segments are not cached,
+#: as they may still be updated
+SEGMENT_LATENCY = 86400
+
 
 def integer_segments(f):
     @wraps(f)
@@ -51,11 +83,304 @@ def integer_segments(f):
     return decorated_method
 
 
+def _segmentlist(segments):
+    return SegmentList(Segment(float(a), float(b)) for a, b in segments)
+
+
+def _chunks(segments):
+    """Return the GPS chunk numbers that overlap a segment list
+    """
+    chunks = set()
+    for start, end in segments:
+        chunks.update(range(int(start // SEGMENT_CHUNK_WIDTH),
+                            int(-(-end // SEGMENT_CHUNK_WIDTH))))
+    return sorted(chunks)
+
+
+class SegmentCache(object):
+    """On-disk cache of segment database queries
+
+    The known and active segments of each flag are recorded in one JSON
+    file per GPS chunk of `SEGMENT_CHUNK_WIDTH` seconds, along with the
+    segments that have been queried. A query then only asks the server
+    for those times not already recorded. Times less than
+    `SEGMENT_LATENCY` seconds ago are never recorded.
+
+    Parameters
+    ----------
+    path : `str`
+        the directory in which to store the cache
+
+    now : `callable`, optional
+        function returning the current GPS time, default: the system clock
+    """
+    def __init__(self, path, now=None):
+        self.path = Path(path)
+        self.now = now or (lambda: float(to_gps('now')))
+
+    def _record_path(self, flag, url, chunk):
+        key = hashlib.sha1(json.dumps([flag, url]).encode('utf-8'))
+        return self.path / key.hexdigest() / '{}.json'.format(chunk)
+
+    def _load(self, flag, url, chunk):
+        try:
+            with open(self._record_path(flag, url, chunk), 'r') as f:
+                record = json.load(f)
+        except (OSError, ValueError):  # missing or corrupt record
+            record = {}
+        return dict((key, _segmentlist(record.get(key, [])))
+                    for key in ('queried', 'known', 'active'))
+
+    def _save(self, flag, url, chunk, record):
+        target = self._record_path(flag, url, chunk)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name('.{}.{}'.format(target.name, os.getpid()))
+        out = dict((key, [[float(a), float(b)] for a, b in segs])
+                   for key, segs in record.items())
+        out['flag'] = flag
+        with open(tmp, 'w') as f:
+            json.dump(out, f)
+        os.replace(tmp, target)
+
+    def query(self, flag, segments, url=DEFAULT_SEGMENT_SERVER, **kwargs):
+        """Query for the segments of a flag, using the cache where possible
+
+        Parameters
+        ----------
+        flag : `str`
+            the name of the flag
+
+        segments : `~gwpy.segments.SegmentList`
+            the segments over which to query
+
+        url : `str`, optional
+            the URL of the segment database
+
+        **kwargs
+            other keyword arguments are passed to `DataQualityFlag.query`
+
+        Returns
+        -------
+        flag : `~gwpy.segments.DataQualityFlag`
+            the known and active segments of the flag, restricted to the
+            ``segments`` queried
+        """
+        request = _segmentlist(segments).coalesce()
+        chunks = _chunks(request)
+        records = dict((c, self._load(flag, url, c)) for c in chunks)
+        queried = SegmentList()
+        for record in records.values():
+            queried.extend(record['queried'])
+        missing = request - queried.coalesce()
+
+        out = DataQualityFlag(flag)
+        final = self.now() - SEGMENT_LATENCY
+        changed = set()
+        for start, end in missing:
+            new = DataQualityFlag.query(flag, start, end, url=url, **kwargs)
+            out.known.extend(new.known)
+            out.active.extend(new.active)
+            for chunk in _chunks([(start, end)]):
+                span = Segment(
+                    max(start, chunk * SEGMENT_CHUNK_WIDTH),
+                    min(end, (chunk + 1) * SEGMENT_CHUNK_WIDTH, final))
+                if span[1] <= span[0]:
+                    continue
+                span = SegmentList([span])
+                record = records[chunk]
+                record['queried'] = (record['queried'] | span).coalesce()
+                record['known'] = (record['known'] | (
+                    new.known & span)).coalesce()
+                record['active'] = (record['active'] | (
+                    new.active & span)).coalesce()
+                changed.add(chunk)
+        for chunk in changed:
+            self._save(flag, url, chunk, records[chunk])
+
+        # merge the recorded segments with those just fetched
+        cached = request & queried.coalesce()
+        for record in records.values():
+            out.known.extend(record['known'] & cached)
+            out.active.extend(record['active'] & cached)
+        out.known = out.known.coalesce()
+        out.active = out.active.coalesce()
+        return out
+
+
+def query_flag(flag, start, end, url=DEFAULT_SEGMENT_SERVER,
+               cache=DEFAULT_SEGMENT_CACHE):
+    """Query a segment database for the segments of a flag
+
+    Parameters
+    ----------
+    flag : `str`
+        the name of the flag
+
+    start : `float`
+        the GPS start time of the query
+
+    end : `float`
+        the GPS end time of the query
+
+    url : `str`, optional
+        the URL of the segment database
+
+    cache : `str`, or `SegmentCache`, optional
+        the directory in which to cache queries, or an existing cache,
+        default: the ``HVETO_SEGMENT_CACHE`` environment variable, if set
+
+    Returns
+    -------
+    flag : `~gwpy.segments.DataQualityFlag`
+        the known and active segments of the flag
+    """
+    if cache is None:
+        return DataQualityFlag.query(flag, start, end, url=url)
+    if not isinstance(cache, SegmentCache):
+        cache = SegmentCache(cache)
+    return cache.query(flag, [(start, end)], url=url)
+
+
+def _is_segment_server(url):
+    """Return `True` if a URL names a segment database (not a file)
+    """
+    parsed = urlparse(url)
+    return bool(parsed.netloc) and parsed.path in ('', '/')
+
+
+def populate(vdf, url=DEFAULT_SEGMENT_SERVER, segments=None, on_error='raise',
+             cache=DEFAULT_SEGMENT_CACHE, nproc=1):
+    """Query a segment database for the segments of each flag in a dict
+
+    This mirrors `DataQualityDict.populate`, but queries for (up to)
+    ``nproc`` flags at a time, each in its own thread, and through a
+    `SegmentCache`, if given.
+
+    Parameters
+    ----------
+    vdf : `~gwpy.segments.DataQualityDict`
+        the flags to populate, e.g. from a veto-definer file, modified
+        in-place
+
+    url : `str`, optional
+        the URL of the segment database
+
+    segments : `~gwpy.segments.SegmentList`, optional
+        the segments over which to query, default: the known segments of
+        each flag
+
+    on_error : `str`, optional
+        how to handle an error querying for one flag, one of ``'raise'``,
+        ``'warn'``, or ``'ignore'``
+
+    cache : `str`, or `SegmentCache`, optional
+        the directory in which to cache queries, or an existing cache,
+        default: the ``HVETO_SEGMENT_CACHE`` environment variable, if set
+
+    nproc : `int`, optional
+        the number of flags to query at once, default: ``1``
+
+    Returns
+    -------
+    vdf : `~gwpy.segments.DataQualityDict`
+        the same dict, populated
+    """
+    if not _is_segment_server(url):  # read from a file
+        return vdf.populate(source=url, segments=segments, on_error=on_error)
+    if cache is not None and not isinstance(cache, SegmentCache):
+        cache = SegmentCache(cache)
+    if segments is not None:
+        segments = _segmentlist(segments).coalesce()
+
+    def _populate(key):
+        flag = vdf[key]
+        qsegs = segments if segments is not None else flag.known
+        tstart = time.time()
+        try:
+            if cache is None:
+                new = DataQualityFlag.query(flag.name, qsegs, url=url)
+            else:
+                new = cache.query(flag.name, qsegs, url=url)
+        except OSError as exc:  # includes requests.RequestException
+            if on_error == 'raise':
+                raise
+            if on_error == 'warn':
+                warnings.warn("Error querying for '{}': {}".format(key, exc))
+            return
+        LOGGER.debug("Populated %s with %d segments in %.2fs"
+                     % (key, len(new.active), time.time() - tstart))
+        flag.known &= new.known
+        flag.active = new.active
+        flag.pad(inplace=True)
+        if segments is not None:
+            flag.known &= segments
+            flag.active &= segments
+
+    with ThreadPoolExecutor(max_workers=max(nproc, 1)) as executor:
+        list(executor.map(_populate, list(vdf)))
+    return vdf
+
+
+def union_segments(segmentlists):
+    """Return the (coalesced) union of many segment lists at once
+
+    This is equivalent to combining the lists one at a time with ``|``,
+    but sorts and merges all segments in a single pass.
+
+    Parameters
+    ----------
+    segmentlists : iterable of `~gwpy.segments.SegmentList`
+        the lists to combine
+
+    Returns
+    -------
+    union : `~gwpy.segments.SegmentList`
+        the union of all segments
+    """
+    segs = numpy.array([tuple(seg) for segl in segmentlists for seg in segl],
+                       dtype=float).reshape(-1, 2)
+    segs = segs[segs[:, 1] > segs[:, 0]]
+    if not len(segs):
+        return SegmentList()
+    segs = segs[numpy.argsort(segs[:, 0], kind='stable')]
+    ends = numpy.maximum.accumulate(segs[:, 1])
+    # a new segment starts wherever a start is after all previous ends
+    first = numpy.flatnonzero(numpy.r_[True, segs[1:, 0] > ends[:-1]])
+    last = numpy.r_[first[1:] - 1, len(segs) - 1]
+    return SegmentList(Segment(a, b) for a, b in
+                       zip(segs[first, 0], ends[last]))
+
+
+def union_flags(name, flags):
+    """Return the union of many flags as a single flag
+
+    Parameters
+    ----------
+    name : `str`
+        the name of the new flag
+
+    flags : iterable of `~gwpy.segments.DataQualityFlag`
+        the flags to combine
+
+    Returns
+    -------
+    flag : `~gwpy.segments.DataQualityFlag`
+        a new flag whose known and active segments are the union of those
+        of all ``flags``
+    """
+    flags = list(flags)
+    return DataQualityFlag(
+        name,
+        known=union_segments(f.known for f in flags),
+        active=union_segments(f.active for f in flags),
+    )
+
+
 @integer_segments
 def query(flag, start, end, url=DEFAULT_SEGMENT_SERVER):
     """Query a segment database for active segments associated with a flag
     """
-    return DataQualityFlag.query(flag, start, end, url=url)
+    return query_flag(flag, start, end, url=url)
 
 
 def write_ascii(outfile, segmentlist, ncol=4):
@@ -71,13 +396,242 @@ def write_ascii(outfile, segmentlist, ncol=4):
                 print("%d\t%f\t%f\t%f" % (i, seg[0], seg[1], abs(seg)), file=f)
 
 
-def read_veto_definer_file(vetofile, start=None, end=None, ifo=None):
+def _atomic_write(target, data):
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name('.{}.{}'.format(target.name, os.getpid()))
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, target)
+
+
+def _download(url, cache):
+    """Download a file, revalidating any copy in a cache directory
+
+    Each download is stored under the SHA-256 hash of its content, with a
+    record (per URL) of that hash and the ``ETag`` and ``Last-Modified``
+    headers of the response, which are sent with the next request for
+    the same URL so that the server can answer ``304 Not Modified``.
+    If the server cannot be reached, or answers with an error, the cached
+    copy is used.
+
+    Returns the path of the cached copy.
+    """
+    cache = Path(cache) / 'vdf'
+    record_path = cache / '{}.json'.format(
+        hashlib.sha1(url.encode('utf-8')).hexdigest())
+    try:
+        with open(record_path, 'r') as f:
+            record = json.load(f)
+        cached = cache / '{}.xml'.format(record['sha256'])
+        if not cached.is_file():
+            raise OSError("missing {}".format(cached))
+    except (OSError, ValueError, KeyError):  # no (valid) cached copy
+        record = cached = None
+
+    request = Request(url)
+    if record is not None:
+        if record.get('etag'):
+            request.add_header('If-None-Match', record['etag'])
+        if record.get('last_modified'):
+            request.add_header('If-Modified-Since', record['last_modified'])
+    try:
+        response = urlopen(request)
+    except HTTPError as exc:
+        if cached is None:
+            raise
+        if exc.code != 304:  # not 'Not Modified'
+            warnings.warn("Failed to download {} ({}), using cached "
+                          "copy".format(url, exc))
+        return cached
+    except URLError as exc:
+        if cached is None:
+            raise
+        warnings.warn("Failed to download {} ({}), using cached copy".format(
+            url, exc.reason))
+        return cached
+    with response:
+        content = response.read()
+        headers = response.headers
+    digest = hashlib.sha256(content).hexdigest()
+    cached = cache / '{}.xml'.format(digest)
+    _atomic_write(cached, content)
+    _atomic_write(record_path, json.dumps({
+        'url': url,
+        'sha256': digest,
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+    }).encode('utf-8'))
+    return cached
+
+
+def _flag_record(flag):
+    """Return a JSON-serialisable record of a veto-definer flag
+    """
+    return {
+        'name': flag.name,
+        'category': None if flag.category is None else int(flag.category),
+        'description': flag.description,
+        'padding': [float(p) for p in flag.padding],
+        'known': [[float(a), float(b)] for a, b in flag.known],
+    }
+
+
+def read_veto_definer_file(vetofile, start=None, end=None, ifo=None,
+                           cache=DEFAULT_SEGMENT_CACHE):
     """Read a veto definer file, downloading it if necessary
+
+    Parameters
+    ----------
+    vetofile : `str`
+        the path or URL of the veto-definer file, remote files are
+        downloaded to the ``cache`` directory, if given, otherwise to
+        the current directory
+
+    start : `float`, optional
+        the GPS start time of flags to read
+
+    end : `float`, optional
+        the GPS end time of flags to read
+
+    ifo : `str`, optional
+        the interferometer prefix of flags to read
+
+    cache : `str`, optional
+        a directory in which to cache downloads (revalidated with the
+        server on each call) and the flags parsed from each file (keyed by
+        the hash of its content), default: the ``HVETO_SEGMENT_CACHE``
+        environment variable, if set
+
+    Returns
+    -------
+    flags : `~gwpy.segments.DataQualityDict`
+        the (unpopulated) flags defined in the file
     """
-    if urlparse(vetofile).netloc:
-        tmp = urlopen(vetofile)
+    remote = bool(urlparse(vetofile).netloc)
+    if remote and cache is None:
+        content = urlopen(vetofile).read()
         vetofile = os.path.abspath(os.path.basename(vetofile))
-        with open(vetofile, 'w') as f:
-            f.write(str(tmp.read()))
-    return DataQualityDict.from_veto_definer_file(
-        vetofile, format='ligolw', start=start, end=end, ifo=ifo)
+        with open(vetofile, 'wb') as f:
+            f.write(content)
+    elif remote:
+        vetofile = str(_download(vetofile, cache))
+    if cache is None:
+        return DataQualityDict.from_veto_definer_file(
+            vetofile, format='ligolw', start=start, end=end, ifo=ifo)
+
+    # read the flags parsed from this content before, if possible
+    with open(vetofile, 'rb') as f:
+        content = f.read()
+    key = hashlib.sha1(json.dumps([
+        hashlib.sha256(content).hexdigest(), start, end, ifo,
+    ], default=str).encode('utf-8')).hexdigest()
+    parsed = Path(cache) / 'vdf' / 'parsed-{}.json'.format(key)
+    try:
+        with open(parsed, 'r') as f:
+            records = json.load(f)
+    except (OSError, ValueError):  # not yet parsed
+        vdf = DataQualityDict.from_veto_definer_file(
+            vetofile, format='ligolw', start=start, end=end, ifo=ifo)
+        _atomic_write(parsed, json.dumps(
+            [_flag_record(flag) for flag in vdf.values()]).encode('utf-8'))
+        return vdf
+    vdf = DataQualityDict()
+    for record in records:
+        vdf[record['name']] = DataQualityFlag(
+            record['name'],
+            known=_segmentlist(record['known']),
+            category=record['category'],
+            description=record['description'],
+            padding=tuple(record['padding']),
+        )
+    return vdf
+
+
+def analysis_segments(cp, start, end, ifo=None, files=None, nproc=1):
+    """Prepare the analysis segments for an hveto configuration
+
+    The ``[segments] analysis-flag`` is read from ``files``, or queried
+    from the ``[segments] url``, and restricted to ``[start, end)``.
+    If ``[segments] padding`` is given, segments too short to survive
+    the padding are dropped before it is applied. The flags of a
+    ``[segments] veto-definer-file`` (restricted to the
+    ``veto-definer-categories``, if given) are then populated over the
+    analysis segments, and removed from them.
+
+    Parameters
+    ----------
+    cp : `~hveto.config.HvetoConfigParser`
+        the configuration
+
+    start : `int`
+        the GPS start time of the analysis
+
+    end : `int`
+        the GPS end time of the analysis
+
+    ifo : `str`, optional
+        the interferometer prefix of veto-definer flags to use
+
+    files : `list` of `str`, optional
+        the files from which to read the analysis flag
+
+    nproc : `int`, optional
+        the number of veto-definer flags to query at once
+
+    Returns
+    -------
+    analysis : `~gwpy.segments.DataQualityFlag`
+        the analysis segments
+
+    vetoes : `~gwpy.segments.DataQualityFlag` or `None`
+        the union of the veto-definer flags removed from the analysis
+        segments, or `None` if no veto-definer file is configured
+    """
+    aflag = cp.get('segments', 'analysis-flag')
+    url = cp.get('segments', 'url')
+    padding = tuple(cp.getfloats('segments', 'padding'))
+    span = SegmentList([Segment(start, end)])
+    if files:
+        analysis = DataQualityDict.read(files, gpstype=float)[aflag]
+        analysis.active &= span
+        analysis.known &= span
+        analysis.coalesce()
+        LOGGER.debug("Segments read from disk")
+    else:
+        analysis = query_flag(aflag, start, end, url=url)
+        LOGGER.debug("Segments recovered from %s" % url)
+    if padding != (0, 0):
+        mindur = padding[0] - padding[1]
+        analysis.active = type(analysis.active)([s for s in analysis.active if
+                                                 abs(s) >= mindur])
+        analysis.pad(*padding, inplace=True)
+        LOGGER.debug("Padding %s applied" % str(padding))
+
+    # apply vetoes from veto-definer file
+    try:
+        vetofile = cp.get('segments', 'veto-definer-file')
+    except configparser.NoOptionError:
+        return analysis, None
+    try:
+        categories = cp.getfloats('segments', 'veto-definer-categories')
+    except configparser.NoOptionError:
+        categories = None
+    vdf = read_veto_definer_file(vetofile, start=start, end=end, ifo=ifo)
+    LOGGER.info("Read veto-definer file from %s" % vetofile)
+    vdfstart = time.time()
+    populate(vdf, url, segments=analysis.active, on_error='warn',
+             nproc=nproc)
+    LOGGER.debug("Populated %d veto-definer flags in %.1fs"
+                 % (len(vdf), time.time() - vdfstart))
+    chosen = [vdf[flag] for flag in vdf if
+              not categories or vdf[flag].category in categories]
+    vetoes = union_flags('%s:VDF-VETOES:1' % ifo, chosen)
+    try:
+        deadtime = int(abs(vetoes.active)) / int(abs(vetoes.known)) * 100
+    except ZeroDivisionError:
+        deadtime = 0
+    LOGGER.debug("Coalesced %ss (%.2f%%) of deadtime from %d veto flags"
+                 % (abs(vetoes.active), deadtime, len(chosen)))
+    analysis -= vetoes
+    LOGGER.debug("Applied vetoes from veto-definer file")
+    return analysis, vetoes
@@ -19,9 +19,13 @@
 """Tests for :mod:`hveto.core`
 """
 
+import numpy
 import pytest
 
-from .. import core
+from gwpy.segments import (Segment, SegmentList)
+from gwpy.table import EventTable
+
+from .. import (core, triggers)
 
 
 def test_create_round():
@@ -41,3 +45,290 @@ def test_significance(n, mu, sig):
     """Test :func:`hveto.core.significance`
     """
     assert core.significance(n, mu) == pytest.approx(sig)
+
+
+def test_coincidence_counts():
+    """Test :func:`hveto.core.coincidence_counts`
+    """
+    primary = numpy.array([1., 2., 3., 10.])
+    auxiliary = numpy.array([1.05, 2.3, 9.])
+    auxsnr = numpy.array([10., 20., 10.])
+    counts = core.coincidence_counts(
+        primary, auxiliary, auxsnr, [8, 15], [.2, 1])
+    numpy.testing.assert_array_equal(counts, [[1, 0], [2, 1]])
+
+
+def test_coincidence_counts_find_all_coincidences():
+    """Compare :func:`hveto.core.coincidence_counts` with the old scan
+
+    :func:`hveto.core.find_all_coincidences` stops scanning at the
+    neighbouring primary event, so misses the auxiliary event beyond it
+    that is still inside the window, :func:`hveto.core.coincidence_counts`
+    (used by :func:`hveto.core.find_max_significance`) counts it
+    """
+    primary = numpy.array([10., 10.2])
+    auxiliary = numpy.array([10.35])
+    auxsnr = numpy.array([10.])
+    triggers = EventTable(
+        [numpy.concatenate((primary, auxiliary)),
+         numpy.concatenate((numpy.full(2, 10.), auxsnr)),
+         ['X1:PRIMARY'] * 2 + ['X1:AUX']],
+        names=('time', 'snr', 'channel'))
+    old = core.find_all_coincidences(triggers, 'X1:PRIMARY', [8], [.2, 1])
+    assert old == {(1, 8): {'X1:AUX': 1}, (.2, 8): {}}
+    counts = core.coincidence_counts(primary, auxiliary, auxsnr, [8], [.2, 1])
+    numpy.testing.assert_array_equal(counts, [[0], [2]])
+
+
+def test_score_coincidences():
+    """Test :func:`hveto.core.score_coincidences`
+    """
+    counts = {
+        'X1:A': numpy.array([[10, 5]]),
+        'X1:B': numpy.array([[1, 0]]),
+    }
+    naux = {
+        'X1:A': core.threshold_counts(numpy.array([8, 9, 20]), [8, 15]),
+        'X1:B': core.threshold_counts(numpy.array([8, 9]), [8, 15]),
+    }
+    winner, sigs = core.score_coincidences(
+        counts, naux, 100, [8, 15], [1], 1000)
+    assert winner.name == 'X1:A'
+    assert winner.snr == 8
+    assert winner.ncoinc == 10
+    assert winner.significance == pytest.approx(
+        core.significance(10, 100 * 3 * 1 / 1000))
+    assert sigs['X1:A'] == winner.significance
+    assert 0 < sigs['X1:B'] < winner.significance
+
+
+def test_snr_index():
+    rng = numpy.random.default_rng(1)
+    snr = rng.uniform(5, 50, size=1000)
+    snrs = [8, 10, 20, 40]
+    index = core.SnrIndex(snr)
+    assert index.counts(snrs).tolist() == core.threshold_counts(
+        snr, snrs).tolist()
+    # counts and selections stay valid as events are discarded
+    alive = numpy.ones(snr.size, dtype=bool)
+    for _ in range(3):
+        mask = rng.uniform(size=snr.size) < .2
+        index.discard(mask)
+        alive &= ~mask
+        assert index.counts(snrs).tolist() == core.threshold_counts(
+            snr[alive], snrs).tolist()
+    assert (index.alive == alive).all()
+    assert sorted(index.select(20)) == numpy.flatnonzero(
+        alive & (snr >= 20)).tolist()
+    # a precomputed order is used only if it sorts the SNRs
+    order = numpy.argsort(snr)
+    assert core.SnrIndex(snr, order=order[::-1]).order.tolist() == (
+        order.tolist())
+
+
+def test_time_partitions():
+    """Test :func:`hveto.core.time_partitions`
+    """
+    segments = SegmentList([Segment(0, 25), Segment(50, 55)])
+    assert core.time_partitions(segments, 10) == SegmentList([
+        Segment(0, 10), Segment(10, 20), Segment(20, 30), Segment(50, 55),
+    ])
+
+
+@pytest.mark.parametrize('nproc', (1, 2))
+def test_find_max_significance_partitions(nproc):
+    """Test :func:`hveto.core.find_max_significance` with partitions
+    """
+    rng = numpy.random.default_rng(0)
+    ptimes = numpy.sort(rng.uniform(0, 1000, size=500))
+    primary = EventTable([ptimes], names=('time',))
+    auxiliary = {}
+    for i, coupled in enumerate((ptimes[::3] + .02, ptimes[::10] - .1)):
+        times = numpy.sort(numpy.concatenate(
+            (coupled, rng.uniform(0, 1000, size=100))))
+        auxiliary['X1:AUX-%d' % i] = EventTable(
+            [times, rng.uniform(8, 30, size=times.size)],
+            names=('time', 'snr'))
+    args = (primary, auxiliary, 'X1:PRIMARY', [8, 12, 20], [.1, .5, 1], 1000)
+    winner, sigs = core.find_max_significance(*args)
+    partitions = core.time_partitions(SegmentList([Segment(0, 1000)]), 70)
+    winner2, sigs2 = core.find_max_significance(
+        *args, partitions=partitions, nproc=nproc)
+    assert winner.name == winner2.name == 'X1:AUX-0'
+    assert (winner.snr, winner.window) == (winner2.snr, winner2.window)
+    assert winner.significance == pytest.approx(winner2.significance)
+    assert sigs == pytest.approx(sigs2)
+
+    # masking events is the same as removing them
+    masks = dict((c, t['snr'] < 25) for c, t in auxiliary.items())
+    masks['X1:PRIMARY'] = ptimes < 800
+    winner3, sigs3 = core.find_max_significance(
+        *args, partitions=partitions, nproc=nproc, masks=masks)
+    winner4, sigs4 = core.find_max_significance(
+        primary[masks['X1:PRIMARY']],
+        dict((c, t[masks[c]]) for c, t in auxiliary.items()),
+        *args[2:])
+    assert (winner3.name, winner3.snr, winner3.window) == (
+        winner4.name, winner4.snr, winner4.window)
+    assert sigs3 == pytest.approx(sigs4)
+
+
+def test_partitioned_counts_order():
+    """Test :func:`hveto.core.partitioned_counts` with unsorted tables
+    """
+    rng = numpy.random.default_rng(0)
+    ptimes = numpy.sort(rng.uniform(0, 100, size=50))
+    atimes = numpy.sort(rng.uniform(0, 100, size=50))
+    asnr = rng.uniform(8, 30, size=50)
+    primary = EventTable([ptimes], names=('time',))
+    auxiliary = {'X1:AUX': EventTable([atimes, asnr], names=('time', 'snr'))}
+    args = ([8, 12], [.5, 1, 2])
+    partitions = core.time_partitions(SegmentList([Segment(0, 100)]), 30)
+    counts = core.partitioned_counts(primary, auxiliary, *args,
+                                     partitions=partitions)
+    numpy.testing.assert_array_equal(
+        counts['X1:AUX'],
+        core.coincidence_counts(ptimes, atimes, asnr, *args))
+
+    # sorted columns are used as they are
+    assert core._time_ordered(ptimes)[0] is ptimes
+
+    # unsorted tables give the same counts
+    order = rng.permutation(50)
+    counts2 = core.partitioned_counts(
+        primary[order],
+        {'X1:AUX': auxiliary['X1:AUX'][order]},
+        *args, partitions=partitions)
+    numpy.testing.assert_array_equal(counts2['X1:AUX'], counts['X1:AUX'])
+
+
+def test_find_coincidences():
+    """Test :func:`hveto.core.find_coincidences`
+    """
+    idx = core.find_coincidences([1., 2., 3., 4.], [1.4, 3.5], dt=1)
+    assert idx.tolist() == [0, 2, 3]
+
+
+def test_coincident_pairs():
+    """Test :func:`hveto.core.coincident_pairs`
+    """
+    ia, ib, lag = core.coincident_pairs(
+        numpy.array([1., 2., 5.]), numpy.array([.9, 1.2, 2.1, 9.]), dt=.5)
+    numpy.testing.assert_array_equal(ia, [0, 0, 1])
+    numpy.testing.assert_array_equal(ib, [0, 1, 2])
+    numpy.testing.assert_allclose(lag, [-.1, .2, .1])
+
+
+def test_veto_mask():
+    """Test :func:`hveto.core.veto_mask`
+    """
+    times = numpy.array([0., 1., 1.5, 2., 2.5, 4.])
+    segs = SegmentList([Segment(1, 2), Segment(3.5, 4)])
+    numpy.testing.assert_array_equal(
+        core.veto_mask(times, segs),
+        [False, True, True, True, False, True])
+    assert not core.veto_mask(times, SegmentList()).any()
+
+
+def test_gps_to_ns():
+    """Test :func:`hveto.core.gps_to_ns` and :func:`hveto.core.ns_to_gps`
+    """
+    ns = core.gps_to_ns([1000000000.25, -.5, numpy.inf])
+    assert ns.dtype == numpy.int64
+    assert ns.tolist() == [1000000000250000000, -500000000,
+                           numpy.iinfo('int64').max]
+    assert core.gps_to_ns(.05) == 50000000
+    assert core.ns_to_gps(ns[:2]).tolist() == [1000000000.25, -.5]
+
+
+def test_integer_times():
+    """Test the coincidence kernels with integer nanosecond times
+    """
+    primary = numpy.array([1., 2., 3., 10.])
+    auxiliary = numpy.array([1.05, 2.3, 9.])
+    auxsnr = numpy.array([10., 20., 10.])
+    segs = SegmentList([Segment(1, 2), Segment(3.5, 4)])
+    nsprimary = core.gps_to_ns(primary)
+    nsauxiliary = core.gps_to_ns(auxiliary)
+    numpy.testing.assert_array_equal(
+        core.coincidence_counts(nsprimary, nsauxiliary, auxsnr, [8, 15],
+                                [.2, 1]),
+        core.coincidence_counts(primary, auxiliary, auxsnr, [8, 15],
+                                [.2, 1]))
+    assert core.find_coincidences(
+        nsprimary, nsauxiliary, dt=.2).tolist() == [0]
+    assert core.veto_mask(nsprimary, segs).tolist() == [
+        True, True, False, False]
+    winner = core.HvetoWinner(window=.5)
+    assert winner.get_segments(nsauxiliary[:1]) == SegmentList([
+        Segment(.8, 1.3)])
+
+
+@pytest.mark.parametrize('partition', (None, 70))
+@pytest.mark.parametrize('nproc', (1, 2))
+def test_find_max_significance_compact(partition, nproc):
+    """Test :func:`hveto.core.find_max_significance` with compact tables
+    """
+    rng = numpy.random.default_rng(0)
+    start = 1000000000
+
+    def _table(times):
+        return EventTable(
+            [times, numpy.full(times.size, 100.),
+             rng.uniform(8, 30, size=times.size)],
+            names=('time', 'frequency', 'snr'))
+
+    ptimes = numpy.sort(rng.uniform(start, start + 1000, size=500))
+    primary = _table(ptimes)
+    auxiliary = {}
+    for i, coupled in enumerate((ptimes[::3] + .02, ptimes[::10] - .1)):
+        auxiliary['X1:AUX-%d' % i] = _table(numpy.sort(numpy.concatenate(
+            (coupled, rng.uniform(start, start + 1000, size=100)))))
+    if partition:
+        partitions = core.time_partitions(
+            SegmentList([Segment(start, start + 1000)]), partition)
+    else:
+        partitions = None
+    args = ('X1:PRIMARY', [8, 12, 20], [.1, .5, 1], 1000)
+    kwargs = {'partitions': partitions, 'nproc': nproc}
+    winner, sigs = core.find_max_significance(
+        primary, auxiliary, *args, **kwargs)
+    winner2, sigs2 = core.find_max_significance(
+        triggers.compact_table(primary),
+        dict((c, triggers.compact_table(t)) for c, t in auxiliary.items()),
+        *args, **kwargs)
+    assert winner.name == winner2.name == 'X1:AUX-0'
+    assert (winner.snr, winner.window) == (winner2.snr, winner2.window)
+    assert winner.significance == pytest.approx(winner2.significance)
+    assert sigs == pytest.approx(sigs2)
+
+
+def test_coincidence_rounds():
+    """Test :func:`hveto.core.coincidence_rounds`
+    """
+    rng = numpy.random.default_rng(1)
+    ptimes = numpy.sort(rng.uniform(0, 1000, size=500))
+    auxiliary = {}
+    for i, coupled in enumerate((ptimes[::3] + .02, ptimes[::10] - .1)):
+        times = numpy.sort(numpy.concatenate(
+            (coupled, rng.uniform(0, 1000, size=100))))
+        snr = rng.uniform(8, 30, size=times.size)
+        pidx, aidx, lag = core.coincident_pairs(ptimes, times, dt=1)
+        auxiliary['X1:AUX-%d' % i] = {
+            'time': times, 'snr': snr,
+            'primary': pidx, 'auxiliary': aidx, 'lag': lag,
+        }
+    segments = SegmentList([Segment(0, 1000)])
+    rounds, vetoed = core.coincidence_rounds(
+        ptimes, segments, auxiliary, [8, 12, 20], [.1, .5, 1], 5)
+    assert [r.winner.name for r in rounds[:2]] == ['X1:AUX-0', 'X1:AUX-1']
+    assert numpy.count_nonzero(vetoed == 1) == rounds[0].efficiency[0]
+
+    # first round must match the direct calculation
+    primary = EventTable([ptimes], names=('time',))
+    tables = dict((c, EventTable([a['time'], a['snr']], names=('time', 'snr')))
+                  for c, a in auxiliary.items())
+    winner, _ = core.find_max_significance(
+        primary, tables, 'X1:PRIMARY', [8, 12, 20], [.1, .5, 1], 1000)
+    assert winner.significance == pytest.approx(
+        rounds[0].winner.significance)
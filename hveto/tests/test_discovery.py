@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for `hveto.discovery`
+"""
+
+import os
+
+from gwpy.io.cache import file_segment
+from gwpy.segments import Segment
+
+from .. import discovery
+
+
+def _archive(base, starts, duration=40000):
+    for start in starts:
+        gpsdir = base / str(start // 100000)
+        gpsdir.mkdir(parents=True, exist_ok=True)
+        (gpsdir / 'X1-AUX_OMICRON-{}-{}.h5'.format(
+            start, duration)).touch()
+
+
+def _finder(base, calls):
+    def find(channel, etg, start, end, **kwargs):
+        calls.append((start, end))
+        span = Segment(start, end)
+        return sorted(str(p) for p in base.glob('*/*.h5')
+                      if file_segment(str(p)).intersects(span))
+    return find
+
+
+def test_discovery_cache(tmp_path):
+    base = tmp_path / 'archive'
+    _archive(base, range(0, 240000, 40000))
+    calls = []
+    finder = _finder(base, calls)
+
+    # completed directories are cached permanently, on disk
+    cache = discovery.DiscoveryCache(tmp_path / 'cache', now=lambda: 1e9)
+    files = cache.find(finder, 'X1:AUX', 'omicron', 50000, 130000)
+    assert [file_segment(f)[0] for f in files] == [40000, 80000, 120000]
+    assert calls == [(0, 100000), (100000, 200000)]
+    cache = discovery.DiscoveryCache(tmp_path / 'cache', now=lambda: 1e9)
+    assert cache.find(finder, 'X1:AUX', 'omicron', 50000, 130000) == files
+    assert len(calls) == 2
+
+    # different options have their own records
+    cache.find(finder, 'X1:AUX', 'omicron', 50000, 60000, ext='xml')
+    assert len(calls) == 3
+
+    # the current directory is revalidated by modification time
+    cache = discovery.DiscoveryCache(tmp_path / 'cache', now=lambda: 250000)
+    assert len(cache.find(finder, 'X1:AUX', 'omicron', 200000, 300000)) == 1
+    assert len(cache.find(finder, 'X1:AUX', 'omicron', 200000, 300000)) == 1
+    assert len(calls) == 4
+    _archive(base, [240000])
+    os.utime(base / '2', (0, 0))
+    assert len(cache.find(finder, 'X1:AUX', 'omicron', 200000, 300000)) == 2
+    assert len(calls) == 5
@@ -19,7 +19,6 @@
 """Tests for `hveto.html`
 """
 
-import os
 import shutil
 from unittest import mock
 
@@ -104,8 +103,8 @@ def test_bold_param(args, kwargs, result):
         {"name": "package-2", "version": "2.0.0"},
     ],
 )
-def test_write_hveto_page(mock_package_list, tmpdir):
-    os.chdir(str(tmpdir))
+def test_write_hveto_page(mock_package_list, tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
     config = 'test.ini'
     with open(config, 'w') as fobj:
         fobj.write('[test]\nchannel = X1:TEST')
@@ -118,7 +117,7 @@ def test_write_hveto_page(mock_package_list, tmpdir):
     shutil.rmtree(str(tmpdir), ignore_errors=True)
 
 
-def test_write_null_page(tmpdir):
-    os.chdir(str(tmpdir))
+def test_write_null_page(tmpdir, monkeypatch):
+    monkeypatch.chdir(str(tmpdir))
     html.write_null_page('L1', 0, 86400, 'test', 'info')
     shutil.rmtree(str(tmpdir), ignore_errors=True)
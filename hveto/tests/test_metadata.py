@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for `hveto.metadata`
+"""
+
+import os
+
+import numpy
+
+from gwpy.segments import (Segment, SegmentList)
+from gwpy.table import EventTable
+
+from .. import (metadata, triggers)
+
+
+def _write(path, start, snr):
+    EventTable(
+        [start + numpy.arange(10.), numpy.full(10, 100.),
+         numpy.full(10, float(snr))],
+        names=('time', 'frequency', 'snr'),
+    ).write(str(path), path='triggers', overwrite=True)
+    return str(path)
+
+
+def test_skip_file():
+    meta = {'rows': 10, 'tmin': 0., 'tmax': 9., 'maxsnr': 8.}
+    assert not metadata.skip_file(meta)
+    assert not metadata.skip_file(meta, snr=8)
+    assert metadata.skip_file(meta, snr=8.5)
+    assert not metadata.skip_file(meta, segments=[(9, 20)])
+    assert metadata.skip_file(meta, segments=[(-10, 0), (10, 20)])
+    assert metadata.skip_file(dict(meta, rows=0))
+
+
+def test_metadata_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(metadata, 'DEFAULT_METADATA_CACHE',
+                        str(tmp_path / 'metadata.sqlite'))
+    cache = [_write(tmp_path / 'X1-AUX_OMICRON-0-10.h5', 0, 5),
+             _write(tmp_path / 'X1-AUX_OMICRON-10-10.h5', 10, 20)]
+    reads = []
+    read = triggers._read_trigger_file
+    monkeypatch.setattr(triggers, '_read_trigger_file',
+                        lambda *args, **kwargs: reads.append(args[0]) or read(
+                            *args, **kwargs))
+    segments = SegmentList([Segment(0, 20)])
+
+    # the first read records the metadata for each file
+    out = triggers.get_triggers('X1:AUX', 'omicron', segments, cache=cache,
+                                snr=10)
+    assert len(out) == 10
+    assert reads == cache
+    meta = metadata.get_metadata_cache().get(cache[1], {
+        'format': 'hdf5', 'path': 'triggers',
+        'columns': ['time', 'frequency', 'snr']})
+    assert meta == {'rows': 10, 'tmin': 10., 'tmax': 19., 'maxsnr': 20.,
+                    'columns': ['time', 'frequency', 'snr']}
+
+    # the quiet file is then not opened, until it changes
+    out2 = triggers.get_triggers('X1:AUX', 'omicron', segments, cache=cache,
+                                 snr=10)
+    assert out2['time'].tolist() == out['time'].tolist()
+    assert reads == cache + cache[1:]
+    _write(cache[0], 0, 15)
+    os.utime(cache[0], ns=(0, 0))
+    out3 = triggers.get_triggers('X1:AUX', 'omicron', segments, cache=cache,
+                                 snr=10)
+    assert len(out3) == 20
+    assert reads == cache + cache[1:] + cache
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for `hveto.online`
+"""
+
+import numpy
+
+from gwpy.table import EventTable
+
+from .. import (core, online)
+
+SNRS = [8, 10, 20]
+WINDOWS = [.1, .5, 1]
+
+
+def _write_triggers(path, times, snr, frequency=100.):
+    table = EventTable(
+        [times, numpy.full(len(times), frequency), snr],
+        names=('time', 'frequency', 'snr'),
+    )
+    table.write(str(path), path='triggers', format='hdf5')
+    return str(path)
+
+
+def _write_block(tmpdir, start, duration, rng):
+    # primary triggers, with one auxiliary channel that sees most of them
+    ptimes = numpy.sort(rng.uniform(start, start + duration, size=40))
+    atimes = ptimes[::2] + .01
+    btimes = numpy.sort(rng.uniform(start, start + duration, size=20))
+    tag = '{}-{}.h5'.format(start, duration)
+    return (
+        [_write_triggers(tmpdir / 'X1-PRIMARY_OMICRON-{}'.format(tag),
+                         ptimes, numpy.full(ptimes.size, 10.))],
+        [_write_triggers(tmpdir / 'X1-AUX_A_OMICRON-{}'.format(tag),
+                         atimes, numpy.full(atimes.size, 25.)),
+         _write_triggers(tmpdir / 'X1-AUX_B_OMICRON-{}'.format(tag),
+                         btimes, numpy.full(btimes.size, 9.))],
+    )
+
+
+def test_hveto_online(tmp_path):
+    rng = numpy.random.default_rng(0)
+    store = online.HvetoOnline(
+        'X1:PRIMARY', 'omicron', ['X1:AUX-A', 'X1:AUX-B'], 'omicron',
+        SNRS, WINDOWS, psnr=8, pfreq=(10, 1000), auxfreq=(10, 1000))
+    pcache, acache = [], []
+    for start in (0, 100):
+        pnew, anew = _write_block(tmp_path, start, 100, rng)
+        pcache.extend(pnew)
+        acache.extend(anew)
+        assert store.update(pcache, acache)
+
+    # nothing new means nothing to do
+    assert not store.update(pcache, acache)
+    assert len(store.primary) == 80
+    assert abs(store.segments) == 200
+
+    # incremental counts must match a full recalculation
+    for chan in store.auxchannels:
+        aux = store.auxiliary[chan]
+        full = core.coincidence_counts(
+            numpy.asarray(store.primary['time']),
+            numpy.asarray(aux['time']), numpy.asarray(aux['snr']),
+            SNRS, WINDOWS)
+        numpy.testing.assert_array_equal(store.counts[chan], full)
+
+    # and the first round should find the coupled channel
+    rounds = store.rounds(5)
+    assert rounds
+    assert rounds[0].winner.name == 'X1:AUX-A'
+    assert rounds[0].efficiency[0] >= 40
+
+    # channel subsets are respected
+    rounds = store.rounds(5, channels=['X1:AUX-B'])
+    assert all(r.winner.name == 'X1:AUX-B' for r in rounds)
@@ -19,11 +19,16 @@
 """Tests for `hveto.segments`
 """
 
+import json
 import os
 import pytest
 import shutil
+import threading
 
+from http.server import (BaseHTTPRequestHandler, ThreadingHTTPServer)
 from unittest import mock
+from urllib.error import HTTPError
+from urllib.parse import (parse_qs, urlparse)
 
 from gwpy.segments import (Segment, SegmentList,
                            DataQualityFlag, DataQualityDict)
@@ -45,6 +50,113 @@ TEST_DICT = DataQualityDict({
     TEST_FLAG.name: TEST_FLAG})
 
 
+class _SegmentServer(BaseHTTPRequestHandler):
+    """Minimal stand-in for the DQSegDB API
+
+    Each flag is active for the first second of every ten seconds.
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        ifo, name, version = url.path.split('/')[2:5]
+        query = parse_qs(url.query)
+        start, end = float(query['s'][0]), float(query['e'][0])
+        self.server.requests.append((name, start, end))
+        first = int(start) - int(start) % 10
+        active = [[t, t + 1] for t in range(first, int(end), 10)]
+        body = json.dumps({
+            'ifo': ifo,
+            'name': name,
+            'version': int(version),
+            'known': [[start, end]],
+            'active': active,
+            'metadata': {},
+            'query_information': {},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def segment_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _SegmentServer)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}'.format(server.server_port)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+VETO_DEFINER_FILE = b"""<?xml version='1.0' encoding='utf-8'?>
+<!DOCTYPE LIGO_LW SYSTEM "http://ldas-sw.ligo.caltech.edu/doc/ligolwAPI/html/ligolw_dtd.txt">
+<LIGO_LW>
+    <Table Name="veto_definer:table">
+        <Column Type="lstring" Name="ifo"/>
+        <Column Type="lstring" Name="name"/>
+        <Column Type="int_4s" Name="version"/>
+        <Column Type="int_4s" Name="category"/>
+        <Column Type="int_4s" Name="start_time"/>
+        <Column Type="int_4s" Name="end_time"/>
+        <Column Type="int_4s" Name="start_pad"/>
+        <Column Type="int_4s" Name="end_pad"/>
+        <Column Type="lstring" Name="comment"/>
+        <Stream Delimiter="," Type="Local" Name="veto_definer:table">
+            "X1","VETO_A",1,1,0,0,-1,2,"first",
+            "X1","VETO_B",1,2,150,250,0,0,"second",
+            "Y1","VETO_C",1,1,0,0,0,0,"other"
+        </Stream>
+    </Table>
+</LIGO_LW>
+"""
+
+
+class _VetoDefinerServer(BaseHTTPRequestHandler):
+    """Serve `VETO_DEFINER_FILE` with an ``ETag``, or the error code
+    set as the ``error`` attribute of the server
+    """
+    etag = '"vdf-1"'
+
+    def do_GET(self):
+        if self.server.error:
+            self.server.responses.append(self.server.error)
+            self.send_error(self.server.error)
+            return
+        if self.headers.get('If-None-Match') == self.etag:
+            self.server.responses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.server.responses.append(200)
+        self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(VETO_DEFINER_FILE)))
+        self.end_headers()
+        self.wfile.write(VETO_DEFINER_FILE)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def veto_definer_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _VetoDefinerServer)
+    server.responses = []
+    server.error = None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}/vdf.xml'.format(server.server_port)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
 # -- unit tests ---------------------------------------------------------------
 
 @mock.patch('gwpy.segments.DataQualityFlag.query', return_value=TEST_FLAG)
@@ -72,14 +184,130 @@ def test_write_segments_ascii_failure():
     assert str(exc.value).startswith('Invalid number of columns')
 
 
-@mock.patch('gwpy.segments.DataQualityDict.from_veto_definer_file')
-def test_read_veto_definer_file(dqflag, tmpdir):
-    # I don't understand this test what does iso_8859 have to do with veto definers?
-    pass
+def test_read_veto_definer_file(veto_definer_server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    vdf = segments.read_veto_definer_file(veto_definer_server.url, ifo='X1',
+                                          cache=None)
+    assert list(vdf) == ['X1:VETO_A:1', 'X1:VETO_B:1']
+    assert vdf['X1:VETO_A:1'].padding == (-1, 2)
+    with open(tmp_path / 'vdf.xml', 'rb') as f:
+        assert f.read() == VETO_DEFINER_FILE
+
 
-    # dqflag.return_value = TEST_DICT
-    # os.chdir(str(tmpdir))
-    # testfile = 'https://www.w3.org/TR/PNG/iso_8859-1.txt'
-    # dqdict = segments.read_veto_definer_file(testfile)
-    # assert dqdict == TEST_DICT
-    # shutil.rmtree(str(tmpdir), ignore_errors=True)
+def test_read_veto_definer_file_cache(veto_definer_server, tmp_path,
+                                      monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = str(tmp_path / 'cache')
+    read = DataQualityDict.from_veto_definer_file
+    with mock.patch('gwpy.segments.DataQualityDict.from_veto_definer_file',
+                    side_effect=read) as parse:
+        vdf = segments.read_veto_definer_file(
+            veto_definer_server.url, start=100, end=200, ifo='X1',
+            cache=cache)
+        vdf2 = segments.read_veto_definer_file(
+            veto_definer_server.url, start=100, end=200, ifo='X1',
+            cache=cache)
+        assert parse.call_count == 1
+        segments.read_veto_definer_file(
+            veto_definer_server.url, start=100, end=300, ifo='X1',
+            cache=cache)
+        assert parse.call_count == 2
+
+    # the second download was answered 'Not Modified'
+    assert veto_definer_server.responses == [200, 304, 304]
+
+    # downloads are only written to the cache
+    assert os.listdir(tmp_path) == ['cache']
+    assert list(vdf2) == list(vdf)
+    for name, flag in vdf.items():
+        assert vdf2[name].known == flag.known
+        assert vdf2[name].category == flag.category
+        assert tuple(vdf2[name].padding) == tuple(flag.padding)
+        assert vdf2[name].description == flag.description
+
+
+def test_read_veto_definer_file_server_error(veto_definer_server, tmp_path):
+    cache = str(tmp_path / 'cache')
+    vdf = segments.read_veto_definer_file(
+        veto_definer_server.url, ifo='X1', cache=cache)
+
+    # a server error falls back to the cached copy, with a warning
+    veto_definer_server.error = 500
+    with pytest.warns(UserWarning, match='using cached copy'):
+        vdf2 = segments.read_veto_definer_file(
+            veto_definer_server.url, ifo='X1', cache=cache)
+    assert veto_definer_server.responses == [200, 500]
+    assert list(vdf2) == list(vdf)
+
+    # but is raised if there is no cached copy
+    with pytest.raises(HTTPError) as exc:
+        segments.read_veto_definer_file(
+            veto_definer_server.url, ifo='X1', cache=str(tmp_path / 'new'))
+    assert exc.value.code == 500
+
+
+@pytest.mark.filterwarnings('ignore::DeprecationWarning')
+def test_segment_cache(segment_server, tmp_path):
+    cache = segments.SegmentCache(tmp_path / 'cache', now=lambda: 1e9)
+    flag = cache.query('X1:TEST-FLAG:1', [(95, 125)], url=segment_server.url)
+    assert flag.known == SegmentList([Segment(95, 125)])
+    assert flag.active == SegmentList(
+        Segment(t, t + 1) for t in range(100, 125, 10))
+    assert segment_server.requests == [('TEST-FLAG', 95, 125)]
+
+    # only the times not yet recorded are fetched, across chunks
+    segment_server.requests.clear()
+    flag2 = segments.query_flag('X1:TEST-FLAG:1', 100, 150,
+                                url=segment_server.url, cache=cache)
+    assert segment_server.requests == [('TEST-FLAG', 125, 150)]
+    assert flag2.known == SegmentList([Segment(100, 150)])
+    assert flag2.active == SegmentList(
+        Segment(t, t + 1) for t in range(100, 150, 10))
+    segments.query_flag('X1:TEST-FLAG:1', 95, 150, url=segment_server.url,
+                        cache=cache)
+    assert len(segment_server.requests) == 1
+
+    # recent times are always fetched again
+    recent = segments.SegmentCache(tmp_path / 'cache',
+                                   now=lambda: 140 + segments.SEGMENT_LATENCY)
+    segment_server.requests.clear()
+    recent.query('X1:TEST-FLAG:1', [(130, 160)], url=segment_server.url)
+    recent.query('X1:TEST-FLAG:1', [(130, 160)], url=segment_server.url)
+    assert segment_server.requests == [('TEST-FLAG', 150, 160)] * 2
+
+
+@pytest.mark.filterwarnings('ignore::DeprecationWarning')
+@pytest.mark.parametrize('cache', (False, True))
+def test_populate(segment_server, tmp_path, cache):
+    vdf = DataQualityDict()
+    for i in range(4):
+        name = 'X1:TEST-FLAG_{}:1'.format(i)
+        vdf[name] = DataQualityFlag(name, known=[(0, 100)],
+                                    padding=(-i, i))
+    segments.populate(vdf, segment_server.url, segments=[(5, 35)],
+                      cache=str(tmp_path / 'cache') if cache else None,
+                      nproc=4)
+    for i, flag in enumerate(vdf.values()):
+        assert flag.known == SegmentList([Segment(5, 35)])
+        assert flag.active == SegmentList(
+            Segment(t - i, t + 1 + i) for t in (10, 20, 30)).coalesce()
+    assert sorted(segment_server.requests) == [
+        ('TEST-FLAG_{}'.format(i), 5, 35) for i in range(4)]
+
+
+def test_union_segments():
+    lists = [
+        SegmentList([Segment(0, 2), Segment(5, 6)]),
+        SegmentList([Segment(1, 3), Segment(3, 4), Segment(8, 8)]),
+        SegmentList(),
+        SegmentList([Segment(5.5, 7)]),
+    ]
+    expected = SegmentList()
+    for segl in lists:
+        expected |= segl
+    assert segments.union_segments(lists) == expected.coalesce()
+    assert segments.union_segments([]) == SegmentList()
+    flag = segments.union_flags('X1:TEST', [TEST_FLAG, TEST_FLAG])
+    assert flag.name == 'X1:TEST'
+    assert flag.known == TEST_FLAG.known
+    assert flag.active == TEST_FLAG.active
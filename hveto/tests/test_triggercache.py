@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for `hveto.triggercache`
+"""
+
+import os
+
+import numpy
+
+from gwpy.segments import (Segment, SegmentList)
+from gwpy.table import EventTable
+
+from .. import (triggercache, triggers)
+
+
+def _write(path, start, duration=10):
+    times = start + numpy.arange(duration, dtype=float)
+    EventTable(
+        [times, numpy.full(duration, 100.), times % 10],
+        names=('time', 'frequency', 'snr'),
+    ).write(str(path), path='triggers', overwrite=True)
+    return str(path)
+
+
+def _store(cache, key, segments, snr=None, frange=None):
+    table = EventTable([numpy.zeros(100)] * 3,
+                       names=('time', 'frequency', 'snr'))
+    return cache.store(key, lambda path: triggers.write_npy_triggers(
+        path, table, segments), segments, snr=snr, frange=frange)
+
+
+def test_trigger_cache(tmp_path):
+    cache = triggercache.TriggerCache(tmp_path / 'cache')
+    segs = SegmentList([Segment(0, 10), Segment(20, 30)])
+    path = _store(cache, 'a', segs, snr=5, frange=(10, 100))
+
+    # subsets of the segments with stricter cuts are served
+    assert cache.find('a', [(2, 8)], snr=6, frange=(20, 90)) == path
+    assert cache.find('a', segs, snr=5, frange=(10, 100)) == path
+    assert cache.find('b', segs, snr=5, frange=(10, 100)) is None
+    assert cache.find('a', [(5, 25)], snr=5, frange=(10, 100)) is None
+    assert cache.find('a', segs, snr=4, frange=(10, 100)) is None
+    assert cache.find('a', segs, snr=5) is None
+
+    # a wider read replaces the entries it covers
+    wide = _store(cache, 'a', [(0, 30)], snr=5, frange=(10, 100))
+    assert cache.find('a', segs, snr=5, frange=(10, 100)) == wide
+    assert not os.path.exists(path)
+
+    # the least recently used entries are removed to fit the size limit
+    cache.max_size = cache.size() * 5 // 2
+    other = _store(cache, 'b', segs)
+    assert cache.find('a', segs, snr=5, frange=(10, 100)) == wide
+    _store(cache, 'c', segs)
+    assert cache.find('b', segs) is None
+    assert not os.path.exists(other)
+    assert cache.find('a', segs, snr=5, frange=(10, 100)) == wide
+    assert cache.size() <= cache.max_size
+
+
+def test_get_triggers_trigger_cache(tmp_path, monkeypatch):
+    files = [_write(tmp_path / 'X1-AUX_OMICRON-0-10.h5', 0),
+             _write(tmp_path / 'X1-AUX_OMICRON-10-10.h5', 10)]
+    reads = []
+    read = triggers._read_trigger_file
+    monkeypatch.setattr(triggers, '_read_trigger_file',
+                        lambda *args, **kwargs: reads.append(args[0]) or read(
+                            *args, **kwargs))
+    kwargs = {'cache': files, 'trigger_cache': str(tmp_path / 'cache')}
+
+    full = triggers.get_triggers('X1:AUX', 'omicron', SegmentList([
+        Segment(0, 20)]), snr=2, **kwargs)
+    assert len(reads) == 2
+    segments = SegmentList([Segment(5, 15)])
+    out = triggers.get_triggers('X1:AUX', 'omicron', segments, snr=7,
+                                **kwargs)
+    assert len(reads) == 2
+    assert out['time'].tolist() == [7., 8., 9.]
+    assert len(full) == 16
+
+    # other options are read from the trigger files
+    triggers.get_triggers('X1:AUX', 'omicron', segments, snr=1, **kwargs)
+    assert len(reads) == 4
+
+
+def test_get_triggers_trigger_cache_partial(tmp_path, monkeypatch):
+    files = [_write(tmp_path / 'X1-AUX_OMICRON-0-10.h5', 0)]
+    reads = []
+    read = triggers._read_trigger_file
+    monkeypatch.setattr(triggers, '_read_trigger_file',
+                        lambda *args, **kwargs: reads.append(args[0]) or read(
+                            *args, **kwargs))
+    tcache = triggercache.TriggerCache(tmp_path / 'cache')
+    segments = SegmentList([Segment(0, 20)])
+
+    # only the segments covered by the files are recorded
+    out = triggers.get_triggers('X1:AUX', 'omicron', segments, cache=files,
+                                trigger_cache=tcache)
+    assert len(out) == 10
+    key = tcache.key('X1:AUX', 'omicron', files=triggercache.file_digest(
+        files), trigfind={}, read={})
+    assert tcache.find(key, segments) is None
+    assert tcache.find(key, [(0, 10)]) is not None
+
+    # once the second file is written, it is read, and the first read again
+    files.append(_write(tmp_path / 'X1-AUX_OMICRON-10-10.h5', 10))
+    out = triggers.get_triggers('X1:AUX', 'omicron', segments, cache=files,
+                                trigger_cache=tcache)
+    assert len(out) == 20
+    assert reads == [files[0]] + files
+
+    # as is any file that is rewritten
+    _write(files[1], 10, duration=5)
+    out = triggers.get_triggers('X1:AUX', 'omicron', segments, cache=files,
+                                trigger_cache=tcache)
+    assert len(out) == 15
+    assert len(reads) == 5
+    out = triggers.get_triggers('X1:AUX', 'omicron', segments, cache=files,
+                                trigger_cache=tcache)
+    assert len(out) == 15
+    assert len(reads) == 5
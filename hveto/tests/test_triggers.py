@@ -19,11 +19,14 @@
 """Tests for `hveto.triggers`
 """
 
+import h5py
+import numpy
 import pytest
 
 from astropy.table import Table
 
 from gwpy.segments import (Segment, SegmentList)
+from gwpy.table import EventTable
 
 from .. import triggers
 
@@ -45,6 +48,25 @@ def test_aux_channels_from_cache():
     assert channels == sorted(AUX_FILES.keys())
 
 
+def test_find_auxiliary_channels(tmp_path):
+    archive = tmp_path / 'triggers'
+    for name, gps5 in (('SYS_A_OMICRON', 10000), ('SYS_B_OMICRON', 10001),
+                       ('SYS_C_KW', 10000)):
+        (archive / 'X1' / name / str(gps5)).mkdir(parents=True)
+    kwargs = dict(ifo='X1', archive=str(archive), nproc=2)
+    channels = triggers.find_auxiliary_channels(
+        'omicron', (1000000000, 1000200000), **kwargs)
+    assert channels == ['X1:SYS-A', 'X1:SYS-B']
+
+    # completed GPS directories are not searched again
+    cache_dir = tmp_path / 'cache'
+    assert triggers.find_auxiliary_channels(
+        'omicron', 1000000000, cache_dir=cache_dir, **kwargs) == ['X1:SYS-A']
+    (archive / 'X1' / 'SYS_A_OMICRON' / '10000').rmdir()
+    assert triggers.find_auxiliary_channels(
+        'omicron', 1000000000, cache_dir=cache_dir, **kwargs) == ['X1:SYS-A']
+
+
 def test_get_triggers():
     # test that trigfind deals with non existant channels correctly
     with pytest.warns(UserWarning):
@@ -54,3 +76,294 @@ def test_get_triggers():
     for col in ['time', 'frequency', 'snr']:
         assert col in out.dtype.names
     assert len(out) == 0
+
+
+def test_get_triggers_cache(tmp_path):
+    cache = []
+    for start in (0, 100, 200):
+        path = tmp_path / 'X1-AUX_OMICRON-{}-100.h5'.format(start)
+        EventTable(
+            [start + numpy.arange(10) * 10., numpy.full(10, 100.),
+             numpy.arange(10) + 5.],
+            names=('time', 'frequency', 'snr'),
+        ).write(str(path), path='triggers')
+        cache.append(str(path))
+    segments = SegmentList([Segment(50, 150), Segment(200, 300)])
+    out = triggers.get_triggers('X1:AUX', 'omicron', segments, cache=cache,
+                                snr=10)
+    assert out['time'].tolist() == [
+        50., 60., 70., 80., 90., 250., 260., 270., 280., 290.]
+    assert (out['snr'] >= 10).all()
+    assert (out['channel'] == 'X1:AUX').all()
+
+
+def test_iter_triggers(tmp_path):
+    cache = []
+    for start in (0, 100, 200):
+        path = tmp_path / 'X1-AUX_OMICRON-{}-100.h5'.format(start)
+        EventTable(
+            [start + numpy.arange(10)[::-1] * 10., numpy.full(10, 100.),
+             numpy.arange(10) + 5.],
+            names=('time', 'frequency', 'snr'),
+        ).write(str(path), path='triggers')
+        cache.append(str(path))
+    segments = SegmentList([Segment(0, 300)])
+    full = triggers.get_triggers('X1:AUX', 'omicron', segments, cache=cache,
+                                 snr=8)
+
+    # files read in threads still come back in order
+    threaded = triggers.get_triggers('X1:AUX', 'omicron', segments,
+                                     cache=cache, snr=8, nproc=3)
+    assert threaded['time'].tolist() == full['time'].tolist()
+
+    # one chunk per file
+    chunks = list(triggers.iter_triggers(
+        'X1:AUX', 'omicron', segments, cache=cache[::-1], snr=8, nproc=2))
+    assert len(chunks) == 3
+    assert numpy.concatenate(
+        [c['time'] for c in chunks]).tolist() == full['time'].tolist()
+    assert (chunks[0]['channel'] == 'X1:AUX').all()
+
+    # fixed-size chunks
+    chunks = list(triggers.iter_triggers(
+        'X1:AUX', 'omicron', segments, cache=cache, snr=8, chunksize=4))
+    assert [len(c) for c in chunks] == [4, 4, 4, 4, 4, 1]
+    assert numpy.concatenate(
+        [c['time'] for c in chunks]).tolist() == full['time'].tolist()
+
+
+def test_read_hdf5_triggers(tmp_path):
+    data = numpy.zeros(100, dtype=[
+        ('time', 'f8'), ('frequency', 'f8'), ('snr', 'f8'), ('q', 'f8')])
+    data['time'] = numpy.arange(100)
+    data['frequency'] = 100.
+    data['snr'] = numpy.arange(100) % 10 + 5
+    segments = SegmentList([Segment(20, 40), Segment(60, 80)])
+
+    # omicron-style file, sorted and unsorted
+    for name, rows in (('sorted', data), ('unsorted', data[::-1])):
+        path = tmp_path / '{}.h5'.format(name)
+        with h5py.File(path, 'w') as h5f:
+            h5f.create_dataset('triggers', data=rows, chunks=True)
+        out = triggers._read_hdf5_triggers(
+            path, path='triggers', columns=['time', 'frequency', 'snr'],
+            segments=segments, snr=12, chunksize=7)
+        assert out.dtype.names == ('time', 'frequency', 'snr')
+        assert sorted(out['time']) == [
+            27., 28., 29., 37., 38., 39., 67., 68., 69., 77., 78., 79.]
+
+    # snax-style file
+    path = tmp_path / 'snax.h5'
+    with h5py.File(path, 'w') as h5f:
+        for channel in ('X1:AUX-A', 'X1:AUX-B'):
+            group = h5f.create_group(channel)
+            group.create_dataset('0', data=data[:50])
+            group.create_dataset('50', data=data[50:])
+    out = triggers._read_hdf5_triggers(
+        path, channels='X1:AUX-B', columns=['time', 'frequency', 'snr'],
+        snr=14)
+    assert out['time'].tolist() == list(range(9, 100, 10))
+    with pytest.raises(ValueError):
+        triggers._read_hdf5_triggers(path, channels='X1:AUX-C')
+
+
+def test_read_hdf5_triggers_unsorted(tmp_path):
+    # neither sorted nor reversed, so bisection would skip the first row
+    data = numpy.zeros(3, dtype=[
+        ('time', 'f8'), ('frequency', 'f8'), ('snr', 'f8')])
+    data['time'] = [30, 10, 50]
+    data['frequency'] = 100.
+    data['snr'] = 10.
+    path = tmp_path / 'X1-AUX_OMICRON-0-100.h5'
+    with h5py.File(path, 'w') as h5f:
+        h5f.create_dataset('triggers', data=data)
+    segments = SegmentList([Segment(25, 35)])
+    out = triggers._read_hdf5_triggers(path, path='triggers',
+                                       segments=segments)
+    assert out['time'].tolist() == [30.]
+    out = triggers.get_triggers('X1:AUX', 'omicron', segments,
+                                cache=[str(path)], format='hdf5',
+                                path='triggers',
+                                columns=['time', 'frequency', 'snr'])
+    assert out['time'].tolist() == [30.]
+
+
+def test_file_crops():
+    cache = ['X1-AUX_OMICRON-0-100.h5', 'X1-AUX_OMICRON-100-100.h5',
+             'X1-AUX_OMICRON-200-100.h5', 'X1-AUX_OMICRON-0-100.h5']
+    segments = SegmentList([Segment(10, 20), Segment(50, 60),
+                            Segment(100, 200), Segment(400, 500)])
+    out = list(triggers._file_crops(cache, segments))
+    assert out == [
+        (cache[0], SegmentList([Segment(10, 20), Segment(50, 60)])),
+        (cache[1], None),
+    ]
+
+
+def test_cache_catalog():
+    cache = ['X1-AUX_A_OMICRON-{}-100.h5'.format(t) for t in (200, 0, 100)]
+    cache += ['X1-AUX_AB_OMICRON-0-100.h5', 'X1-AUX_B-0-100.h5', 'bad.h5']
+    catalog = triggers.CacheCatalog(cache)
+    assert list(catalog) == cache
+    assert catalog.files('X1:AUX-A') == [
+        'X1-AUX_AB_OMICRON-0-100.h5', 'X1-AUX_A_OMICRON-0-100.h5',
+        'X1-AUX_A_OMICRON-100-100.h5', 'X1-AUX_A_OMICRON-200-100.h5']
+    assert catalog.files('X1:AUX-A_OMICRON', SegmentList([
+        Segment(50, 100), Segment(250, 300)])) == [
+        'X1-AUX_A_OMICRON-0-100.h5', 'X1-AUX_A_OMICRON-200-100.h5']
+    assert catalog.files('X1:AUX-C') == []
+
+
+def test_get_multichannel_triggers(tmp_path):
+    channels = ['X1:AUX-A', 'X1:AUX-B', 'X1:AUX-C']
+    cache = []
+    for start in (0, 100):
+        path = tmp_path / 'X1-SNAX-{}-100.h5'.format(start)
+        with h5py.File(path, 'w') as h5f:
+            for i, channel in enumerate(channels[:2]):
+                data = numpy.zeros(10, dtype=[
+                    ('time', 'f8'), ('frequency', 'f8'), ('snr', 'f8')])
+                data['time'] = start + numpy.arange(10) * 10 + i
+                data['frequency'] = 100.
+                data['snr'] = numpy.arange(10) + 5
+                h5f.create_group(channel).create_dataset(str(start), data=data)
+        cache.append(str(path))
+    segments = SegmentList([Segment(0, 150)])
+    out = triggers.get_multichannel_triggers(
+        channels, 'snax', segments, cache=cache, snr=10, nproc=2)
+    assert list(out) == channels
+    for channel in channels[:2]:
+        assert out[channel]['time'].tolist() == triggers.get_triggers(
+            channel, 'snax', segments, cache=cache, snr=10)['time'].tolist()
+        assert (out[channel]['channel'] == channel).all()
+    assert len(out['X1:AUX-C']) == 0
+
+
+def test_read_ligolw_triggers(tmp_path):
+    path = tmp_path / 'X1-AUX_KW-0-100.xml.gz'
+    n = 10
+    EventTable(
+        [numpy.arange(n, dtype='int32'),
+         numpy.arange(n, dtype='int32') * 100000000,
+         numpy.full(n, 'a, "b"'),
+         numpy.arange(n, dtype='float32') * 10 + 50,
+         numpy.arange(n, dtype='float32') + 5],
+        names=('peak_time', 'peak_time_ns', 'channel', 'peak_frequency',
+               'snr'),
+    ).write(str(path), format='ligolw', tablename='sngl_burst')
+    read_kwargs = dict(triggers.DEFAULT_READ_OPTIONS[('kleinewelle', 'ligolw')],
+                       format='ligolw')
+    out = triggers._read_trigger_file(str(path), read_kwargs, snr=10,
+                                      segments=SegmentList([Segment(0, 9)]))
+    expected = EventTable.read(str(path), **read_kwargs)
+    expected = expected[(expected['snr'] >= 10) & (expected['peak'] < 9)]
+    assert out.dtype == expected.dtype
+    assert out.as_array().tolist() == expected.as_array().tolist()
+    assert out['peak'].tolist() == pytest.approx([5.5, 6.6, 7.7, 8.8])
+
+
+def test_read_ligolw_triggers_chunks(tmp_path, monkeypatch):
+    path = tmp_path / 'X1-AUX_KW-0-100.xml'
+    n = 10
+    EventTable(
+        [numpy.arange(n, dtype='int32'),
+         numpy.zeros(n, dtype='int32'),
+         numpy.full(n, 'a, "b"'),
+         numpy.full(n, 100., dtype='float32'),
+         numpy.arange(n, dtype='float32') + 5,
+         numpy.arange(n, dtype='float64')],
+        names=('peak_time', 'peak_time_ns', 'channel', 'peak_frequency',
+               'snr', 'duration'),
+    ).write(str(path), format='ligolw', tablename='sngl_burst')
+
+    # rows are tokenized and cut in blocks, and only the rows that pass
+    # the cuts are converted for the other columns
+    converted = []
+    column = triggers._LigolwTable.column
+
+    def spy(self, name, rows):
+        converted.append((name, len(rows)))
+        return column(self, name, rows)
+
+    monkeypatch.setattr(triggers._LigolwTable, 'chunks',
+                        lambda self: triggers._ligolw_rows(
+                            self.stream.text, len(self.types), chunk=3))
+    monkeypatch.setattr(triggers._LigolwTable, 'column', spy)
+    out = triggers._read_ligolw_triggers(
+        str(path), 'sngl_burst', ['peak', 'peak_frequency', 'snr', 'duration'],
+        snr=10, segments=SegmentList([Segment(0, 8)]))
+    assert out['duration'].tolist() == [5., 6., 7.]
+    assert out['snr'].tolist() == [10., 11., 12.]
+    assert [size for name, size in converted if name == 'snr'] == [3, 3, 3, 1]
+    assert [size for name, size in converted if name == 'duration'] == [0, 1, 2, 0]
+
+
+def test_npy_triggers(tmp_path):
+    table = EventTable(
+        [numpy.arange(10.), numpy.full(10, 100.), numpy.arange(10.) + 5],
+        names=('time', 'frequency', 'snr'))
+    segments = SegmentList([Segment(0, 10)])
+    path = tmp_path / 'X1-AUX-0-10.npy.json'
+    triggers.write_npy_triggers(path, table, segments)
+    manifest = triggers.read_npy_manifest(path)
+    assert manifest['rows'] == 10
+    assert manifest['columns'] == ['time', 'frequency', 'snr']
+    assert manifest['segments'] == segments
+
+    # read memory-mapped, or via get_triggers with cuts
+    out = triggers.read_npy_triggers(path)
+    assert out.as_array().tolist() == table.as_array().tolist()
+    out = triggers.get_triggers('X1:AUX', 'omicron', segments,
+                                cache=[str(path)], format=None, snr=10)
+    assert out['time'].tolist() == [5., 6., 7., 8., 9.]
+    assert out.meta['snr_order'].tolist() == [0, 1, 2, 3, 4]
+
+    with pytest.raises(ValueError):
+        triggers.write_npy_triggers(tmp_path / 'test.json', table, segments)
+
+
+def test_compact_table(tmp_path):
+    table = EventTable(
+        [1000000000. + numpy.arange(10) / 4., numpy.full(10, 100.),
+         numpy.arange(10.) + 5, numpy.repeat('X1:AUX', 10)],
+        names=('time', 'frequency', 'snr', 'channel'))
+    compact = triggers.compact_table(table)
+    assert triggers.is_compact(compact)
+    assert compact.dtype.names == ('time', 'frequency', 'snr')
+    assert compact['time'].dtype == numpy.int64
+    assert compact['snr'].dtype == numpy.float32
+    assert compact.meta['channel'] == 'X1:AUX'
+    assert triggers.compact_table(compact) is compact
+    out = triggers.expand_table(compact)
+    assert out.as_array().tolist() == table.as_array().tolist()
+    assert triggers.expand_table(out) is out
+
+    # compact tables are stored, and cut, as they are
+    segments = SegmentList([Segment(1000000000, 1000000003)])
+    path = tmp_path / 'X1-AUX-1000000000-3.npy.json'
+    triggers.write_npy_triggers(path, compact[:3], segments)
+    out = triggers.read_npy_triggers(path, segments=SegmentList([
+        Segment(1000000000.25, 1000000001)]))
+    assert triggers.is_compact(out)
+    assert out['time'].tolist() == [1000000000250000000, 1000000000500000000]
+    out = triggers.get_triggers('X1:AUX', 'omicron', segments,
+                                cache=[str(path)], format=None)
+    assert out['time'].tolist() == [1000000000., 1000000000.25,
+                                    1000000000.5]
+    out = triggers.get_triggers('X1:AUX', 'omicron', segments,
+                                cache=[str(path)], format=None, compact=True)
+    assert out['time'].dtype == numpy.int64
+    assert out.meta['channel'] == 'X1:AUX'
+
+
+def test_snr_order():
+    table = EventTable(
+        [numpy.array([3., 0., 2., 1., 4.]), numpy.full(5, 100.),
+         numpy.array([9., 5., 7., 8., 6.])],
+        names=('time', 'frequency', 'snr'))
+    table.meta['snr_order'] = triggers._snr_order(table)
+    # the order follows the rows through cuts and sorting
+    out = triggers._sort_table(triggers._take(
+        table, numpy.array([True, True, False, True, True])))
+    assert out['time'].tolist() == [0., 1., 3., 4.]
+    assert out['snr'][out.meta['snr_order']].tolist() == [5., 6., 8., 9.]
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) Joshua Smith (2016-)
+#
+# This file is part of the hveto python package.
+#
+# hveto is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# hveto is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with hveto.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Read-through cache of the events read for each channel
+
+The events read for a channel (see `hveto.triggers.get_triggers`) are
+stored on disk as NumPy column files, one entry per read, together with
+the SNR and frequency cuts used and the segments covered by the files
+read. Later reads of the same channel, trigger generator, read options
+and trigger files (see `file_digest`), over a subset of those segments
+and with cuts at least as strict, are then served from the cache without
+opening any trigger files.
+
+The entries are listed in an SQLite database in the cache directory,
+which serialises concurrent updates by different processes. When the
+total size of the entries exceeds a limit, those used least recently
+are removed.
+
+The key of each entry includes the path, size and modification time of
+each trigger file, so files that are added, removed or rewritten (e.g.
+while an online analysis is running) are read again.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from gwpy.segments import (Segment, SegmentList)
+
+__author__ = 'Duncan Macleod <duncan.macleod@ligo.org>'
+
+#: default maximum size (bytes) of a trigger cache
+DEFAULT_TRIGGER_CACHE_SIZE = 10 * 2 ** 30
+
+#: file extension of the manifest of each cache entry, this must match
+#: `hveto.triggers.NPY_MANIFEST_EXT`
+_MANIFEST_EXT = ".npy.json"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    name TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    snr REAL,
+    fmin REAL,
+    fmax REAL,
+    segments TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    atime REAL NOT NULL
+)
+"""
+
+_INDEX = "CREATE INDEX IF NOT EXISTS entries_key ON entries (key)"
+
+
+def file_digest(paths):
+    """Return a digest of the path, size and modification time of files
+
+    Parameters
+    ----------
+    paths : `list` of `str`
+        the paths of the files, in any order
+
+    Returns
+    -------
+    digest : `str`
+        the hex digest, for use in a `TriggerCache.key`
+    """
+    sha = hashlib.sha1()
+    for path in sorted(set(map(str, paths))):
+        try:
+            stat = os.stat(path)
+        except OSError:  # missing file
+            ident = [path]
+        else:
+            ident = [path, stat.st_size, stat.st_mtime_ns]
+        sha.update(json.dumps(ident).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def _covers(entry, segments, snr=None, frange=None):
+    """Return `True` if a cache entry holds all events that pass some cuts
+
+    Parameters
+    ----------
+    entry : `tuple`
+        the ``(snr, fmin, fmax, segments)`` of a cache entry
+
+    segments : `~gwpy.segments.SegmentList`
+        the segments in which events are needed
+
+    snr : `float`, optional
+        the minimum SNR of events needed
+
+    frange : `tuple` of `float`, optional
+        the ``[low, high)`` frequency range of events needed
+    """
+    esnr, fmin, fmax, esegments = entry
+    if esnr is not None and (snr is None or snr < esnr):
+        return False
+    if fmin is not None and (
+            frange is None or frange[0] < fmin or frange[1] > fmax):
+        return False
+    return not SegmentList(segments) - esegments
+
+
+class TriggerCache(object):
+    """On-disk read-through cache of the events read for each channel
+
+    Parameters
+    ----------
+    path : `str`
+        the directory in which to store the cache, created if needed
+
+    max_size : `int`, optional
+        the maximum total size (bytes) of the cached events, default:
+        `DEFAULT_TRIGGER_CACHE_SIZE`
+    """
+    def __init__(self, path, max_size=DEFAULT_TRIGGER_CACHE_SIZE):
+        self.path = os.path.abspath(os.path.expanduser(str(path)))
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+
+    def _connect(self):
+        # connections cannot be shared with forked processes, so each
+        # process opens its own
+        if self._db is None or self._pid != os.getpid():
+            os.makedirs(self.path, exist_ok=True)
+            self._db = sqlite3.connect(
+                os.path.join(self.path, "index.sqlite"), timeout=60,
+                isolation_level=None, check_same_thread=False)
+            self._pid = os.getpid()
+            self._db.execute(_SCHEMA)
+            self._db.execute(_INDEX)
+        return self._db
+
+    @contextmanager
+    def _transaction(self):
+        """Run a block of statements as one (exclusive) transaction
+        """
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    @staticmethod
+    def key(*args, **kwargs):
+        """Return the cache key for a read, e.g. ``(channel, etg, options)``
+        """
+        ident = json.dumps([list(map(str, args)), kwargs],
+                           sort_keys=True, default=str)
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+    def _manifest(self, name):
+        return os.path.join(self.path, name + _MANIFEST_EXT)
+
+    def _remove_files(self, name):
+        for path in glob.glob(os.path.join(glob.escape(self.path),
+                                           name + ".*")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # removed by another process
+                pass
+
+    @staticmethod
+    def _entries(db, key):
+        for name, snr, fmin, fmax, segs, size in db.execute(
+                "SELECT name, snr, fmin, fmax, segments, size FROM entries "
+                "WHERE key = ?", (key,)):
+            yield name, size, (snr, fmin, fmax, SegmentList(
+                Segment(*seg) for seg in json.loads(segs)))
+
+    def find(self, key, segments, snr=None, frange=None):
+        """Find a cache entry holding all events that pass some cuts
+
+        Parameters
+        ----------
+        key : `str`
+            the key for this read, see `TriggerCache.key`
+
+        segments : `~gwpy.segments.SegmentList`
+            the segments in which events are needed
+
+        snr : `float`, optional
+            the minimum SNR of events needed
+
+        frange : `tuple` of `float`, optional
+            the ``[low, high)`` frequency range of events needed
+
+        Returns
+        -------
+        path : `str` or `None`
+            the path of the NumPy manifest of the (smallest) matching
+            entry, see `hveto.triggers.read_npy_triggers`, or `None`
+        """
+        segments = SegmentList(segments).coalesce()
+        with self._transaction() as db:
+            matches = [(size, name) for name, size, entry in
+                       self._entries(db, key)
+                       if _covers(entry, segments, snr=snr, frange=frange)]
+            if not matches:
+                return None
+            name = min(matches)[1]
+            db.execute("UPDATE entries SET atime = ? WHERE name = ?",
+                       (time.time(), name))
+        return self._manifest(name)
+
+    def store(self, key, write, segments, snr=None, frange=None):
+        """Add a new entry to the cache
+
+        Any existing entries for the same ``key`` that are covered by the
+        new entry are removed, then, if needed, the least recently used
+        entries are removed until the cache is within its size limit.
+
+        Parameters
+        ----------
+        key : `str`
+            the key for this read, see `TriggerCache.key`
+
+        write : `callable`
+            function taking the path of a NumPy manifest file, and writing
+            the events read (see `hveto.triggers.write_npy_triggers`)
+
+        segments : `~gwpy.segments.SegmentList`
+            the segments in which events were read
+
+        snr : `float`, optional
+            the minimum SNR of the events read
+
+        frange : `tuple` of `float`, optional
+            the ``[low, high)`` frequency range of the events read
+
+        Returns
+        -------
+        path : `str` or `None`
+            the path of the manifest of the new entry, or `None` if it
+            could not be kept within the size limit
+        """
+        segments = SegmentList(segments).coalesce()
+        fmin, fmax = frange if frange is not None else (None, None)
+        name = uuid.uuid4().hex
+        os.makedirs(self.path, exist_ok=True)
+        try:
+            write(self._manifest(name))
+        except BaseException:
+            self._remove_files(name)
+            raise
+        size = sum(os.path.getsize(p) for p in glob.glob(
+            os.path.join(glob.escape(self.path), name + ".*")))
+        if size > self.max_size:
+            self._remove_files(name)
+            return None
+
+        new = (snr, fmin, fmax, segments)
+        with self._transaction() as db:
+            removed = []
+            for old, _, (osnr, ofmin, ofmax, osegs) in list(
+                    self._entries(db, key)):
+                ofrange = None if ofmin is None else (ofmin, ofmax)
+                if _covers(new, osegs, snr=osnr, frange=ofrange):
+                    removed.append(old)
+            db.execute(
+                "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, key, snr, fmin, fmax,
+                 json.dumps([[float(a), float(b)] for a, b in segments]),
+                 size, time.time()))
+            total = 0
+            for old, osize in db.execute(
+                    "SELECT name, size FROM entries ORDER BY atime DESC"
+            ).fetchall():
+                if old in removed:
+                    continue
+                total += osize
+                if total > self.max_size:
+                    removed.append(old)
+            db.executemany("DELETE FROM entries WHERE name = ?",
+                           [(old,) for old in removed])
+        # files are only removed once no longer listed, a process that
+        # is reading them will fall back to reading the trigger files
+        for old in removed:
+            self._remove_files(old)
+        return self._manifest(name)
+
+    def size(self):
+        """Return the total size (bytes) of the cached events
+        """
+        with self._lock:
+            return self._connect().execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+
+_TRIGGER_CACHES = {}
+
+
+def get_trigger_cache(cache):
+    """Return the (shared) `TriggerCache` for a directory
+
+    Parameters
+    ----------
+    cache : `str`, `TriggerCache`, or `None`
+        the cache directory, or an existing cache
+
+    Returns
+    -------
+    cache : `TriggerCache` or `None`
+        the cache, or `None` if ``cache`` is `None`
+    """
+    if cache is None or isinstance(cache, TriggerCache):
+        return cache
+    path = os.path.abspath(os.path.expanduser(str(cache)))
+    try:
+        return _TRIGGER_CACHES[path]
+    except KeyError:
+        cache = _TRIGGER_CACHES[path] = TriggerCache(path)
+        return cache
@@ -19,14 +19,24 @@
 """Trigger I/O utilities for hveto
 """
 
+import csv
 import glob
+import gzip
+import json
 import os.path
 import re
+import sqlite3
 import warnings
-from collections import OrderedDict
+from bisect import bisect_left
+from collections import (OrderedDict, deque)
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
+import h5py
 import numpy
 
+from lxml import etree
+
 from astropy.table import vstack as vstack_tables
 
 import gwtrigfind
@@ -36,7 +46,19 @@ from gwpy.io.utils import file_list
 from gwpy.table import EventTable
 from gwpy.table.filters import in_segmentlist
 from gwpy.table.io.pycbc import filter_empty_files as filter_empty_pycbc_files
-from gwpy.segments import SegmentList
+from gwpy.segments import (Segment, SegmentList)
+
+from .core import (gps_to_ns, ns_to_gps)
+from .metadata import (get_metadata_cache, skip_file)
+from .triggercache import (file_digest, get_trigger_cache)
+from .discovery import (
+    DEFAULT_DISCOVERY_CACHE,
+    GPS_DIRECTORY_WIDTH,
+    DiscoveryCache,
+    _IntervalIndex,
+    _gps_blocks,
+    get_discovery_cache,
+)
 try:
     from gwpy.io.registry import default_registry
 except ImportError:  # gwpy < 4.0.0
@@ -104,7 +126,8 @@ DEFAULT_READ_OPTIONS = {
 
 # -- find files/channels ------------------------------------------------------
 
-def find_trigger_files(channel, etg, segments, **kwargs):
+def find_trigger_files(channel, etg, segments,
+                       cache_dir=DEFAULT_DISCOVERY_CACHE, **kwargs):
     """Find trigger files for a given channel and ETG
 
     Parameters
@@ -118,6 +141,12 @@ def find_trigger_files(channel, etg, segments, **kwargs):
     segments : :class:`~ligo.segments.segmentlist`
         list of segments to find
 
+    cache_dir : `str`, optional
+        directory in which to cache the files found in each GPS directory
+        of the archive (see `hveto.discovery.DiscoveryCache`), default:
+        the ``HVETO_DISCOVERY_CACHE`` environment variable, if set,
+        otherwise the archive is searched every time
+
     **kwargs
         all other keyword arguments are passed to
         `gwtrigfind.find_trigger_urls`
@@ -141,11 +170,21 @@ def find_trigger_files(channel, etg, segments, **kwargs):
     for key, val in DEFAULT_TRIGFIND_OPTIONS.get((etg, readfmt), {}).items():
         kwargs.setdefault(key, val)
 
+    if cache_dir:
+        discovery = get_discovery_cache(cache_dir)
+
+        def _find(start, end):
+            return discovery.find(gwtrigfind.find_trigger_files, channel,
+                                  etg, start, end, **kwargs)
+    else:
+        def _find(start, end):
+            return gwtrigfind.find_trigger_files(channel, etg, start, end,
+                                                 **kwargs)
+
     cache = []
     for start, end in segments:
         try:
-            cache.extend(gwtrigfind.find_trigger_files(channel, etg, start,
-                                                       end, **kwargs))
+            cache.extend(_find(start, end))
         except ValueError as e:
             if str(e).lower().startswith('no channel-level directory'):
                 warnings.warn(str(e))
@@ -158,21 +197,78 @@ def find_trigger_files(channel, etg, segments, **kwargs):
     # remove 'empty' pycbc files from the cache
     if etg == "pycbc_live":
         ifo = channel.split(":", 1)[0]
-        cache = filter_empty_pycbc_files(cache, ifo=ifo)
+        cache = _filter_empty_pycbc_files(cache, ifo)
 
     return type(cache)(OrderedDict.fromkeys(cache))
 
 
+def _filter_empty_pycbc_files(cache, ifo):
+    """Remove empty PyCBC Live files from a cache
+
+    Files already known to be empty (or not) from the metadata cache (see
+    `hveto.metadata`) are not opened again.
+    """
+    metadata = get_metadata_cache()
+    if metadata is None:
+        return filter_empty_pycbc_files(cache, ifo=ifo)
+    options = {"empty": "pycbc_live", "ifo": ifo}
+    out = []
+    for path in cache:
+        meta = metadata.get(path, options)
+        if meta is None:
+            empty = not filter_empty_pycbc_files([path], ifo=ifo)
+            metadata.set(path, options, rows=0 if empty else None)
+        else:
+            empty = meta["rows"] == 0
+        if not empty:
+            out.append(path)
+    return type(cache)(out)
+
+
 re_delim = re.compile('[_-]')
 
+#: root directory of the archive of auxiliary channel triggers
+DEFAULT_TRIGGER_ARCHIVE = os.getenv('HVETO_TRIGGER_ARCHIVE',
+                                    '/home/detchar/triggers')
+
+
+def _find_channels_in_gps_dir(etg, ifo, gps5, archive=DEFAULT_TRIGGER_ARCHIVE):
+    """Find the channels with triggers in one GPS directory of the archive
 
-def find_auxiliary_channels(etg, gps='*', ifo='*', cache=None):
+    Returns the `list` of channel names and the `list` of directories
+    whose contents were searched.
+    """
+    stub = '_%s' % etg.lower()
+    dirglob = os.path.join(archive, ifo)
+    channels = glob.glob(os.path.join(dirglob, '*', str(gps5)))
+    use_o2 = bool(channels)
+    if not use_o2:  # try old convention
+        dirglob = os.path.join(archive, '*', ifo)
+        channels = glob.glob(os.path.join(dirglob, '*', str(gps5)))
+    out = set()
+    for path in channels:
+        path = os.path.split(path)[0]
+        if not path.lower().endswith(stub):
+            continue
+        cifo, name = path[:-len(stub)].rsplit(os.path.sep)[-2:]
+        if use_o2:
+            out.add(u'%s:%s' % (cifo, name.replace('_', '-', 1)))
+        else:
+            out.add(u'%s:%s' % (cifo, name))
+    searched = glob.glob(dirglob) + glob.glob(os.path.join(dirglob, '*'))
+    return sorted(out), searched
+
+
+def find_auxiliary_channels(etg, gps='*', ifo='*', cache=None,
+                            archive=DEFAULT_TRIGGER_ARCHIVE,
+                            cache_dir=DEFAULT_DISCOVERY_CACHE, nproc=1):
     """Find all auxiliary channels processed by a given ETG
 
     If `cache=None` is given (default), the channels are parsed from the
-    ETG archive under ``/home/detchar/triggers``. Otherwise, the channel
-    names are parsed from the files in the `cache`, assuming they follow
-    the T050017 file-naming convention.
+    ETG archive under ``archive``. Otherwise, the channel names are parsed
+    from the files in the `cache`, assuming they follow the T050017
+    file-naming convention, or read from the index of any consolidated
+    event stores in the `cache`.
 
     Parameters
     ----------
@@ -185,6 +281,17 @@ def find_auxiliary_channels(etg, gps='*', ifo='*', cache=None):
         interferometer prefix for which to find channels
     cache : `list` of `str`, optional
         `list` of files from which to parse channels
+    archive : `str`, optional
+        root directory of the trigger archive, default: the
+        ``HVETO_TRIGGER_ARCHIVE`` environment variable, if set, otherwise
+        ``/home/detchar/triggers``
+    cache_dir : `str`, optional
+        directory in which to cache the channels found in each GPS
+        directory of the archive (see `hveto.discovery.DiscoveryCache`),
+        default: the ``HVETO_DISCOVERY_CACHE`` environment variable, if set
+    nproc : `int`, optional
+        the number of threads with which to search GPS directories,
+        default: ``1``
 
     Returns
     -------
@@ -194,6 +301,9 @@ def find_auxiliary_channels(etg, gps='*', ifo='*', cache=None):
     out = set()
     if cache is not None:
         for url in cache:
+            if _is_event_store(url):
+                out.update(read_event_store_index(url))
+                continue
             try:
                 ifo, name = os.path.basename(url).split('-')[:2]
             except AttributeError:  # CacheEntry
@@ -203,37 +313,114 @@ def find_auxiliary_channels(etg, gps='*', ifo='*', cache=None):
             if channel.lower().endswith(etg.lower()):
                 channel = channel[:-len(etg)]
             out.add(u'%s' % channel.rstrip('_'))
+        return sorted(out)
+
+    if not isinstance(gps, (list, tuple)):
+        gps = (gps, gps)
+    blocks = _gps_blocks(float(gps[0]), float(gps[-1])) or [
+        int(float(gps[0]) // GPS_DIRECTORY_WIDTH)]
+
+    def _query(gps5):
+        return _find_channels_in_gps_dir(etg, ifo, gps5, archive=archive)
+
+    if cache_dir:
+        key = DiscoveryCache.key('channels', etg.lower(), ifo,
+                                 archive=os.path.abspath(archive))
+        found = get_discovery_cache(cache_dir).search(
+            key, blocks, _query, nproc=nproc).values()
     else:
-        if not isinstance(gps, (list, tuple)):
-            gps = (gps, gps)
-        gps5 = int(str(gps[0])[:5])
-        gpse = int(str(gps[-1])[:5])
-        while gps5 <= gpse and gps5 * 1e5 < gps[-1]:
-            aux_chan_glob = f'/home/detchar/triggers/{ifo}/*/{gps5}'
-            channels = glob.glob(aux_chan_glob)
-            if len(channels) == 0:  # try old convention
-                channels = glob.glob(os.path.join(
-                    '/home/detchar/triggers', '*', ifo, '*', str(gps5)))
-                use_o2 = False
-            else:
-                use_o2 = True
-            stub = '_%s' % etg.lower()
-            for path in channels:
-                path = os.path.split(path)[0]
-                if not path.lower().endswith('_%s' % etg.lower()):
-                    continue
-                ifo, name = path[:-len(stub)].rsplit(os.path.sep)[-2:]
-                if use_o2:
-                    out.add(u'%s:%s' % (ifo, name.replace('_', '-', 1)))
-                else:
-                    out.add(u'%s:%s' % (ifo, name))
-            gps5 += 1
+        with ThreadPoolExecutor(max_workers=max(nproc, 1)) as executor:
+            found = [chans for chans, _ in executor.map(_query, blocks)]
+    for channels in found:
+        out.update(channels)
     return sorted(out)
 
 
 # -- read ---------------------------------------------------------------------
 
 
+def _channel_prefix(channel):
+    """Return the (T050017) file name prefix for a channel
+    """
+    ifo, name = channel.split(':', 1)
+    return "{}-{}".format(ifo, name.replace('-', '_'))
+
+
+class CacheCatalog(list):
+    """A cache of trigger files, indexed by channel and time
+
+    This is a `list` of file paths, as returned by
+    `gwpy.io.cache.read_cache`, with an index built (once) on creation:
+    files following the T050017 naming convention are grouped by their
+    ``<obs>-<description>`` prefix, held in sorted order, and the files
+    for each prefix are sorted by start time, so that the files for a
+    channel, or for a channel over a list of segments, can be found
+    without scanning the whole cache.
+
+    The index is not updated if the `list` is modified.
+
+    Parameters
+    ----------
+    cache : `list` of `str`
+        the paths of the files in the cache
+    """
+    def __init__(self, cache=()):
+        super().__init__(cache)
+        groups = OrderedDict()
+        self._unindexed = []
+        for path in self:
+            try:
+                obs, desc, _ = os.path.basename(path).split('-', 2)
+                io_cache.file_segment(path)
+            except (ValueError, TypeError):
+                self._unindexed.append(path)
+            else:
+                groups.setdefault('{}-{}'.format(obs, desc), []).append(path)
+        self._prefixes = sorted(groups)
+        self._index = dict((p, _IntervalIndex(f)) for p, f in groups.items())
+
+    @classmethod
+    def read(cls, *sources):
+        """Read a catalog from one or more LAL-format cache files
+        """
+        return cls(e for source in sources for e in io_cache.read_cache(source))
+
+    def files(self, channel, segments=None):
+        """Find the files in this cache for a channel
+
+        Files are matched to the channel if their (T050017) names start
+        with ``<IFO>-<NAME>``, for a channel named ``<IFO>:<NAME>`` (with
+        all dashes in the name replaced by underscores).
+
+        Parameters
+        ----------
+        channel : `str`
+            the name of the channel
+
+        segments : `~gwpy.segments.SegmentList`, optional
+            if given, only return files that overlap these segments
+
+        Returns
+        -------
+        files : `list` of `str`
+            the matching files, in time order for each file name prefix
+        """
+        match = _channel_prefix(channel)
+        out = []
+        i = bisect_left(self._prefixes, match)
+        while i < len(self._prefixes) and self._prefixes[i].startswith(match):
+            index = self._index[self._prefixes[i]]
+            if segments is None:
+                out.extend(index.files)
+            else:
+                for start, end in segments:
+                    out.extend(index.search(start, end))
+            i += 1
+        out.extend(e for e in self._unindexed
+                   if os.path.basename(e).startswith(match))
+        return list(OrderedDict.fromkeys(out))
+
+
 def _sanitize_name(name):
     return re.sub(r"[-_.]", "_", name).lower()
 
@@ -260,10 +447,22 @@ def _format_params(channel, etg, fmt, trigfind_kwargs, read_kwargs):
         read_kwargs.setdefault("ifo", channel.split(":", 1)[0])
     if etg == "snax":
         read_kwargs.setdefault("channels", channel)
+    if fmt == "hdf5.hveto":
+        read_kwargs.setdefault("channel", channel)
 
     return trigfind_kwargs, read_kwargs
 
 
+def _identify_format(source):
+    """Identify the format of a trigger file
+    """
+    if str(source).endswith(NPY_MANIFEST_EXT):
+        return "npy"
+    if _is_event_store(source):
+        return "hdf5.hveto"
+    return get_read_format(EventTable, source, (), {})
+
+
 def get_read_format(cls, source, args, kwargs):
     """Get the read format for the given type and input source.
     """
@@ -277,9 +476,706 @@ def get_read_format(cls, source, args, kwargs):
     )
 
 
-def get_triggers(channel, etg, segments, cache=None, snr=None, frange=None,
-                 raw=False, extra_times=None, trigfind_kwargs={}, **read_kwargs):
-    """Get triggers for the given channel
+def _cut(data, segments=None, snr=None, frange=None):
+    """Find the rows of a table that pass all cuts
+
+    The first three columns are taken to be the time, frequency-like,
+    and SNR-like columns, respectively.
+    """
+    tcolumn, fcolumn, scolumn = data.dtype.names[:3]
+    keep = numpy.ones(len(data), dtype=bool)
+    if snr is not None:
+        keep &= data[scolumn] >= snr
+    if frange is not None:
+        keep &= data[fcolumn] >= frange[0]
+        keep &= data[fcolumn] < frange[1]
+    if segments is not None:
+        times = data[tcolumn]
+        if numpy.issubdtype(times.dtype, numpy.integer):  # nanoseconds
+            times = ns_to_gps(times)
+        keep &= in_segmentlist(times, segments)
+    return keep
+
+
+#: key of the table metadata holding the (ascending argsort) SNR order of
+#: its rows
+SNR_ORDER = "snr_order"
+
+
+def _snr_order(data):
+    """Return the (stable) argsort of the SNR-like (third) column of a table
+    """
+    return numpy.argsort(data[data.dtype.names[2]], kind="stable")
+
+
+def _take(table, keep):
+    """Select the rows of a table with a boolean mask
+
+    Any SNR order of the table (see `SNR_ORDER`) is restricted to the
+    selected rows, without sorting again.
+    """
+    if keep.all():
+        return table
+    order = table.meta.get(SNR_ORDER)
+    out = table[keep]
+    if order is not None:
+        position = numpy.cumsum(keep) - 1
+        out.meta[SNR_ORDER] = position[order[keep[order]]]
+    return out
+
+
+def _vstack(tables):
+    """Stack tables, dropping any SNR order, which would not be valid
+    """
+    for table in tables:
+        table.meta.pop(SNR_ORDER, None)
+    return vstack_tables(tables, metadata_conflicts='silent')
+
+
+def cluster_triggers(table, **clusterkwargs):
+    """Cluster a table of events, as for the primary channel
+
+    Parameters
+    ----------
+    table : `~gwpy.table.EventTable`
+        the events to cluster
+
+    **clusterkwargs
+        the ``index``, ``rank`` and ``window`` to pass to
+        `~gwpy.table.EventTable.cluster`, normally the ``cluster-``
+        options of the ``[primary]`` section of the configuration,
+        if none are given the table is returned unchanged
+
+    Returns
+    -------
+    table : `~gwpy.table.EventTable`
+        the clustered events
+    """
+    if not clusterkwargs:
+        return table
+    clustered = table.cluster(**clusterkwargs)
+    clustered.meta.pop(SNR_ORDER, None)
+    return clustered
+
+
+# -- compact tables -------------
+
+#: key of the table metadata recording the unit of (integer) times
+TIME_UNIT = "time_unit"
+
+#: key of the table metadata holding the channel of a compact table
+CHANNEL = "channel"
+
+
+def is_compact(table):
+    """Return `True` if a table holds compact columns, see `compact_table`
+    """
+    return table.meta.get(TIME_UNIT) == "ns"
+
+
+def compact_table(table):
+    """Return a copy of a table with compact numeric columns
+
+    The first (time) column is converted to integer GPS nanoseconds (see
+    `hveto.core.gps_to_ns`), which keeps sub-microsecond precision and
+    allows exact comparisons, all other floating-point columns are
+    converted to single precision, and a ``'channel'`` column holding
+    a single channel name is replaced by a single entry in the metadata.
+    This roughly halves the memory needed for a table of events.
+
+    Parameters
+    ----------
+    table : `~gwpy.table.EventTable`
+        the table to convert
+
+    Returns
+    -------
+    compact : `~gwpy.table.EventTable`
+        the compact table, or ``table`` itself if already compact
+
+    See also
+    --------
+    expand_table
+        for the reverse conversion
+    """
+    if is_compact(table):
+        return table
+    meta = dict(table.meta)
+    meta[TIME_UNIT] = "ns"
+    names = table.dtype.names
+    columns = []
+    for name in names:
+        column = numpy.asarray(table[name])
+        if name == names[0]:
+            column = gps_to_ns(column)
+        elif column.dtype.kind == "f":
+            column = column.astype("float32", copy=False)
+        elif name == "channel" and column.size and (
+                column == column[0]).all():
+            meta[CHANNEL] = str(column[0])
+            continue
+        columns.append((name, column))
+    return EventTable([c for _, c in columns], names=[n for n, _ in columns],
+                      meta=meta, copy=False)
+
+
+def expand_table(table):
+    """Return a copy of a compact table with times in seconds
+
+    The time column of a compact table (see `compact_table`) is converted
+    back to (double-precision) GPS seconds, and its ``'channel'`` column
+    restored, other columns are not changed.
+
+    Parameters
+    ----------
+    table : `~gwpy.table.EventTable`
+        the table to convert
+
+    Returns
+    -------
+    expanded : `~gwpy.table.EventTable`
+        the expanded table, or ``table`` itself if not compact
+    """
+    if not is_compact(table):
+        return table
+    meta = dict(table.meta)
+    meta.pop(TIME_UNIT)
+    channel = meta.pop(CHANNEL, None)
+    names = list(table.dtype.names)
+    columns = [numpy.asarray(table[name]) for name in names]
+    columns[0] = ns_to_gps(columns[0])
+    if channel is not None:
+        columns.append(numpy.repeat(channel, len(table)))
+        names.append("channel")
+    return EventTable(columns, names=names, meta=meta, copy=False)
+
+
+def _convert_table(table, compact=False):
+    return compact_table(table) if compact else expand_table(table)
+
+
+# -- HDF5 -----------------------
+
+#: number of rows to read from an HDF5 dataset at once
+HDF5_CHUNK_SIZE = 2 ** 16
+
+
+def _read_hdf5_rows(dset, columns, start, stop, chunksize=HDF5_CHUNK_SIZE,
+                    **cuts):
+    """Read rows ``[start, stop)`` of a dataset in chunks, applying cuts
+
+    Returns the `list` of passing arrays.
+    """
+    view = dset.fields(columns)
+    chunks = []
+    for i in range(start, stop, chunksize):
+        data = view[i:min(i + chunksize, stop)]
+        keep = _cut(data, **cuts)
+        if keep.any():
+            chunks.append(data[keep])
+    return chunks
+
+
+def _read_hdf5_dataset(dset, columns, segments=None, **cuts):
+    """Read the rows of an HDF5 dataset that pass all cuts
+
+    If ``segments`` is given, and the time column is sorted (as written by
+    Omicron and SNAX), only the rows inside the segment extent are read,
+    otherwise all rows are read. The time column is read in full to check.
+    """
+    start, stop = 0, dset.shape[0]
+    if segments and stop:
+        times = dset.fields(columns[0])[()]
+        if (times[1:] >= times[:-1]).all():
+            tstart, tend = segments.extent()
+            start = int(numpy.searchsorted(times, tstart, side='left'))
+            stop = int(numpy.searchsorted(times, tend, side='left'))
+    return _read_hdf5_rows(dset, columns, start, stop, segments=segments,
+                           **cuts)
+
+
+def _read_hdf5_tables(datasets, columns=None, **cuts):
+    """Read the rows of a list of HDF5 datasets that pass all cuts
+    """
+    if columns is None:
+        columns = datasets[0].dtype.names
+    columns = list(columns)
+    chunks = [chunk for dset in datasets
+              for chunk in _read_hdf5_dataset(dset, columns, **cuts)]
+    if chunks:
+        return EventTable(numpy.concatenate(chunks))
+    dtype = numpy.dtype([(c, datasets[0].dtype[c]) for c in columns])
+    return EventTable(numpy.empty(0, dtype=dtype))
+
+
+def _read_hdf5_triggers(source, path=None, channels=None, columns=None,
+                        **cuts):
+    """Read triggers from an Omicron or SNAX HDF5 file, applying cuts
+
+    Omicron files hold a single table at ``path``, while SNAX files hold
+    one group per channel, each containing one or more tables.
+    """
+    with h5py.File(source, 'r') as h5f:
+        if channels is None:
+            datasets = [h5f[path]]
+        else:
+            if isinstance(channels, str):
+                channels = [channels]
+            missing = set(channels) - set(h5f.keys())
+            if missing:
+                raise ValueError(
+                    "requested channels not found in SNAX file: '{}'".format(
+                        "', '".join(sorted(missing))))
+            datasets = [d for c in channels for d in h5f[c].values()]
+        return _read_hdf5_tables(datasets, columns=columns, **cuts)
+
+
+def _read_snax_channels(source, channels, columns=None, **cuts):
+    """Read triggers for many channels from a SNAX file in one pass
+
+    Returns a `dict` of tables for each of the ``channels`` found in
+    the file, channels not in the file are ignored.
+    """
+    out = {}
+    with h5py.File(source, 'r') as h5f:
+        for channel in channels:
+            datasets = list(h5f[channel].values()) if channel in h5f else []
+            if datasets:
+                out[channel] = _read_hdf5_tables(datasets, columns=columns,
+                                                 **cuts)
+    return out
+
+
+def _use_hdf5_reader(read_kwargs):
+    """Return `True` if a file can be read with `_read_hdf5_triggers`
+    """
+    fmt = read_kwargs.get("format")
+    if fmt == "hdf5":
+        required = "path"
+    elif fmt == "hdf5.snax":
+        required = "channels"
+    else:
+        return False
+    allowed = {"format", "path", "channels", "columns"}
+    return required in read_kwargs and set(read_kwargs) <= allowed
+
+
+# -- LIGO_LW --------------------
+
+#: numpy types for numeric LIGO_LW column types
+LIGOLW_TYPES = {
+    "int_2s": "int16",
+    "int_4s": "int32",
+    "int_8s": "int64",
+    "real_4": "float32",
+    "real_8": "float64",
+}
+
+#: number of LIGO_LW rows tokenized (and cut) at a time
+LIGOLW_CHUNK = 4096
+
+
+def _ligolw_name(name, suffix=None):
+    """Strip the table prefix (and an optional suffix) from a LIGO_LW name
+    """
+    if suffix and name.endswith(suffix):
+        name = name[:-len(suffix)]
+    return name.rsplit(":", 1)[-1]
+
+
+def _ligolw_rows(text, ncol, delimiter=",", chunk=LIGOLW_CHUNK):
+    """Split the text of a LIGO_LW ``<Stream>`` into 2-D arrays of tokens
+
+    Lines are tokenized as they are reached, yielding (at most) ``chunk``
+    rows at a time, so that the tokens of the whole table are never held
+    in memory at once. An empty stream yields a single empty block.
+    """
+    tokens = []
+    empty = True
+    for match in re.finditer("[^\n]+", text):
+        line = match.group().strip()
+        if not line:
+            continue
+        row = next(csv.reader([line], delimiter=delimiter, escapechar="\\",
+                              doublequote=False, skipinitialspace=True))
+        if line.endswith(delimiter) and not line.endswith("\\" + delimiter):
+            row.pop()  # the delimiter between this row and the next
+        tokens.extend(row)
+        if len(tokens) >= chunk * ncol:
+            size = len(tokens) - len(tokens) % ncol
+            yield numpy.array(tokens[:size], dtype=object).reshape(-1, ncol)
+            del tokens[:size]
+            empty = False
+    if len(tokens) % ncol:
+        raise ValueError("cannot parse LIGO_LW stream with %d columns"
+                         % ncol)
+    if tokens or empty:
+        yield numpy.array(tokens, dtype=object).reshape(-1, ncol)
+
+
+class _LigolwTable(object):
+    """Access to the (numeric) columns of one parsed LIGO_LW table
+    """
+    def __init__(self, element):
+        self.types = OrderedDict(
+            (_ligolw_name(col.get("Name")), col.get("Type"))
+            for col in element.iterfind("Column"))
+        self.index = dict((name, i) for i, name in enumerate(self.types))
+        self.stream = element.find("Stream")
+
+    def chunks(self, chunk=LIGOLW_CHUNK):
+        """Yield blocks of (at most) ``chunk`` rows of tokens
+        """
+        return _ligolw_rows(self.stream.text or "", len(self.types),
+                            delimiter=self.stream.get("Delimiter", ","),
+                            chunk=chunk)
+
+    def column(self, name, rows):
+        """Return a column of a block of rows as a numpy array, combining
+        GPS ``_time`` and ``_time_ns`` columns for names like ``'peak'``
+        """
+        if name not in self.index and name + "_time" in self.index:
+            sec = self.column(name + "_time", rows).astype("float64")
+            nsec = self.column(name + "_time_ns", rows).astype("float64")
+            return sec + nsec * 1e-9
+        try:
+            dtype = LIGOLW_TYPES[self.types[name]]
+        except KeyError:
+            raise ValueError("cannot read LIGO_LW column %r" % name)
+        return rows[:, self.index[name]].astype(dtype)
+
+
+def _read_ligolw_triggers(source, tablename, columns, **cuts):
+    """Read columns of a LIGO_LW table, applying cuts as rows are read
+
+    The (optionally gzipped) XML document is parsed one ``<Table>`` at a
+    time, and the rows of each table are tokenized in blocks: the time,
+    frequency-like and SNR-like columns (the first three) of each block are
+    converted and cut first, and only the surviving rows of any other
+    requested columns are converted, with ``peak`` (for example) formed from
+    ``peak_time`` and ``peak_time_ns``.
+
+    Notes
+    -----
+    The text of each ``<Table>`` is still held in memory while its rows
+    are read, but the tokens of rejected rows are discarded a block at a
+    time.
+    """
+    opener = gzip.open if str(source).endswith(".gz") else open
+    data = OrderedDict((c, []) for c in columns)
+    with opener(source, "rb") as f:
+        for _, element in etree.iterparse(f, tag="Table", huge_tree=True):
+            if _ligolw_name(element.get("Name"), ":table") != tablename:
+                continue
+            table = _LigolwTable(element)
+            for rows in table.chunks():
+                cut = OrderedDict((c, table.column(c, rows))
+                                  for c in columns[:3])
+                keep = _cut(numpy.rec.fromarrays(list(cut.values()),
+                                                 names=list(cut)), **cuts)
+                for col in columns:
+                    if col in cut:
+                        data[col].append(cut[col][keep])
+                    else:
+                        data[col].append(table.column(col, rows[keep]))
+            element.clear()
+    if not all(data.values()):
+        raise ValueError("no %r table found in %s" % (tablename, source))
+    return EventTable(
+        [numpy.concatenate(arrs) for arrs in data.values()],
+        names=list(data), meta={"tablename": tablename})
+
+
+def _use_ligolw_reader(read_kwargs):
+    """Return `True` if a file can be read with `_read_ligolw_triggers`
+    """
+    if read_kwargs.get("format") != "ligolw" or "tablename" not in read_kwargs:
+        return False
+    allowed = {"format", "tablename", "columns", "use_numpy_dtypes"}
+    ncol = len(read_kwargs.get("columns") or ())
+    return ncol >= 3 and set(read_kwargs) <= allowed
+
+
+# -- NumPy ----------------------
+
+#: file extension for the manifest of a set of NumPy column files
+NPY_MANIFEST_EXT = ".npy.json"
+
+
+def _npy_column_path(path, column):
+    path = Path(path)
+    stem = path.name[:-len(NPY_MANIFEST_EXT)]
+    return path.with_name("{}.{}.npy".format(stem, column))
+
+
+def read_npy_manifest(path):
+    """Read the manifest for a set of NumPy trigger column files
+
+    Parameters
+    ----------
+    path : `str`
+        the path of the manifest file
+
+    Returns
+    -------
+    manifest : `dict`
+        the manifest, with keys ``'rows'`` (the number of rows),
+        ``'columns'`` (the `list` of column names), and ``'segments'``
+        (a `~gwpy.segments.SegmentList` of the times analysed)
+    """
+    with open(path, "r") as f:
+        manifest = json.load(f)
+    manifest["segments"] = SegmentList(
+        Segment(*seg) for seg in manifest["segments"])
+    return manifest
+
+
+def write_npy_triggers(path, table, segments):
+    """Write a table of triggers as a set of NumPy column files
+
+    Each column is written as a little-endian ``.npy`` file alongside a
+    JSON manifest recording the columns, the number of rows, and the
+    segments that were analysed. These files can then be loaded without
+    copying via memory-mapping.
+
+    Parameters
+    ----------
+    path : `str`
+        the path of the manifest file, must end with ``'.npy.json'``
+
+    table : `~gwpy.table.EventTable`
+        the table of triggers to write
+
+    segments : `~gwpy.segments.SegmentList`
+        the segments over which these triggers were found
+    """
+    if not str(path).endswith(NPY_MANIFEST_EXT):
+        raise ValueError("NumPy trigger manifest must end with {!r}".format(
+            NPY_MANIFEST_EXT))
+    for name in table.dtype.names:
+        column = numpy.asarray(table[name])
+        numpy.save(_npy_column_path(path, name),
+                   column.astype(column.dtype.newbyteorder("<")))
+    numpy.save(_npy_column_path(path, SNR_ORDER),
+               _snr_order(table).astype("<i8"))
+    manifest = {
+        "rows": len(table),
+        "columns": list(table.dtype.names),
+        "segments": [[float(a), float(b)] for a, b in segments],
+        SNR_ORDER: True,
+    }
+    if is_compact(table):
+        manifest[TIME_UNIT] = table.meta[TIME_UNIT]
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_npy_triggers(path, columns=None, **cuts):
+    """Read a set of NumPy trigger column files
+
+    The column files are memory-mapped, and if no rows are cut, the
+    columns of the returned table are views of those files.
+
+    Parameters
+    ----------
+    path : `str`
+        the path of the manifest file
+
+    columns : `list` of `str`, optional
+        the columns to read, default: all columns
+
+    **cuts
+        ``segments``, ``snr`` and ``frange`` cuts to apply
+
+    Returns
+    -------
+    table : `~gwpy.table.EventTable`
+        the table of triggers
+    """
+    manifest = read_npy_manifest(path)
+    if columns is None:
+        columns = manifest["columns"]
+    table = EventTable(
+        [numpy.load(_npy_column_path(path, c), mmap_mode="r")
+         for c in columns],
+        names=list(columns),
+        copy=False,
+    )
+    if manifest.get(SNR_ORDER):
+        table.meta[SNR_ORDER] = numpy.load(
+            _npy_column_path(path, SNR_ORDER), mmap_mode="r")
+    if manifest.get(TIME_UNIT):
+        table.meta[TIME_UNIT] = manifest[TIME_UNIT]
+    return _take(table, _cut(table, **cuts))
+
+
+# -- event store ----------------
+
+#: file extension for a consolidated multi-channel event store
+EVENT_STORE_EXT = ".hveto.h5"
+
+#: the dtype of the index of an event store
+EVENT_STORE_INDEX_DTYPE = numpy.dtype([
+    ("channel", h5py.string_dtype()),
+    ("rows", "i8"),
+    ("tmin", "f8"),
+    ("tmax", "f8"),
+    ("maxsnr", "f8"),
+])
+
+
+def _is_event_store(source):
+    return str(source).endswith(EVENT_STORE_EXT)
+
+
+def read_event_store_index(path):
+    """Read the index of a consolidated event store
+
+    Parameters
+    ----------
+    path : `str`
+        the path of the event store
+
+    Returns
+    -------
+    index : `dict`
+        a `dict` for each channel in the store, with keys ``'rows'``
+        (the number of rows), ``'tmin'`` and ``'tmax'`` (the time span
+        of those rows), and ``'maxsnr'`` (the loudest SNR)
+    """
+    with h5py.File(path, "r") as h5f:
+        if "index" not in h5f:
+            return OrderedDict()
+        index = h5f["index"][()]
+    return OrderedDict((
+        row["channel"].decode("utf-8") if isinstance(row["channel"], bytes)
+        else row["channel"],
+        dict((key, row[key].item()) for key in ("rows", "tmin", "tmax", "maxsnr")),
+    ) for row in index)
+
+
+def _skip_store_group(group, segments=None, snr=None, **cuts):
+    """Return `True` if no rows of an event store group can pass all cuts
+    """
+    attrs = group.attrs
+    if not attrs.get("rows"):
+        return True
+    if snr is not None and attrs["maxsnr"] < snr:
+        return True
+    if segments is not None:
+        span = Segment(attrs["tmin"], attrs["tmax"])
+        return not any(a <= span[1] and span[0] < b for a, b in segments)
+    return False
+
+
+def _read_store_group(group, columns=None, **cuts):
+    """Read the rows of an event store group that pass all cuts
+    """
+    if columns is None:
+        columns = list(group.attrs["columns"])
+    columns = list(columns)
+    meta = {}
+    if group.attrs.get(TIME_UNIT):
+        meta[TIME_UNIT] = group.attrs[TIME_UNIT]
+    if _skip_store_group(group, **cuts):
+        dtype = [(c, group[c].dtype) for c in columns]
+        return EventTable(numpy.empty(0, dtype=dtype), meta=meta)
+    # read the time, frequency and snr columns first to apply cuts
+    cutcols = list(group.attrs["columns"])[:3]
+    data = dict((c, group[c][()]) for c in cutcols)
+    keep = _cut(numpy.rec.fromarrays([data[c] for c in cutcols],
+                                     names=cutcols), **cuts)
+    table = EventTable(
+        [data[c] if c in data else group[c][()] for c in columns],
+        names=columns, meta=meta)
+    if SNR_ORDER in group:
+        table.meta[SNR_ORDER] = group[SNR_ORDER][()]
+    return _take(table, keep)
+
+
+def read_event_store_triggers(path, channel, columns=None, **cuts):
+    """Read the triggers for one channel from a consolidated event store
+
+    Parameters
+    ----------
+    path : `str`
+        the path of the event store
+
+    channel : `str`
+        the name of the channel to read
+
+    columns : `list` of `str`, optional
+        the columns to read, default: all columns
+
+    **cuts
+        ``segments``, ``snr`` and ``frange`` cuts to apply
+
+    Returns
+    -------
+    table : `~gwpy.table.EventTable`
+        the table of triggers, empty if the channel is not in the store
+    """
+    return _read_store_channels(path, [channel], columns=columns,
+                                **cuts).get(channel, EventTable(
+                                    names=columns or ['time', 'frequency', 'snr']))
+
+
+def _read_store_channels(source, channels, columns=None, **cuts):
+    """Read triggers for many channels from an event store in one pass
+
+    Returns a `dict` of tables for each of the ``channels`` found in
+    the store, channels not in the store are ignored.
+    """
+    out = {}
+    with h5py.File(source, "r") as h5f:
+        groups = h5f.get("channels", {})
+        for channel in channels:
+            if channel in groups:
+                out[channel] = _read_store_group(groups[channel],
+                                                 columns=columns, **cuts)
+    return out
+
+
+# -- files ----------------------
+
+def _read_trigger_file(source, read_kwargs, segments=None, snr=None,
+                       frange=None):
+    """Read a single trigger file, keeping only the rows that pass all cuts
+
+    The first three columns are taken to be the time, frequency-like,
+    and SNR-like columns, respectively.
+    """
+    cuts = {"segments": segments, "snr": snr, "frange": frange}
+    if read_kwargs.get("format") == "npy":
+        return read_npy_triggers(source, columns=read_kwargs.get("columns"),
+                                 **cuts)
+    if read_kwargs.get("format") == "hdf5.hveto":
+        return read_event_store_triggers(
+            source, read_kwargs["channel"], columns=read_kwargs.get("columns"),
+            **cuts)
+    if _use_hdf5_reader(read_kwargs):
+        kwargs = {k: v for k, v in read_kwargs.items() if k != "format"}
+        return _read_hdf5_triggers(source, **kwargs, **cuts)
+    if _use_ligolw_reader(read_kwargs):
+        try:
+            return _read_ligolw_triggers(
+                source, read_kwargs["tablename"], read_kwargs["columns"],
+                **cuts)
+        except ValueError:  # fall back to the full LIGO_LW reader
+            pass
+    table = EventTable.read(source, **read_kwargs)
+    table.meta = {k: table.meta[k] for k in TABLE_META if table.meta.get(k)}
+    if not len(table):
+        return table
+    keep = _cut(table, **cuts)
+    if keep.all():
+        return table
+    return table[keep]
+
+
+def _prepare_read(channel, etg, segments, cache, trigfind_kwargs,
+                  read_kwargs):
+    """Format the read options for a channel, and find its files if needed
     """
     etg = _sanitize_name(etg)
     # format arguments
@@ -289,7 +1185,7 @@ def get_triggers(channel, etg, segments, cache=None, snr=None, frange=None,
         raise ValueError("unsupported ETG {!r}".format(etg))
     if not readfmt and cache:
         # try to identify format from files in cache
-        readfmt = get_read_format(EventTable, cache[0], (), {})
+        readfmt = _identify_format(cache[0])
     trigfind_kwargs, read_kwargs = _format_params(
         channel,
         etg,
@@ -301,64 +1197,296 @@ def get_triggers(channel, etg, segments, cache=None, snr=None, frange=None,
     # find triggers
     if cache is None:
         cache = find_trigger_files(channel, etg, segments, **trigfind_kwargs)
+    return cache, read_kwargs
 
-    # read files
-    tables = []
-    for segment in segments:
-        segaslist = SegmentList([segment])
-        segcache = io_cache.sieve(cache, segment=segment)
-        # try and work out if cache overextends segment (so we need to crop)
-        cachesegs = io_cache.cache_segments(segcache)
-        outofbounds = abs(cachesegs - segaslist)
-        if segcache:
-            # if len(segcache) == 1:  # just pass the single filename
-            #     segcache = segcache[0]
-            # read trigger files one by one so we can ignore empty ones
-
-            # new = EventTable.read(segcache, **read_kwargs)
-            new: EventTable = None
-            for trig_file in segcache:
-                trig_tbl = EventTable.read(trig_file, **read_kwargs)
-                if len(trig_tbl) > 0:
-                    if new:
-                        new = vstack_tables([new, trig_tbl])
-                    else:
-                        new = trig_tbl
-                else:
-                    pass    # place for a breakpoint
-
-            if new is not None and len(new) > 0:
-                new.meta = {k: new.meta[k] for k in TABLE_META if new.meta.get(k)}
-                if outofbounds:
-                    new = new[in_segmentlist(new[new.dtype.names[0]], segaslist)]
-                tables.append(new)
-    if len(tables):
-        table = vstack_tables(tables)
-    else:
-        table = EventTable(names=read_kwargs.get(
-            'columns', ['time', 'frequency', 'snr']))
+
+def _imap_ordered(func, iterable, nproc=1):
+    """Map a function over an iterable using a bounded pool of threads
+
+    Results are yielded in input order, with at most ``2 * nproc`` calls
+    in flight (or completed but not yet consumed) at any time.
+    """
+    if nproc <= 1:
+        yield from map(func, iterable)
+        return
+    with ThreadPoolExecutor(max_workers=nproc) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * nproc:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _file_crops(cache, segments):
+    """Yield each unique file that overlaps a segment list, once, in order
+
+    Each file is paired with the list of segments it overlaps, if its rows
+    need to be cropped to those segments, otherwise `None`.
+    """
+    segments = SegmentList(segments).coalesce()
+    if not segments:
+        return
+    starts, ends = numpy.asarray(segments, dtype=float).T
+    for trig_file in sorted(OrderedDict.fromkeys(cache),
+                            key=io_cache.file_segment):
+        fstart, fend = io_cache.file_segment(trig_file)
+        # segments[i:j] are those that intersect [fstart, fend)
+        i = numpy.searchsorted(ends, fstart, side='right')
+        j = numpy.searchsorted(starts, fend, side='left')
+        if i >= j:
+            continue
+        if j - i == 1 and starts[i] <= fstart and fend <= ends[i]:
+            yield trig_file, None
+        else:
+            yield trig_file, SegmentList(segments[i:j])
+
+
+def _read_segments(cache, segments, read_kwargs, snr=None, frange=None,
+                   nproc=1):
+    """Yield the non-empty table of events that pass all cuts for each file
+
+    Each file is read once, even if it spans several segments. If a
+    metadata cache is configured (see `hveto.metadata`), files known to
+    hold no events that pass the cuts are not opened, and the metadata
+    for any file not yet recorded is recorded as it is read.
+    """
+    metadata = get_metadata_cache()
+
+    def _read(args):
+        trig_file, crop = args
+        if metadata is None:
+            return _read_trigger_file(trig_file, read_kwargs, segments=crop,
+                                      snr=snr, frange=frange)
+        meta = metadata.get(trig_file, read_kwargs)
+        if meta is not None and skip_file(meta, segments=crop, snr=snr):
+            return ()
+        if meta is not None:
+            return _read_trigger_file(trig_file, read_kwargs, segments=crop,
+                                      snr=snr, frange=frange)
+        # read the full file once to record its metadata
+        table = _read_trigger_file(trig_file, read_kwargs)
+        metadata.set_table(trig_file, table, read_kwargs)
+        if not len(table):
+            return table
+        return _take(table, _cut(table, segments=crop, snr=snr,
+                                 frange=frange))
+
+    for new in _imap_ordered(_read, _file_crops(cache, segments),
+                             nproc=nproc):
+        if len(new):
+            yield new
+
+
+def _rechunk(tables, size):
+    """Regroup a stream of tables into tables of (at most) ``size`` rows
+    """
+    buffer = []
+    nrows = 0
+    for table in tables:
+        buffer.append(table)
+        nrows += len(table)
+        if nrows < size:
+            continue
+        table = _vstack(buffer)
+        nfull = nrows - nrows % size
+        for i in range(0, nfull, size):
+            yield table[i:i + size]
+        buffer = [table[nfull:]] if nfull < nrows else []
+        nrows -= nfull
+    if buffer:
+        yield _vstack(buffer)
+
+
+def _sort_table(table):
+    """Sort a table by its first (time) column
+
+    Any SNR order of the table (see `SNR_ORDER`) is kept in step with
+    the sorted rows.
+    """
+    times = numpy.asarray(table[table.dtype.names[0]])
+    if not (numpy.diff(times) < 0).any():
+        return table
+    perm = numpy.argsort(times, kind="stable")
+    order = table.meta.get(SNR_ORDER)
+    table = table[perm]
+    if order is not None:
+        rank = numpy.empty_like(perm)
+        rank[perm] = numpy.arange(perm.size)
+        table.meta[SNR_ORDER] = rank[order]
+    return table
+
+
+def _format_table(table, channel):
+    """Rename the time column of a table, and add a ``'channel'`` column
+
+    The channel of a compact table (see `compact_table`) is recorded in
+    its metadata instead.
+    """
+    tcolumn = table.dtype.names[0]
+    if tcolumn != "time":
+        table.rename_column(tcolumn, 'time')
+    if is_compact(table):
+        table.meta[CHANNEL] = channel
+        return
+    table.add_column(table.Column(data=numpy.repeat(channel, len(table)),
+                                  name='channel'))
+
+
+def iter_triggers(channel, etg, segments, cache=None, snr=None, frange=None,
+                  raw=False, chunksize=None, nproc=1, trigfind_kwargs=None,
+                  **read_kwargs):
+    """Iterate over the triggers for the given channel in chunks
+
+    This applies the same format defaults, and SNR and frequency cuts,
+    as `get_triggers`, but only holds (roughly) one chunk in memory at
+    any time.
+
+    Parameters
+    ----------
+    channel : `str`
+        name of channel to read
+
+    etg : `str`
+        name of event trigger generator
+
+    segments : :class:`~ligo.segments.segmentlist`
+        list of segments to read
+
+    cache : `list` of `str`, optional
+        cache of trigger file paths, default: discover with
+        `find_trigger_files`
+
+    snr : `float`, optional
+        minimum SNR for events to keep
+
+    frange : `tuple` of `float`, optional
+        ``[low, high)`` frequency range for events to keep
+
+    raw : `bool`, optional
+        if `True`, yield tables as read, without renaming the time
+        column or adding a ``'channel'`` column, default: `False`
+
+    chunksize : `int`, optional
+        the number of rows per chunk, default: one chunk per file
+
+    nproc : `int`, optional
+        the number of threads with which to read files, default: ``1``
+
+    trigfind_kwargs : `dict`, optional
+        keyword arguments to pass to `find_trigger_files`
+
+    **read_kwargs
+        all other keyword arguments are passed to `EventTable.read`
+
+    Yields
+    ------
+    table : `~gwpy.table.EventTable`
+        a time-sorted chunk of events, chunks are yielded in time order
+        for a time-ordered cache of non-overlapping files
+    """
+    cache, read_kwargs = _prepare_read(
+        channel, etg, segments, cache, trigfind_kwargs, read_kwargs)
+    tables = _read_segments(cache, segments, read_kwargs, snr=snr,
+                            frange=frange, nproc=nproc)
+    tables = (_sort_table(table) for table in tables)
+    if chunksize:
+        tables = _rechunk(tables, chunksize)
+    for table in tables:
+        table = expand_table(table)
+        if not raw:
+            _format_table(table, channel)
+        yield table
+
+
+def _read_trigger_cache(tcache, key, segments, snr=None, frange=None):
+    """Read the events for a channel from a `TriggerCache`, if possible
+    """
+    path = tcache.find(key, segments, snr=snr, frange=frange)
+    if path is None:
+        return None
+    try:
+        return read_npy_triggers(path, segments=segments, snr=snr,
+                                 frange=frange)
+    except (OSError, ValueError):  # removed by another process
+        return None
+
+
+def get_triggers(channel, etg, segments, cache=None, snr=None, frange=None,
+                 raw=False, extra_times=None, nproc=1, trigfind_kwargs={},
+                 trigger_cache=None, compact=False, **read_kwargs):
+    """Get triggers for the given channel
+
+    Files are read (in order) using a pool of ``nproc`` threads.
+
+    If ``compact=True`` the events are returned as a compact table (see
+    `compact_table`), otherwise any compact events read (e.g. from an
+    event store written with ``hveto-cache-events --compact``) are
+    returned with times in seconds (see `expand_table`).
+
+    If a ``trigger_cache`` (a `~hveto.triggercache.TriggerCache`, or the
+    path of its directory) is given, the events are read from the cache
+    if an earlier read of this channel, with the same trigger generator,
+    options and (unchanged) trigger files, covered the ``segments`` with
+    cuts no stricter than ``snr`` and ``frange``, otherwise the events read
+    are added to the cache, for the segments covered by the files.
+    """
+    # copy the options, which are updated with the defaults for each read
+    trigfind_kwargs = dict(trigfind_kwargs or {})
+    tcache = get_trigger_cache(trigger_cache)
+    if tcache is not None:
+        options = {"trigfind": dict(trigfind_kwargs),
+                   "read": dict(read_kwargs)}
+    cache, read_kwargs = _prepare_read(
+        channel, etg, segments, cache, trigfind_kwargs, read_kwargs)
+
+    table = None
+    if tcache is not None:
+        key = tcache.key(channel, _sanitize_name(etg),
+                         files=file_digest(cache), **options)
+        table = _read_trigger_cache(tcache, key, segments, snr=snr,
+                                    frange=frange)
+
+    if table is None:
+        # read files, applying cuts to each file as it is read, so that
+        # only the surviving rows are concatenated (once) at the end
+        tables = list(_read_segments(cache, segments, read_kwargs, snr=snr,
+                                     frange=frange, nproc=nproc))
+        if len(tables) > 1:
+            table = _vstack(tables)
+        elif tables:
+            table = tables[0]
+        else:
+            table = EventTable(names=read_kwargs.get(
+                'columns', ['time', 'frequency', 'snr']))
+
+        if tcache is not None:
+            # only record the segments for which there are files, so that
+            # a later read is not served an incomplete set of events
+            covered = SegmentList(segments).coalesce()
+            covered &= io_cache.cache_segments(cache)
+            try:
+                tcache.store(key, lambda path: write_npy_triggers(
+                    path, table, covered), covered, snr=snr, frange=frange)
+            except (OSError, sqlite3.Error) as exc:
+                warnings.warn("failed to cache events for {}: {}".format(
+                    channel, exc))
+
+    table = _convert_table(table, compact=compact)
 
     # parse time, frequency-like and snr-like column names
     columns = table.dtype.names
-    tcolumn = columns[0]
     fcolumn = columns[1]
     scolumn = columns[2]
 
-    # filter
-    keep = numpy.ones(len(table), dtype=bool)
-    if snr is not None:
-        keep &= table[scolumn] >= snr
-    if frange is not None:
-        keep &= table[fcolumn] >= frange[0]
-        keep &= table[fcolumn] < frange[1]
-    table = table[keep]
-
     if extra_times:
+        table.meta.pop(SNR_ORDER, None)
         f_low = min(table[fcolumn])
         s_low = min(table[scolumn])
         for time in extra_times:
-            extra_row = numpy.zeros(len(table.colnames))
-            extra_row[0] = time
+            extra_row = [0.] * len(table.colnames)
+            extra_row[0] = gps_to_ns(time) if compact else time
             extra_row[1] = f_low
             extra_row[2] = s_low
             table.add_row(extra_row)
@@ -367,13 +1495,136 @@ def get_triggers(channel, etg, segments, cache=None, snr=None, frange=None,
     if raw:
         return table
 
-    # rename time column so that all tables match in at least that
-    if tcolumn != "time":
-        table.rename_column(tcolumn, 'time')
+    # rename time column so that all tables match in at least that,
+    # and add channel column to identify all triggers
+    _format_table(table, channel)
 
-    # add channel column to identify all triggers
-    table.add_column(table.Column(data=numpy.repeat(channel, len(table)),
-                                  name='channel'))
+    return _sort_table(table)
 
-    table.sort('time')
-    return table
+
+def get_multichannel_triggers(channels, etg, segments, cache=None, snr=None,
+                              frange=None, raw=False, nproc=1,
+                              trigfind_kwargs=None, trigger_cache=None,
+                              compact=False, **read_kwargs):
+    """Get triggers for many channels that share the same files
+
+    Each SNAX file, or consolidated event store (see
+    `read_event_store_triggers`), is opened and read once, with its rows
+    split into a table for each channel, rather than once per channel as
+    with `get_triggers`.
+    Formats that do not store many channels per file are read with
+    `get_triggers` for each channel in turn.
+
+    Parameters
+    ----------
+    channels : `list` of `str`
+        the names of the channels to read
+
+    etg : `str`
+        name of event trigger generator
+
+    segments : :class:`~ligo.segments.segmentlist`
+        list of segments to read
+
+    cache : `list` of `str`, optional
+        cache of trigger file paths, default: discover with
+        `find_trigger_files` for each channel
+
+    snr : `float`, optional
+        minimum SNR for events to keep
+
+    frange : `tuple` of `float`, optional
+        ``[low, high)`` frequency range for events to keep
+
+    raw : `bool`, optional
+        if `True`, return tables as read, without renaming the time
+        column or adding a ``'channel'`` column, default: `False`
+
+    nproc : `int`, optional
+        the number of threads with which to read files, default: ``1``
+
+    trigfind_kwargs : `dict`, optional
+        keyword arguments to pass to `find_trigger_files`
+
+    trigger_cache : `~hveto.triggercache.TriggerCache`, optional
+        a cache of the events read for each channel, used (as with
+        `get_triggers`) for channels that are read one at a time
+
+    compact : `bool`, optional
+        if `True`, return compact tables (see `compact_table`),
+        default: `False`
+
+    **read_kwargs
+        all other keyword arguments are passed to the reader
+
+    Returns
+    -------
+    tables : `dict` of `~gwpy.table.EventTable`
+        the table of events for each channel, in the order given
+    """
+    channels = list(channels)
+    trigfind_kwargs = trigfind_kwargs or {}
+
+    def _read_each(caches):
+        return dict((c, get_triggers(
+            c, etg, segments, cache=caches.get(c), snr=snr, frange=frange,
+            raw=raw, nproc=nproc, trigfind_kwargs=dict(trigfind_kwargs),
+            trigger_cache=trigger_cache, compact=compact, **read_kwargs))
+            for c in channels)
+
+    # files named for each channel (e.g. written by hveto-cache-events)
+    # hold a single channel, so are read channel by channel
+    if cache is not None:
+        if not isinstance(cache, CacheCatalog):
+            cache = CacheCatalog(cache)
+        caches = dict((c, cache.files(c)) for c in channels)
+        if any(caches.values()):
+            return _read_each(caches)
+    if not read_kwargs.get("format") and cache and _is_event_store(cache[0]):
+        read_kwargs["format"] = "hdf5.hveto"
+    elif not read_kwargs.get("format") and _sanitize_name(etg) == "snax":
+        read_kwargs["format"] = DEFAULT_FORMAT["snax"]
+    if read_kwargs.get("format") == "hdf5.hveto" and cache is not None:
+        reader = _read_store_channels
+    elif read_kwargs.get("format") == "hdf5.snax":
+        reader = _read_snax_channels
+    else:
+        return _read_each(dict.fromkeys(channels, cache))
+
+    if cache is None:
+        cache = list(OrderedDict.fromkeys(
+            e for c in channels for e in find_trigger_files(
+                c, etg, segments, **dict(trigfind_kwargs))))
+    kwargs = dict(read_kwargs, channels=channels)
+    cache, kwargs = _prepare_read(
+        channels[0], etg, segments, cache, dict(trigfind_kwargs), kwargs)
+    if reader is _read_snax_channels and not _use_hdf5_reader(kwargs):
+        return _read_each(dict.fromkeys(channels, cache))
+
+    def _read(args):
+        trig_file, crop = args
+        return reader(trig_file, channels, columns=kwargs.get("columns"),
+                      segments=crop, snr=snr, frange=frange)
+
+    tables = dict((c, []) for c in channels)
+    for new in _imap_ordered(_read, _file_crops(cache, segments),
+                             nproc=nproc):
+        for channel, table in new.items():
+            if len(table):
+                tables[channel].append(table)
+
+    out = {}
+    for channel, chunks in tables.items():
+        if len(chunks) > 1:
+            table = _vstack(chunks)
+        elif chunks:
+            table = chunks[0]
+        else:
+            table = EventTable(names=kwargs.get(
+                'columns', ['time', 'frequency', 'snr']))
+        table = _convert_table(table, compact=compact)
+        if not raw:
+            _format_table(table, channel)
+            table = _sort_table(table)
+        out[channel] = table
+    return out